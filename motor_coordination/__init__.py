@@ -0,0 +1,39 @@
+##
+## __init__.py
+## Mouse Motor Coordination
+##
+## Library package of the treadmill motor coordination pipeline
+## Public functions are imported from their submodule on first use, so importing the package
+## or one light submodule does not load Pandas, SciPy, h5py or Matplotlib
+##
+
+import importlib
+
+## Public functions and the submodule defining each
+EXPORTS = {
+    'analyze'         : 'steplength_analysis',
+    'stream_analyze'  : 'steplength_analysis',
+    'estimate_corners': 'box_corners',
+    'load_pose'       : 'deeplabcut_loader',
+    'metrics'         : 'mouse_coordination_metrics',
+    'process_session' : 'mouse_coordination_metrics',
+    'batch_metrics'   : 'mouse_coordination_metrics',
+    'reanalyze'       : 'mouse_coordination_metrics',
+    'paw_stability'   : 'mouse_coordination_score',
+    'paw_stabilities' : 'mouse_coordination_score',
+    'score_sessions'  : 'mouse_coordination_score',
+    'bootstrap_scores': 'mouse_coordination_score',
+    'score_stream'    : 'online_metrics',
+    'read_log'        : 'treadmill_log',
+    'frame_index'     : 'treadmill_log',
+    'read_manifest'   : 'manifest',
+    'write_manifest'  : 'manifest',
+}
+
+__all__ = list(EXPORTS)
+
+## Import a public function from its submodule when it is first accessed
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+    return getattr(importlib.import_module('.' + EXPORTS[name], __name__), name)
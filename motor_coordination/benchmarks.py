@@ -0,0 +1,329 @@
+##
+## benchmarks.py
+## Mouse Motor Coordination
+##
+## Benchmark suite for the analysis pipeline on synthetic cohorts
+## Reports throughput and peak memory of every stage as cohorts and recordings grow,
+## and checks each stage against a reference implementation of the original loops
+##
+
+import argparse
+import contextlib
+import glob
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy import stats
+from .deeplabcut_loader import SIDECAR_SUFFIX, load_columns, load_pose
+from .synthetic_sessions import PAWS, make_cohort
+
+## Stages that can be benchmarked
+STAGES = ['metrics', 'process_session', 'lowess', 'paw_stability', 'scoring']
+
+## Compute metrics of one session with the original per-part loops of metrics()
+## Section indexes are int64 here, the original int16 indexes overflow after 32767 frames
+## Arguments
+## time       : (frames,) time column in seconds
+## positions  : (frames, 5, 2) X/Y positions of head, LFP, RFP, LHP, RHP
+## steplengths: (frames, 4) step lengths of LFP, RFP, LHP, RHP
+## box_corners: left/right/top/bottom box edges
+## reverse    : Boolean flag to indicate mouse running in reverse
+## Returns (speeds, 6) metrics matrix
+def reference_metrics(time, positions, steplengths, box_corners, reverse):
+    extracted_data = [np.column_stack((positions[:, 0], time))]
+    for paw in range(4):
+        extracted_data.append(np.column_stack((positions[:, paw + 1], steplengths[:, paw], time)))
+
+    ## Remove outliers and normalize each body part's X/Y data
+    for i in range(len(extracted_data)):
+        part = extracted_data[i]
+        part = part[(part[:, 0] >= box_corners[0]) & (part[:, 0] <= box_corners[1]) & (part[:, 1] >= box_corners[2]) & (part[:, 1] <= box_corners[3])]
+        part[:, 0] = (part[:, 0] - box_corners[0]) / (box_corners[1] - box_corners[0])
+        part[:, 1] = (part[:, 1] - box_corners[2]) / (box_corners[3] - box_corners[2])
+        if reverse:
+            part[:, :2] = 1 - part[:, :2]
+        extracted_data[i] = part
+
+    sections       = np.array([30.0, 90.0, 150.0, 210.0, 270.0, 330.0])
+    quadrant_locs  = np.array([0.0, 0.2, 0.4, 0.6, 0.8, 1])
+    quadrants      = np.array([1, 2, 3, 4, 5])
+    quadrant_probs = np.zeros((5, 5))
+    allmetrics     = np.zeros((5, 6))
+    for i in range(len(extracted_data)):
+        indexes = np.zeros(len(sections), dtype = np.int64)
+        for j in range(len(sections)):
+            indexes[j] = np.abs(extracted_data[i][:, -1] - sections[j]).argmin()
+        for k in range(len(indexes) - 1):
+            section = extracted_data[i][indexes[k]:indexes[k + 1]]
+            if i == 0:
+                for m in range(quadrants.shape[0] - 1):
+                    quadrant_probs[k, m] = np.count_nonzero((section[:, 0] >= quadrant_locs[m]) & (section[:, 0] < quadrant_locs[m + 1]))
+                quadrant_probs[k] /= section[:, 0].shape[0]
+                allmetrics[k, 0] = np.average(quadrants, weights = quadrant_probs[k])
+                allmetrics[k, 1] = np.std(section[:, 1])
+            else:
+                allmetrics[k, i + 1] = np.mean(section[:, 2])
+    return allmetrics
+
+## Compute coordination scores with the original per-session loops of mouse_coordination_score.main()
+## Arguments
+## cohort   : (6, speeds, sessions) array of cohort metrics
+## sessions : (N, speeds, 6) array of metrics of sessions to score
+## positions: list of N (mouse, day) indexes
+## n_mice   : number of mice
+## Returns (n_mice, speeds, 12) array of coordination scores
+def reference_scores(cohort, sessions, positions, n_mice):
+    from .mouse_coordination_score import paw_stability
+
+    coordination_weights = np.array([40.0, 40.0, 5.0, 5.0, 5.0, 5.0])
+    raw_scores = np.zeros((n_mice, 5, 12))
+    for data, (index1, index2) in zip(sessions, positions):
+        intermediate_scores = np.zeros((5, 6))
+        for i in range(5):
+            intermediate_scores[i, 0] = 100 - stats.percentileofscore(cohort[0, i], data[i, 0])
+            intermediate_scores[i, 1] = 100 - stats.percentileofscore(cohort[1, i], data[i, 1])
+            for paw in range(2, 6):
+                intermediate_scores[i, paw] = paw_stability(cohort[paw, i], data[i, paw])
+        raw_scores[index1, :, index2] = np.average(intermediate_scores, axis = 1, weights = coordination_weights)
+
+    raw_scores_merged = raw_scores.flatten()
+    scores = np.zeros(raw_scores.shape)
+    for index in np.ndindex(raw_scores.shape):
+        percentile    = stats.percentileofscore(raw_scores_merged, raw_scores[index])
+        scores[index] = int(percentile / 20) + 1 if percentile < 100 else 5
+    return scores
+
+## Time a function and optionally measure its peak traced memory in a second call
+## Arguments
+## function: callable without arguments
+## setup   : callable run before every call, e.g. to clear caches, None for no setup
+## memory  : Boolean flag to measure peak memory
+## Returns result of the timed call, seconds and peak memory in bytes (NaN when not measured)
+def measure(function, setup = None, memory = True):
+    if setup is not None:
+        setup()
+    start   = time.perf_counter()
+    result  = function()
+    seconds = time.perf_counter() - start
+
+    peak = np.nan
+    if memory:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+## Remove binary sidecars so the next run parses source files again
+## Arguments
+## directory: cohort folder
+def clear_sidecars(directory):
+    for path in glob.glob(os.path.join(directory, '**', '*' + SIDECAR_SUFFIX), recursive = True):
+        os.remove(path)
+
+## Load inputs of reference_metrics() for one database entry
+## Arguments
+## file, raw_file: analyzed CSV and DeepLabCut export
+## Returns time in seconds from the frame index, positions and steplengths arrays
+def session_arrays(file, raw_file):
+    from .mouse_coordination_metrics import FRAME_RATE
+
+    data        = load_columns(file, [paw + column for paw in PAWS for column in ['_x', '_y', '_steplength']])
+    head        = load_pose(raw_file, ['head'])
+    time        = np.arange(len(data)) / FRAME_RATE
+    positions   = np.stack([head[['head_x', 'head_y']].to_numpy()] + [data[[paw + '_x', paw + '_y']].to_numpy() for paw in PAWS], axis = 1)
+    steplengths = data[[paw + '_steplength' for paw in PAWS]].to_numpy()
+    return time, positions.astype(np.float64), steplengths.astype(np.float64)
+
+## Make one benchmark result row
+def result_row(stage, variant, sessions, frames, seconds, peak, error):
+    return {'stage': stage, 'variant': variant, 'sessions': sessions, 'frames': frames, 'seconds': seconds,
+            'frames/s': frames / seconds if frames else np.nan, 'sessions/s': sessions / seconds,
+            'peak MiB': peak / 2 ** 20, 'max error': error}
+
+## Benchmark metrics() and process_session() on a synthetic cohort on disk
+## Arguments
+## directory: cohort folder, also the working directory while benchmarking
+## database : database dictionary from make_cohort()
+## stages   : list of stages to run
+## memory   : Boolean flag to measure peak memory
+## reference: Boolean flag to compare against reference_metrics()
+## Returns list of result rows
+def benchmark_sessions(directory, database, stages, memory = True, reference = True):
+    from . import mouse_coordination_metrics
+
+    rows    = []
+    entries = [args for days in database.values() for args in days.values()]
+    frames  = 0
+    cwd     = os.getcwd()
+    os.chdir(directory)
+    try:
+        ## Box edges from corner tracks, as used by metrics() without given corners
+        boxes = {}
+        for file, raw_file, _, _ in entries:
+            frames         += len(load_columns(file, ['time']))
+            box_coordinates = mouse_coordination_metrics.resolve_corners(None, load_pose(raw_file, mouse_coordination_metrics.CORNER_PARTS))
+            boxes[raw_file] = mouse_coordination_metrics.box_edges(*box_coordinates)
+
+        ## Golden reference from original loops
+        expected = None
+        if reference and ('metrics' in stages or 'process_session' in stages):
+            def run_reference():
+                return [reference_metrics(*session_arrays(file, raw_file), boxes[raw_file], reverse) for file, raw_file, _, reverse in entries]
+            expected, seconds, peak = measure(run_reference, memory = memory)
+            rows.append(result_row('metrics', 'reference', len(entries), frames, seconds, peak, 0.0))
+
+        if 'metrics' in stages:
+            def run_metrics():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return [mouse_coordination_metrics.metrics(*args[:4])[0] for args in entries]
+            for variant, setup in [('cold', lambda: clear_sidecars('.')), ('warm', None)]:
+                results, seconds, peak = measure(run_metrics, setup, memory)
+                error = np.nan if expected is None else np.nanmax(np.abs(np.array(results) - np.array(expected)))
+                rows.append(result_row('metrics', variant, len(entries), frames, seconds, peak, error))
+
+        if 'process_session' in stages:
+            def run_process():
+                return [mouse_coordination_metrics.process_session(raw_file, None, reverse)[0] for _, raw_file, _, reverse in entries]
+            for variant, setup in [('cold', lambda: clear_sidecars('.')), ('warm', None)]:
+                results, seconds, peak = measure(run_process, setup, memory)
+                error = np.nan if expected is None else np.nanmax(np.abs(np.array(results) - np.array(expected)))
+                rows.append(result_row('process_session', variant, len(entries), frames, seconds, peak, error))
+    finally:
+        os.chdir(cwd)
+    return rows
+
+## Benchmark batched LOWESS smoothing of the eight step length signals of one session
+## Arguments
+## frames   : number of frames
+## memory   : Boolean flag to measure peak memory
+## reference: Boolean flag to run the eight statsmodels lowess() calls as reference
+## Returns list of result rows
+def benchmark_lowess(frames, memory = True, reference = True):
+    from .smoothing import smooth
+    from .steplength_analysis import rolling_variance
+
+    rng     = np.random.default_rng(frames)
+    time    = np.arange(frames) + 2.0
+    signals = rng.exponential(3.0, (frames, 4)) + 10 + 5 * np.sin(time / 3000)[:, None]
+    signals[0] = np.nan
+    signals = np.hstack((signals, np.column_stack([rolling_variance(column) for column in signals.T])))
+
+    rows = []
+    smoothed, seconds, peak = measure(lambda: smooth(time, signals, frac = 0.1), memory = memory)
+    error = np.nan
+    if reference:
+        from statsmodels.nonparametric.smoothers_lowess import lowess
+        def run_reference():
+            return np.column_stack([lowess(column, time, frac = 0.1, missing = 'drop', return_sorted = False) for column in signals.T])
+        expected, reference_seconds, reference_peak = measure(run_reference, memory = memory)
+        error = np.nanmax(np.abs(smoothed - expected))
+        rows.append(result_row('lowess', 'reference', 1, frames, reference_seconds, reference_peak, 0.0))
+    rows.append(result_row('lowess', 'batched', 1, frames, seconds, peak, error))
+    return rows
+
+## Simulate cohort metrics for scoring benchmarks
+## Arguments
+## mice: number of mice, each with 12 days
+## seed: random seed
+## Returns (6, 5, sessions) cohort, (sessions, 5, 6) session metrics and (mouse, day) positions
+def simulate_metrics(mice, seed = 0):
+    rng       = np.random.default_rng(seed)
+    positions = [(mouse, day) for mouse in range(mice) for day in range(12)]
+    sessions  = np.empty((len(positions), 5, 6))
+    sessions[:, :, 0] = rng.uniform(1.0, 4.0, (len(positions), 5))
+    sessions[:, :, 1] = rng.uniform(0.05, 0.3, (len(positions), 5))
+    sessions[:, :, 2:] = rng.normal(20.0, 5.0, (len(positions), 5, 4))
+    return sessions.transpose(2, 1, 0).copy(), sessions, positions
+
+## Benchmark paw stability and cohort scoring
+## Arguments
+## mice     : number of mice, each with 12 days
+## stages   : list of stages to run
+## memory   : Boolean flag to measure peak memory
+## reference: Boolean flag to run the original loops as reference
+## Returns list of result rows
+def benchmark_scoring(mice, stages, memory = True, reference = True):
+    from .mouse_coordination_score import paw_stabilities, paw_stability, score_sessions
+
+    cohort, sessions, positions = simulate_metrics(mice)
+    rows = []
+    if 'paw_stability' in stages:
+        values = sessions[:, 0, 2]
+        result, seconds, peak = measure(lambda: paw_stabilities(cohort[2, 0], values), memory = memory)
+        error = np.nan
+        if reference:
+            expected, reference_seconds, reference_peak = measure(lambda: np.array([paw_stability(cohort[2, 0], value) for value in values]), memory = memory)
+            error = np.nanmax(np.abs(result - expected))
+            rows.append(result_row('paw_stability', 'reference', len(values), 0, reference_seconds, reference_peak, 0.0))
+        rows.append(result_row('paw_stability', 'sorted', len(values), 0, seconds, peak, error))
+
+    if 'scoring' in stages:
+        result, seconds, peak = measure(lambda: score_sessions(cohort, sessions, positions, mice), memory = memory)
+        error = np.nan
+        if reference:
+            expected, reference_seconds, reference_peak = measure(lambda: reference_scores(cohort, sessions, positions, mice), memory = memory)
+            error = np.nanmax(np.abs(result - expected))
+            rows.append(result_row('scoring', 'reference', len(positions), 0, reference_seconds, reference_peak, 0.0))
+        rows.append(result_row('scoring', 'sorted', len(positions), 0, seconds, peak, error))
+    return rows
+
+## Run benchmarks over growing cohorts and recordings and print a table of results
+## Arguments
+## mice          : list of numbers of mice of synthetic cohorts for session stages
+## days          : number of days per mouse of synthetic cohorts
+## frames        : list of numbers of frames per session
+## score_mice    : list of numbers of mice for scoring stages
+## stages        : list of stages to run
+## directory     : folder for synthetic cohorts, a temporary folder if None
+## memory        : Boolean flag to measure peak memory
+## reference     : Boolean flag to compare against reference implementations
+## reference_frames: longest recording smoothed by the slow statsmodels reference
+## fmt           : 'csv' or 'h5' format of synthetic DeepLabCut exports
+## Returns Pandas frame of results
+def run_benchmarks(mice = (2, 4), days = 3, frames = (10800, 21600), score_mice = (10, 100), stages = STAGES,
+                   directory = None, memory = True, reference = True, reference_frames = 20000, fmt = 'csv'):
+    rows = []
+    with contextlib.ExitStack() as stack:
+        if directory is None:
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+        for n_frames in frames:
+            if 'metrics' in stages or 'process_session' in stages:
+                for n_mice in mice:
+                    cohort   = os.path.join(directory, 'cohort-{mice}-{frames}'.format(mice = n_mice, frames = n_frames))
+                    database = make_cohort(cohort, n_mice, days, n_frames, fmt = fmt)
+                    rows    += benchmark_sessions(cohort, database, stages, memory, reference)
+            if 'lowess' in stages:
+                rows += benchmark_lowess(n_frames, memory, reference and n_frames <= reference_frames)
+        for n_mice in score_mice:
+            if 'paw_stability' in stages or 'scoring' in stages:
+                rows += benchmark_scoring(n_mice, stages, memory, reference)
+
+    results = pd.DataFrame(rows, columns = ['stage', 'variant', 'sessions', 'frames', 'seconds', 'frames/s', 'sessions/s', 'peak MiB', 'max error'])
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(results.to_string(index = False, float_format = lambda value: '{value:.4g}'.format(value = value)))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the analysis pipeline on synthetic cohorts')
+    parser.add_argument('--mice', type = int, nargs = '+', default = [2, 4], help = 'numbers of mice of synthetic cohorts')
+    parser.add_argument('--days', type = int, default = 3, help = 'number of days per mouse')
+    parser.add_argument('--frames', type = int, nargs = '+', default = [10800, 21600], help = 'numbers of frames per session')
+    parser.add_argument('--score-mice', type = int, nargs = '+', default = [10, 100], help = 'numbers of mice for scoring stages')
+    parser.add_argument('--stages', nargs = '+', default = STAGES, choices = STAGES, help = 'stages to benchmark')
+    parser.add_argument('--directory', default = None, help = 'folder to keep synthetic cohorts in')
+    parser.add_argument('--format', default = 'csv', choices = ['csv', 'h5'], help = 'format of synthetic DeepLabCut exports')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip peak memory measurement')
+    parser.add_argument('--no-reference', action = 'store_true', help = 'skip reference implementations')
+    parser.add_argument('--output', default = None, help = 'CSV file to write results to')
+    args = parser.parse_args()
+    results = run_benchmarks(args.mice, args.days, args.frames, args.score_mice, args.stages, args.directory,
+                             not args.no_memory, not args.no_reference, fmt = args.format)
+    if args.output is not None:
+        results.to_csv(args.output, index = False)
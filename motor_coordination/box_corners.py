@@ -0,0 +1,92 @@
+##
+## box_corners.py
+## Mouse Motor Coordination
+##
+## Headless estimation of treadmill box corners from DeepLabCut corner tracks
+## Replaces clicking corners on an image for batch runs
+##
+
+import numpy as np
+from .deeplabcut_loader import load_pose
+
+## Box corner body parts labeled in DeepLabCut, in order of box coordinates stored in hdf5 file
+CORNER_PARTS = ['bottomleft', 'topleft', 'topright', 'bottomright']
+
+## Frames with a corner likelihood below this value are ignored
+MIN_LIKELIHOOD = 0.9
+
+## Minimum fraction of confident frames needed to estimate a corner from its track
+MIN_FRACTION = 0.1
+
+## Number of consecutive blocks of frames compared to measure corner drift
+DRIFT_BLOCKS = 10
+
+## Corner drift in pixels above which a session should be reviewed manually
+DRIFT_TOLERANCE = 5.0
+
+## Compute weighted median of each column
+## Arguments
+## values : (frames, columns) array
+## weights: (frames, columns) non-negative weights, zero for ignored values
+## Returns (columns,) array of weighted medians, NaN for columns without any weight
+def weighted_median(values, weights):
+    order   = np.argsort(values, axis = 0)
+    values  = np.take_along_axis(values, order, axis = 0)
+    weights = np.take_along_axis(weights, order, axis = 0)
+    total   = np.cumsum(weights, axis = 0)
+    if len(values) == 0:
+        return np.full(values.shape[1], np.nan)
+
+    ## First value at which cumulative weight reaches half of the total weight
+    half   = total[-1] / 2
+    median = values[np.argmax(total >= half, axis = 0), np.arange(values.shape[1])]
+    return np.where(total[-1] > 0, median, np.nan)
+
+## Load box corner tracks of a DeepLabCut export
+## Arguments
+## raw_file: original CSV or H5 file from DeepLabCut with box corner tracks
+## Returns (frames, 4, 2) array of X/Y positions and (frames, 4) array of likelihoods
+def corner_tracks(raw_file):
+    raw_data   = load_pose(raw_file, CORNER_PARTS, coords = ('x', 'y', 'likelihood'))
+    positions  = np.stack([raw_data[[part + '_x', part + '_y']].to_numpy(dtype = np.float64) for part in CORNER_PARTS], axis = 1)
+    likelihood = raw_data[[part + '_likelihood' for part in CORNER_PARTS]].to_numpy(dtype = np.float64)
+    return positions, likelihood
+
+## Estimate box corners without user input
+## Each corner is the likelihood-weighted median of its confident frames
+## Corners that are rarely tracked with confidence are taken from the fallback of the rig instead
+## Arguments
+## raw_file      : original CSV or H5 file from DeepLabCut with box corner tracks
+## fallback      : (4, 2) or (4, 1, 2) corners of the rig the session was recorded on, None if unknown
+## min_likelihood: frames with a lower corner likelihood are ignored
+## min_fraction  : minimum fraction of confident frames to trust a corner track
+## blocks        : number of consecutive blocks of frames compared to measure drift
+## Returns (4, 1, 2) array of bottom left, top left, top right and bottom right corners like pick_corners(),
+## and (4,) array of drift of each corner, the largest distance in pixels between a block median and the session median
+def estimate_corners(raw_file, fallback = None, min_likelihood = MIN_LIKELIHOOD, min_fraction = MIN_FRACTION, blocks = DRIFT_BLOCKS):
+    positions, likelihood = corner_tracks(raw_file)
+    frames  = len(positions)
+    weights = np.where(np.isfinite(positions).all(axis = 2) & (likelihood >= min_likelihood), likelihood, 0.0)
+
+    ## Weighted median of X and Y of every corner, as (frames, 8) columns
+    values  = np.nan_to_num(positions.reshape(frames, 8))
+    columns = np.repeat(weights, 2, axis = 1)
+    corners = weighted_median(values, columns).reshape(4, 2)
+
+    ## Replace corners without enough confident frames by rig fallback
+    tracked = np.count_nonzero(weights, axis = 0) >= max(min_fraction * frames, 1)
+    if not tracked.all():
+        if fallback is None:
+            missing = [part for part, found in zip(CORNER_PARTS, tracked) if not found]
+            raise ValueError('Box corners {missing} of {path} are not tracked and there is no rig fallback'.format(missing = missing, path = raw_file))
+        fallback = np.asarray(fallback, dtype = np.float64).reshape(4, 2)
+        corners[~tracked] = fallback[~tracked]
+
+    ## Drift of block medians from session median
+    drift = np.zeros(4)
+    for block in np.array_split(np.arange(frames), blocks):
+        block_corners = weighted_median(values[block], columns[block]).reshape(4, 2)
+        distance      = np.hypot(*(block_corners - corners).T)
+        drift         = np.fmax(drift, np.where(tracked, distance, 0.0))
+
+    return corners[:, None], drift
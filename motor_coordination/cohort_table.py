@@ -0,0 +1,204 @@
+##
+## cohort_table.py
+## Mouse Motor Coordination
+##
+## Long-format cohort metrics table with out-of-core scoring
+## The table holds one (day, speed, metric, value) row per metric of every session,
+## stored as Parquet files in one mouse=<mouse> folder per mouse. Scoring streams the
+## files with columnar group-by operations, so mice may have any number of days and
+## only the sorted reference distributions and weighted average scores are kept in memory
+##
+
+import argparse
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import h5py
+
+from .metrics_store import CHUNK_SESSIONS, METRIC_NAMES
+from .mouse_coordination_metrics import SPEED_NAMES
+from .mouse_coordination_score import COORDINATION_WEIGHTS, coordination_bins, ranked_percentiles, ranked_stabilities
+
+## Folders of the metrics table and of the weighted average scores, next to mice_metrics.hdf5
+TABLE_DIRECTORY = 'mice_metrics_table'
+SCORES_DIRECTORY = 'mice_scores_table'
+
+## Metrics scored by percentile, the others are scored by paw stability
+PERCENTILE_METRICS = METRIC_NAMES[:2]
+
+## Open a table folder as dataset with the mouse column taken from the folder names
+## The mouse column is read as string, so numeric mouse names such as 01 keep their leading zeros
+def open_table(directory):
+    partitioning = ds.partitioning(pa.schema([('mouse', pa.string())]), flavor = 'hive')
+    return ds.dataset(directory, format = 'parquet', partitioning = partitioning)
+
+## Get names of the mice in a table folder
+def table_mice(directory):
+    return sorted(name[len('mouse='):] for name in os.listdir(directory) if name.startswith('mouse='))
+
+## Export the cohort metrics store into a long-format table, replacing an earlier export
+## Sessions are read in chunks of the store and every chunk is written as one file per mouse,
+## so all metrics of a session are always in the same file
+## Arguments
+## mice_metrics: open h5py file with the store of metrics_store.py
+## directory   : folder to write the table to
+def export_table(mice_metrics, directory = TABLE_DIRECTORY):
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    index = mice_metrics['index'].asstr()[...]
+    for start in range(0, len(index), CHUNK_SESSIONS):
+        keys   = index[start:start + CHUNK_SESSIONS]
+        values = np.stack([mice_metrics[name][:, start:start + CHUNK_SESSIONS] for name in METRIC_NAMES])
+        for mouse in np.unique(keys[:, 0]):
+            ## Rows are ordered by session, speed and metric
+            columns = np.flatnonzero(keys[:, 0] == mouse)
+            session, speed, metric = np.meshgrid(columns, np.arange(values.shape[1]), np.arange(len(METRIC_NAMES)), indexing = 'ij')
+            table = pa.table({'day'   : keys[session.ravel(), 1],
+                              'speed' : np.array(SPEED_NAMES)[speed.ravel()],
+                              'metric': np.array(METRIC_NAMES)[metric.ravel()],
+                              'value' : values[metric.ravel(), speed.ravel(), session.ravel()]})
+            os.makedirs(os.path.join(directory, 'mouse=' + mouse), exist_ok = True)
+            pq.write_table(table, os.path.join(directory, 'mouse=' + mouse, 'part-{start}.parquet'.format(start = start)))
+
+## Collect the reference distribution of every speed and metric of the cohort
+## Only the speed, metric and value columns are read, one record batch at a time
+## Arguments
+## directory: folder of the metrics table
+## Returns dictionary of (speed, metric) to sorted values with NaN last, number of non-NaN values and median
+def table_references(directory = TABLE_DIRECTORY):
+    groups = {}
+    for batch in open_table(directory).to_batches(columns = ['speed', 'metric', 'value']):
+        frame = batch.to_pandas()
+        for key, values in frame.groupby(['speed', 'metric'], sort = False)['value']:
+            groups.setdefault(key, []).append(values.to_numpy())
+
+    references = {}
+    for key, parts in groups.items():
+        ranked = np.sort(np.concatenate(parts))
+        references[key] = (ranked, np.count_nonzero(~np.isnan(ranked)), np.median(ranked))
+    return references
+
+## Compute weighted average scores of the sessions in one long-format frame
+## Percentiles and paw stabilities are computed per (speed, metric) group against the cohort references
+## Arguments
+## frame     : long-format rows with day, speed, metric and value columns
+## references: dictionary from table_references()
+## Returns frame with day, speed and raw score columns, NaN if a session lacks a metric
+def raw_scores(frame, references):
+    values = frame['value'].to_numpy()
+    scores = np.empty(len(values))
+    for (speed, metric), rows in frame.groupby(['speed', 'metric'], sort = False).indices.items():
+        ranked, valid, median = references[(speed, metric)]
+        if metric in PERCENTILE_METRICS:
+            ## 100 - percentile is used because smaller expectation and SD are better
+            scores[rows] = 100 - ranked_percentiles(ranked, values[rows])
+        else:
+            scores[rows] = ranked_stabilities(ranked[:valid], median, values[rows])
+
+    ## Weighted average over the metrics of each session and speed
+    weighted = frame[['day', 'speed', 'metric']].assign(score = scores)
+    weighted = weighted.pivot(index = ['day', 'speed'], columns = 'metric', values = 'score').reindex(columns = METRIC_NAMES)
+    raw      = np.average(weighted.to_numpy(), axis = 1, weights = COORDINATION_WEIGHTS)
+    return weighted.index.to_frame(index = False).assign(raw = raw)
+
+## Compute weighted average scores of every session in the table, one file at a time
+## Arguments
+## directory: folder of the metrics table
+## output   : folder to write the weighted average scores to, in the same layout
+def score_table(directory = TABLE_DIRECTORY, output = SCORES_DIRECTORY):
+    references = table_references(directory)
+    if os.path.isdir(output):
+        shutil.rmtree(output)
+    for fragment in open_table(directory).get_fragments():
+        mouse  = ds.get_partition_keys(fragment.partition_expression)['mouse']
+        scores = raw_scores(fragment.to_table(columns = ['day', 'speed', 'metric', 'value']).to_pandas(), references)
+        os.makedirs(os.path.join(output, 'mouse=' + mouse), exist_ok = True)
+        pq.write_table(pa.Table.from_pandas(scores, preserve_index = False),
+                       os.path.join(output, 'mouse=' + mouse, os.path.basename(fragment.path)))
+
+## Get the sorted weighted average scores of all sessions, the reference of the coordination scores
+## Unlike score_sessions(), missing days are not padded with zero scores
+## output: folder of the weighted average scores
+def ranked_raw_scores(output = SCORES_DIRECTORY):
+    return np.sort(open_table(output).to_table(columns = ['raw'])['raw'].to_numpy())
+
+## Compute coordination scores from 1 to 5 of one mouse, reading only its files
+## Arguments
+## output: folder of the weighted average scores
+## mouse : mouse name
+## ranked: array from ranked_raw_scores()
+## Returns frame of coordination scores with one row per speed and one column per day
+def mouse_scores(output, mouse, ranked):
+    scores = open_table(output).to_table(columns = ['day', 'speed', 'raw'], filter = ds.field('mouse') == mouse).to_pandas()
+    scores['score'] = coordination_bins(ranked_percentiles(ranked, scores['raw'].to_numpy()))
+    frame = scores.pivot(index = 'speed', columns = 'day', values = 'score')
+    return frame.reindex(index = [speed for speed in SPEED_NAMES if speed in frame.index], columns = sorted(frame.columns))
+
+## Lazily compute coordination scores of every mouse
+## output: folder of the weighted average scores
+## Yields mouse name and frame from mouse_scores()
+def iter_mouse_scores(output = SCORES_DIRECTORY):
+    ranked = ranked_raw_scores(output)
+    for mouse in table_mice(output):
+        yield mouse, mouse_scores(output, mouse, ranked)
+
+## Score the table and export coordination scores like mouse_coordination_score.py
+## Day-wise means and standard errors are accumulated over mice without padding missing days
+## Arguments
+## directory: folder of the metrics table
+## output   : folder of the weighted average scores
+## show     : Boolean flag to show the cohort plot after saving it, blocks until the window is closed
+def main(directory = TABLE_DIRECTORY, output = SCORES_DIRECTORY, show = True):
+    import matplotlib.pyplot as plt
+
+    score_table(directory, output)
+
+    ## Running sums of scores over all mice and speeds recorded on each day
+    totals = {}
+    for mouse, frame in iter_mouse_scores(output):
+        frame.to_csv(mouse + '_coordination_scores.csv')
+        for day in frame.columns:
+            scores = frame[day].dropna().to_numpy()
+            total  = totals.setdefault(day, np.zeros(3))
+            total += [len(scores), np.sum(scores), np.sum(scores ** 2)]
+
+    ## Compute mean and standard error of coordination scores of each day
+    days   = sorted(totals)
+    count, sums, squares = np.array([totals[day] for day in days]).T
+    means  = sums / count
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        errors = np.sqrt(np.maximum(squares - count * means ** 2, 0) / (count - 1) / count)
+    pd.DataFrame(data = [means, errors], index = ['mean', 'sem'], columns = days).to_csv('coordination_score_means.csv')
+
+    ## Plot results
+    plt.errorbar(range(1, len(days) + 1), means, yerr = errors, marker = 'o', capsize = 4)
+    plt.xticks(range(1, len(days) + 1), days)
+    plt.yticks(range(6))
+    plt.xlabel('Day')
+    plt.ylabel('Average Coordination Score')
+    plt.tight_layout()
+    plt.savefig('coordinationscore.png', dpi = 300)
+    if show:
+        plt.show()
+
+## Command line entry point
+## argv: list of arguments, None for sys.argv
+def cli(argv = None):
+    parser = argparse.ArgumentParser(description = 'Export cohort metrics to a long-format table and score it out of core')
+    parser.add_argument('command', choices = ['export', 'score'], help = 'export mice_metrics.hdf5 to the table, or score the table')
+    parser.add_argument('--table', default = TABLE_DIRECTORY, help = 'folder of the metrics table')
+    parser.add_argument('--scores', default = SCORES_DIRECTORY, help = 'folder of the weighted average scores')
+    parser.add_argument('--no-show', action = 'store_true', help = 'only save the cohort plot, do not open a window')
+    args = parser.parse_args(argv)
+    if args.command == 'export':
+        with h5py.File('mice_metrics.hdf5', 'r') as mice_metrics:
+            export_table(mice_metrics, args.table)
+    else:
+        main(args.table, args.scores, show = not args.no_show)
+
+if __name__ == '__main__':
+    cli()
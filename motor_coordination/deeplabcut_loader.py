@@ -0,0 +1,183 @@
+##
+## deeplabcut_loader.py
+## Mouse Motor Coordination
+##
+## Shared loader for DeepLabCut exports and analyzed step length files
+## Only requested columns are parsed, and parsed columns are kept in a
+## float32 .npz sidecar next to the source file so later runs skip text parsing
+##
+
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+## Suffix of the binary sidecar written next to each source file
+SIDECAR_SUFFIX = '.cols.npz'
+
+## Labels of the first cell of each DeepLabCut CSV header row
+HEADER_LABELS = ('scorer', 'individuals', 'bodyparts', 'coords')
+
+## Get path of the binary sidecar for a source file
+def sidecar_path(path):
+    return path + SIDECAR_SUFFIX
+
+## Load cached columns from sidecar if the source file is unchanged
+## Arguments
+## path: source file path
+## Returns dictionary of column name to array, empty if there is no valid sidecar
+def read_sidecar(path):
+    cache = sidecar_path(path)
+    if not os.path.exists(cache):
+        return {}
+    stat = os.stat(path)
+    try:
+        with np.load(cache) as sidecar:
+            if sidecar['mtime'] != stat.st_mtime_ns or sidecar['size'] != stat.st_size:
+                return {}
+            return {str(name): sidecar['col_' + name] for name in sidecar['columns']}
+    except (OSError, ValueError, KeyError):
+        ## Unreadable sidecar is treated as missing and rewritten
+        return {}
+
+## Write columns to sidecar keyed on source file modification time and size
+## The sidecar is only a cache, so it is skipped in read-only or shared data folders
+## Arguments
+## path   : source file path
+## columns: dictionary of column name to array
+def write_sidecar(path, columns):
+    stat   = os.stat(path)
+    arrays = {'col_' + name: np.asarray(values, dtype = np.float32) for name, values in columns.items()}
+    arrays['columns'] = np.array(list(columns.keys()), dtype = str)
+    arrays['mtime']   = np.int64(stat.st_mtime_ns)
+    arrays['size']    = np.int64(stat.st_size)
+
+    ## Write to temporary file first so concurrent readers never see a partial sidecar
+    cache     = sidecar_path(path)
+    temporary = cache + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(temporary, 'wb') as handle:
+            np.savez(handle, **arrays)
+        os.replace(temporary, cache)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+## Read DeepLabCut CSV header into one "<bodypart>_<coord>" name per column
+## Arguments
+## path: DeepLabCut CSV file
+## Returns list of column names and number of header rows
+def read_header(path):
+    rows = {}
+    with open(path, newline = '', encoding = 'cp1252') as handle:
+        for row in csv.reader(handle):
+            if not row or row[0] not in HEADER_LABELS:
+                break
+            rows[row[0]] = row
+    if 'bodyparts' not in rows or 'coords' not in rows:
+        raise ValueError('{path} is not a DeepLabCut CSV export'.format(path = path))
+    names = [bodypart + '_' + coord for bodypart, coord in zip(rows['bodyparts'], rows['coords'])]
+    return names, len(rows)
+
+## Parse selected columns of a source file
+## Arguments
+## path   : DeepLabCut CSV/H5 export or analyzed CSV file
+## columns: list of column names to parse, None for all pose columns
+def parse_columns(path, columns):
+    if path.endswith('.h5'):
+        ## DeepLabCut native output with (scorer, [individuals,] bodyparts, coords) columns
+        frame = pd.read_hdf(path)
+        names = [bodypart + '_' + coord for bodypart, coord in zip(frame.columns.get_level_values('bodyparts'),
+                                                                    frame.columns.get_level_values('coords'))]
+        frame.columns = names
+        frame = frame.loc[:, ~frame.columns.duplicated()]
+        if columns is None:
+            columns = [name for name in names if not name.endswith('_likelihood')]
+        return {name: frame[name].to_numpy(dtype = np.float32) for name in columns}
+
+    with open(path, newline = '', encoding = 'cp1252') as handle:
+        first = next(csv.reader(handle), [''])
+    if first[0] == 'scorer':
+        ## DeepLabCut CSV with multi-row header
+        names, skip = read_header(path)
+        if columns is None:
+            columns = [name for name in names[1:] if not name.endswith('_likelihood')]
+        missing = [name for name in columns if name not in names]
+        if missing:
+            raise KeyError('Columns {missing} not found in {path}'.format(missing = missing, path = path))
+        positions = sorted(names.index(name) for name in columns)
+        frame = pd.read_csv(path, encoding = 'cp1252', header = None, skiprows = skip, usecols = positions, dtype = np.float64)
+        frame.columns = [names[position] for position in positions]
+    else:
+        ## Analyzed CSV with single-row header
+        frame = pd.read_csv(path, encoding = 'cp1252', usecols = columns, dtype = np.float64)
+    return {name: frame[name].to_numpy(dtype = np.float32) for name in frame.columns}
+
+## Load columns of a DeepLabCut export or analyzed CSV file
+## Arguments
+## path   : DeepLabCut CSV/H5 export or analyzed CSV file
+## columns: list of column names, e.g. 'head_x' or 'lfp_steplength'
+##          None loads every X/Y column of a DeepLabCut export
+## cache  : Boolean flag to read and write the binary sidecar
+## Returns Pandas frame with float32 columns
+def load_columns(path, columns = None, cache = True):
+    if columns is None and not path.endswith('.h5'):
+        names, _ = read_header(path)
+        columns  = [name for name in names[1:] if not name.endswith('_likelihood')]
+
+    cached = read_sidecar(path) if cache else {}
+    if columns is not None and all(name in cached for name in columns):
+        return pd.DataFrame({name: cached[name] for name in columns})
+
+    ## Parse requested columns and keep previously cached ones in the sidecar
+    parsed = parse_columns(path, columns)
+    if cache:
+        cached.update(parsed)
+        write_sidecar(path, cached)
+    if columns is None:
+        return pd.DataFrame(parsed)
+    return pd.DataFrame({name: parsed[name] for name in columns})
+
+## Iterate over fixed-size chunks of selected columns without loading the whole file
+## Arguments
+## path     : DeepLabCut CSV export or table-format H5 file
+## columns  : list of column names, None for every X/Y column
+## chunksize: number of frames per chunk
+## Yields Pandas frames with float32 columns, indexed by frame number
+def iter_columns(path, columns = None, chunksize = 50000):
+    offset = 0
+    if path.endswith('.h5'):
+        with pd.HDFStore(path, mode = 'r') as store:
+            for chunk in store.select(store.keys()[0], chunksize = chunksize):
+                chunk.columns = [bodypart + '_' + coord for bodypart, coord in zip(chunk.columns.get_level_values('bodyparts'),
+                                                                                    chunk.columns.get_level_values('coords'))]
+                chunk = chunk.loc[:, ~chunk.columns.duplicated()]
+                names = columns or [name for name in chunk.columns if not name.endswith('_likelihood')]
+                chunk = chunk[names].astype(np.float32).set_axis(pd.RangeIndex(offset, offset + len(chunk)))
+                offset += len(chunk)
+                yield chunk
+        return
+
+    names, skip = read_header(path)
+    if columns is None:
+        columns = [name for name in names[1:] if not name.endswith('_likelihood')]
+    positions = sorted(names.index(name) for name in columns)
+    reader = pd.read_csv(path, encoding = 'cp1252', header = None, skiprows = skip, usecols = positions,
+                         dtype = np.float32, chunksize = chunksize)
+    for chunk in reader:
+        chunk.columns = [names[position] for position in positions]
+        chunk = chunk[columns].set_axis(pd.RangeIndex(offset, offset + len(chunk)))
+        offset += len(chunk)
+        yield chunk
+
+## Load X/Y (and optionally likelihood) columns of selected body parts
+## Arguments
+## path     : DeepLabCut CSV/H5 export
+## bodyparts: list of body part names, None for all body parts
+## coords   : coordinates to load for each body part
+## cache    : Boolean flag to read and write the binary sidecar
+def load_pose(path, bodyparts = None, coords = ('x', 'y'), cache = True):
+    if bodyparts is None:
+        return load_columns(path, None, cache)
+    columns = [bodypart + '_' + coord for bodypart in bodyparts for coord in coords]
+    return load_columns(path, columns, cache)
@@ -0,0 +1,126 @@
+##
+## instrumentation.py
+## Mouse Motor Coordination
+##
+## Opt-in per-session records of stage timing, peak memory and frames lost to the box mask
+## Records are plain dictionaries, every function is a no-op when the record is None
+##
+
+import contextlib
+import json
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+## Fraction of frames of a body part outside the box above which a session is flagged
+LOSS_TOLERANCE = 0.5
+
+## File with one JSON record per line, written next to mice_data.hdf5
+RECORDS_FILE = 'mice_data_instrumentation.jsonl'
+
+## Reset peak resident set size of this process, so the next peak_rss() covers one stage
+## Only possible on Linux, elsewhere peak_rss() is the peak since the process started
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as handle:
+            handle.write('5')
+    except OSError:
+        pass
+
+## Get peak resident set size of this process in bytes, NaN if unknown
+def peak_rss():
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith('VmHWM:'):
+                    return float(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return np.nan
+    ## ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return float(peak) if peak > 2 ** 32 else float(peak) * 1024
+
+## Create an empty record for one session
+## Arguments
+## keys: identifying fields, e.g. mouse = 'Animal_ID', day = 'd01'
+def new_record(**keys):
+    record = dict(keys)
+    record['stages'] = {}
+    return record
+
+## Time a stage of the pipeline and record its wall time and peak memory
+## Time of a stage entered several times is summed
+## Arguments
+## record: dictionary from new_record(), None to skip instrumentation
+## name  : stage name
+@contextlib.contextmanager
+def stage(record, name):
+    if record is None:
+        yield
+        return
+    reset_peak_rss()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        entry   = record['stages'].setdefault(name, {'seconds': 0.0, 'peak_rss_mb': 0.0})
+        entry['seconds']    += seconds
+        entry['peak_rss_mb'] = max(entry['peak_rss_mb'], peak_rss() / 2 ** 20)
+
+## Record how many frames of each body part the box-corner outlier mask threw away
+## Arguments
+## record: dictionary from new_record(), None to skip instrumentation
+## inside: (frames, parts) mask of positions inside the box
+## parts : body part names
+def record_mask_loss(record, inside, parts):
+    if record is None:
+        return
+    frames = len(inside)
+    lost   = frames - np.count_nonzero(inside, axis = 0)
+    record['frames']        = int(frames)
+    record['lost_frames']   = {part: int(count) for part, count in zip(parts, lost)}
+    record['lost_fraction'] = {part: float(count) / max(frames, 1) for part, count in zip(parts, lost)}
+    record['flagged']       = bool(frames > 0 and np.max(lost) > LOSS_TOLERANCE * frames)
+
+## Record how many frames fell into each speed section
+## Arguments
+## record     : dictionary from new_record(), None to skip instrumentation
+## labels     : (frames,) section bins from section_labels()
+## n_sections : number of sections per session
+## speed_names: name of each section
+def record_sections(record, labels, n_sections, speed_names):
+    if record is None:
+        return
+    counts = np.bincount(labels[labels >= 0] % n_sections, minlength = n_sections)
+    record['section_frames'] = {name: int(count) for name, count in zip(speed_names, counts)}
+
+## Append records to a JSON lines file
+## Arguments
+## path   : JSON lines file
+## records: list of records
+def write_jsonl(path, records):
+    with open(path, 'a') as handle:
+        for record in records:
+            handle.write(json.dumps(record) + '\n')
+
+## Store a record as JSON string attribute of an hdf5 dataset or group
+## Arguments
+## node  : h5py dataset or group, e.g. the session's metrics dataset
+## record: record of the session
+def write_attribute(node, record):
+    node.attrs['instrumentation'] = json.dumps(record)
+
+## Read records from a JSON lines file
+## Arguments
+## path: JSON lines file
+## Returns list of records
+def read_jsonl(path):
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
@@ -0,0 +1,74 @@
+##
+## manifest.py
+## Mouse Motor Coordination
+##
+## Read and write session manifests, CSV files with one row per (mouse, day) session
+## that replace the hardcoded database dictionary of mouse_coordination_metrics.py
+##
+
+import csv
+import json
+import os
+
+## Manifest columns, one row per session
+## analyzed_file: step length file, empty to compute step lengths in memory from the raw file
+## raw_file     : DeepLabCut export with head, paw and box corner positions
+## corners      : image to pick or estimate box corners for, empty to use per-frame corner positions
+## reverse      : True if the mouse runs in reverse direction
+## rig          : optional name of the rig in the rigs file, for fallback box corners
+## log_file     : optional serial log of arduino_code.ino, to section frames by the logged motor schedule
+## sync_part    : optional body part of the raw file tracking the video sync LED, to align frames to the log
+## fps          : optional video frame rate, empty for the --fps option of the metrics command
+MANIFEST_COLUMNS = ['mouse', 'day', 'analyzed_file', 'raw_file', 'corners', 'reverse', 'rig', 'log_file', 'sync_part', 'fps']
+
+## Resolve a path of a manifest relative to the folder of the manifest
+def manifest_path(directory, path):
+    return os.path.normpath(os.path.join(directory, path)) if path else None
+
+## Read a session manifest into a database dictionary
+## Relative file paths are resolved against the folder of the manifest
+## Arguments
+## path: CSV manifest file
+## Returns dictionary of mouse to dictionary of day to [analyzed_file, raw_file, corners, reverse(, rig(, log_file(, sync_part(, fps))))]
+def read_manifest(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    database  = {}
+    with open(path, newline = '') as handle:
+        for row in csv.DictReader(handle):
+            args = [manifest_path(directory, row.get('analyzed_file')),
+                    manifest_path(directory, row['raw_file']),
+                    manifest_path(directory, row.get('corners')),
+                    (row.get('reverse') or '').strip().lower() in ('true', '1', 'yes')]
+            if row.get('rig') or row.get('log_file') or row.get('sync_part') or row.get('fps'):
+                args.append(row.get('rig') or None)
+            if row.get('log_file') or row.get('sync_part') or row.get('fps'):
+                args.append(manifest_path(directory, row.get('log_file')))
+            if row.get('sync_part') or row.get('fps'):
+                args.append(row.get('sync_part') or None)
+            if row.get('fps'):
+                args.append(float(row['fps']))
+            database.setdefault(row['mouse'], {})[row['day']] = args
+    return database
+
+## Write a database dictionary as session manifest
+## Arguments
+## path    : CSV manifest file
+## database: dictionary in the format of read_manifest(), e.g. from synthetic_sessions.make_cohort()
+def write_manifest(path, database):
+    with open(path, 'w', newline = '') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(MANIFEST_COLUMNS)
+        for mouse, days in database.items():
+            for day, args in days.items():
+                file, raw_file, corners, reverse = args[:4]
+                rig       = args[4] if len(args) > 4 else None
+                log_file  = args[5] if len(args) > 5 else None
+                sync_part = args[6] if len(args) > 6 else None
+                fps       = args[7] if len(args) > 7 else None
+                writer.writerow([mouse, day, file or '', raw_file, corners or '', reverse, rig or '', log_file or '', sync_part or '',
+                                 fps or ''])
+
+## Read fallback box corners of each rig from a JSON file of rig name to four [X, Y] corners
+def read_rigs(path):
+    with open(path) as handle:
+        return json.load(handle)
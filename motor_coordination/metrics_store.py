@@ -0,0 +1,152 @@
+##
+## metrics_store.py
+## Mouse Motor Coordination
+##
+## Incremental cohort metrics store in mice_metrics.hdf5
+## Each metric is a chunked, resizable, compressed (speeds, sessions) dataset
+## and the 'index' dataset holds the (mouse, day) pair of every session column
+## Every write bumps the 'generation' counter of the store and stamps it on the column
+## written, so readers such as rank_store.py find the sessions changed since they last looked
+##
+
+import uuid
+import numpy as np
+import h5py
+
+## Names of metric datasets, in column order of the metrics() matrix
+METRIC_NAMES = ['expectation', 'sd', 'lfp_steplength', 'rfp_steplength', 'lhp_steplength', 'rhp_steplength']
+
+## Number of sessions per chunk along the session axis
+CHUNK_SESSIONS = 256
+
+## Create metric and index datasets if they do not exist yet
+## Datasets from the old fixed-size layout have no session index and are dropped
+## Stores without generations get them, with every column stamped as unchanged generation 0
+## Arguments
+## mice_metrics: open h5py file
+## n_speeds    : number of treadmill speeds
+def create_store(mice_metrics, n_speeds = 5):
+    if 'index' in mice_metrics:
+        if 'generation' not in mice_metrics:
+            create_generations(mice_metrics, len(mice_metrics['index']))
+        return
+    for name in METRIC_NAMES:
+        if name in mice_metrics:
+            del mice_metrics[name]
+    mice_metrics.create_dataset('index', shape = (0, 2), maxshape = (None, 2), chunks = (CHUNK_SESSIONS, 2),
+                                dtype = h5py.string_dtype())
+    for name in METRIC_NAMES:
+        mice_metrics.create_dataset(name, shape = (n_speeds, 0), maxshape = (n_speeds, None),
+                                    chunks = (n_speeds, CHUNK_SESSIONS), dtype = np.float64,
+                                    compression = 'gzip', shuffle = True)
+    create_generations(mice_metrics, 0)
+
+## Create the generation of every column and the generation counter of a new store
+## The store identifier tells readers that a recreated store restarted its counter
+def create_generations(mice_metrics, n_sessions):
+    mice_metrics.create_dataset('generation', data = np.zeros(n_sessions, dtype = np.int64), maxshape = (None,),
+                                chunks = (CHUNK_SESSIONS,))
+    mice_metrics.attrs['generation'] = 0
+    mice_metrics.attrs['store_id']   = uuid.uuid4().hex
+
+## Bump the generation counter of the store, None for stores without generations
+def next_generation(mice_metrics):
+    if 'generation' not in mice_metrics:
+        return None
+    generation = int(mice_metrics.attrs['generation']) + 1
+    mice_metrics.attrs['generation'] = generation
+    return generation
+
+## Map each stored session to its column
+## Arguments
+## mice_metrics: open h5py file
+## Returns dictionary of (mouse, day) to column index
+def session_index(mice_metrics):
+    index = mice_metrics['index'].asstr()[...]
+    return {(mouse, day): column for column, (mouse, day) in enumerate(index)}
+
+## Store metrics of one session, replacing its column in place or appending a new one
+## Arguments
+## mice_metrics: open h5py file
+## mouse, day  : session keys
+## results     : (speeds, 6) matrix returned by metrics()
+## index       : dictionary from session_index(), updated when a session is appended
+def write_session(mice_metrics, mouse, day, results, index = None):
+    if index is None:
+        index = session_index(mice_metrics)
+    column = index.get((mouse, day))
+    if column is None:
+        column = len(index)
+        mice_metrics['index'].resize(column + 1, axis = 0)
+        mice_metrics['index'][column] = [mouse, day]
+        for name in METRIC_NAMES:
+            mice_metrics[name].resize(column + 1, axis = 1)
+        if 'generation' in mice_metrics:
+            mice_metrics['generation'].resize(column + 1, axis = 0)
+        index[(mouse, day)] = column
+    for position, name in enumerate(METRIC_NAMES):
+        mice_metrics[name][:, column] = results[:, position]
+    generation = next_generation(mice_metrics)
+    if generation is not None:
+        mice_metrics['generation'][column] = generation
+    return column
+
+## Remove sessions that are not in keep
+## The last columns are moved into the freed columns so removal never rewrites the whole store
+## Arguments
+## mice_metrics: open h5py file
+## keep        : set of (mouse, day) pairs to keep
+## Returns list of removed (mouse, day) pairs
+def prune_sessions(mice_metrics, keep):
+    index   = session_index(mice_metrics)
+    removed = [key for key in index if key not in keep]
+    keys    = sorted(index, key = index.get)
+    tracked = 'generation' in mice_metrics
+    if removed:
+        next_generation(mice_metrics)
+    for key in removed:
+        column = index.pop(key)
+        last   = len(keys) - 1
+        if column != last:
+            ## Move last session into freed column
+            moved = keys[last]
+            mice_metrics['index'][column] = list(moved)
+            for name in METRIC_NAMES:
+                mice_metrics[name][:, column] = mice_metrics[name][:, last]
+            if tracked:
+                mice_metrics['generation'][column] = mice_metrics['generation'][last]
+            index[moved]  = column
+            keys[column] = moved
+        keys.pop()
+        mice_metrics['index'].resize(last, axis = 0)
+        for name in METRIC_NAMES:
+            mice_metrics[name].resize(last, axis = 1)
+        if tracked:
+            mice_metrics['generation'].resize(last, axis = 0)
+    return removed
+
+## Read metrics of some sessions
+## Arguments
+## mice_metrics: open h5py file
+## columns     : increasing list of session columns
+## Returns (sessions, speeds, metrics) array in METRIC_NAMES order
+def read_columns(mice_metrics, columns):
+    n_speeds, n_sessions = mice_metrics[METRIC_NAMES[0]].shape
+    if len(columns) == 0:
+        return np.zeros((0, n_speeds, len(METRIC_NAMES)))
+    ## Reading every column as a slice avoids the point selection of h5py
+    selection = slice(None) if len(columns) == n_sessions else list(columns)
+    return np.stack([mice_metrics[name][:, selection] for name in METRIC_NAMES]).transpose(2, 1, 0)
+
+## Read all cohort metrics into one preallocated array
+## Each metric is read straight into its slice, so the per-metric arrays are views without extra copies
+## Arguments
+## mice_metrics: open h5py file
+## Returns (metrics, speeds, sessions) array in METRIC_NAMES order
+def read_metrics(mice_metrics):
+    shape  = mice_metrics[METRIC_NAMES[0]].shape
+    cohort = np.empty((len(METRIC_NAMES),) + shape)
+    for position, name in enumerate(METRIC_NAMES):
+        if shape[1] > 0:
+            mice_metrics[name].read_direct(cohort[position])
+    return cohort
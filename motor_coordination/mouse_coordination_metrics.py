@@ -0,0 +1,861 @@
+##
+## mouse_coordination_metrics.py
+## Mouse Motor Coordination
+##
+## Run statistical analysis on mouse data derived from DeepLabCut
+##
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from time import perf_counter
+import argparse
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+import h5py
+from .box_corners import CORNER_PARTS, DRIFT_BLOCKS, DRIFT_TOLERANCE, MIN_FRACTION, MIN_LIKELIHOOD, estimate_corners
+from .deeplabcut_loader import load_columns, load_pose
+from .manifest import read_manifest, read_rigs
+from .instrumentation import RECORDS_FILE, new_record, record_mask_loss, record_sections, stage, write_attribute, write_jsonl
+from .pose_archive import has_pose, read_session, session_columns, write_pose
+from .result_cache import cache_key, digest_of, evict_sessions, input_digests, is_cached, stored_digests, write_key
+from .metrics_store import create_store, prune_sessions, session_index, write_session
+from .steplength_analysis import PAWS, step_lengths
+from .treadmill_log import LOG_VERSION, MOTOR_SECTIONS, log_sections, pulse_onsets
+
+## Dictionary to store list of mice and corresponding files
+## Main key     : mouse ID
+## Secondary key: day X of mouse training
+## Value        : list containing arguments for metrics() function
+# 3 files are needed: file containing the head and paw positions, file containing the steplength, image file with a frame for the video to label the corners of the box 
+# The steplength file can be None, step lengths are then computed in memory from the raw file with process_session()
+# An optional fifth element names the rig in rigs the session was recorded on, and an optional sixth element
+# the serial log of arduino_code.ino, whose motor schedule then replaces the fixed SECTIONS
+# An optional seventh element names the body part tracking the video sync LED, whose pulses align frames to the log
+# An optional eighth element is the video frame rate, FRAME_RATE or the --fps option when missing
+database = {
+            'Animal_ID': {
+                'd01': ["Animal_ID/d01.csv", "Animal_ID/Animal_ID-TMday01.csv", "Animal_ID/day01.png", False],
+                'd02': ["Animal_ID/d02.csv", "Animal_ID/Animal_ID-TMday02.csv", "Animal_ID/day02.png", False],
+                'd03': ["Animal_ID/d03.csv", "Animal_ID/Animal_ID-TMday03.csv", "Animal_ID/day03.png", False],
+                'd04': ["Animal_ID/d04.csv", "Animal_ID/Animal_ID-TMday04.csv", "Animal_ID/day04.png", False],
+                'd05': ["Animal_ID/d05.csv", "Animal_ID/Animal_ID-TMday05.csv", "Animal_ID/day05.png", False],
+                'd06': ["Animal_ID/d06.csv", "Animal_ID/Animal_ID-TMday06.csv", "Animal_ID/day06.png", False],
+                'd07': ["Animal_ID/d07.csv", "Animal_ID/Animal_ID-TMday07.csv", "Animal_ID/day07.png", False],
+                'd08': ["Animal_ID/d08.csv", "Animal_ID/Animal_ID-TMday08.csv", "Animal_ID/day08.png", False],
+                'd09': ["Animal_ID/d09.csv", "Animal_ID/Animal_ID-TMday09.csv", "Animal_ID/day09.png", True],
+                'd10': ["Animal_ID/d10.csv", "Animal_ID/Animal_ID-TMday10.csv", "Animal_ID/day10.png", True],
+                'd11': ["Animal_ID/d11.csv", "Animal_ID/Animal_ID-TMday11.csv", "Animal_ID/day11.png", True],
+                'd12': ["Animal_ID/d12.csv", "Animal_ID/Animal_ID-TMday12.csv", "Animal_ID/day12.png", True],
+            }
+         }
+
+## Dictionary of fallback box corners for each treadmill rig
+## Key  : rig name, fifth element of a database entry
+## Value: bottom left, top left, top right and bottom right X/Y positions
+# Used when a corner is not tracked with enough confidence in a session recorded on the rig
+rigs = {
+        'Rig_ID': [[100.0, 300.0], [100.0, 50.0], [500.0, 50.0], [500.0, 300.0]],
+       }
+
+## Declare specific time sections to extract from data
+## Each section corresponds to different treadmill speed
+## 30 - 90 seconds  : 3m/min
+## 90 - 150 seconds : 6m/min
+## 150 - 210 seconds: 8m/min
+## 210 - 270 seconds: 10m/min
+## 270 - 330 seconds: 12m/min 
+SECTIONS    = np.array([30.0, 90.0, 150.0, 210.0, 270.0, 330.0])
+SPEED_NAMES = ['3m/min', '6m/min', '8m/min', '10m/min', '12m/min']
+
+## Declare mouse quadrants and position
+## Box is split into 5 equally-sized quadrants
+## 1 is frontmost quadrant, 5 is backmost quadrant
+QUADRANT_LOCS = np.array([0.0, 0.2, 0.4, 0.6, 0.8, 1])
+
+## Default video frame rate used to convert frame numbers into seconds
+## Both metrics() and process_session() time frame i at i / fps seconds to compare it with SECTIONS,
+## sessions recorded at another rate set it with the eighth database element or the --fps option
+FRAME_RATE = 30.0
+
+## Get the frame rate of a database entry
+## Arguments
+## args: database entry
+## fps : frame rate of entries without their own
+def session_fps(args, fps = FRAME_RATE):
+    return float(args[7]) if len(args) > 7 and args[7] else fps
+
+## Compute average left/right X and top/bottom Y position of the box
+## Arguments
+## bottom_left, top_left, top_right, bottom_right: (N, 2) arrays of X/Y positions for each box corner
+def box_edges(bottom_left, top_left, top_right, bottom_right):
+    edges    = np.zeros(4)
+    edges[0] = (np.mean(bottom_left[:, 0]) + np.mean(top_left[:, 0])) / 2
+    edges[1] = (np.mean(bottom_right[:, 0]) + np.mean(top_right[:, 0])) / 2
+    edges[2] = (np.mean(top_left[:, 1]) + np.mean(top_right[:, 1])) / 2
+    edges[3] = (np.mean(bottom_left[:, 1]) + np.mean(bottom_right[:, 1])) / 2
+    return edges
+
+## Stack several sessions along the frame axis for batch_metrics()
+## Arguments
+## sessions: list of (time, positions, steplengths) tuples, one per session
+## Returns stacked time, positions, steplengths and the number of frames in each session
+def stack_sessions(sessions):
+    time        = np.concatenate([session[0] for session in sessions])
+    positions   = np.concatenate([session[1] for session in sessions])
+    steplengths = np.concatenate([session[2] for session in sessions])
+    lengths     = np.array([len(session[0]) for session in sessions])
+    return time, positions, steplengths, lengths
+
+## Mask body part positions outside the box, which are outliers
+## Arguments
+## positions  : (frames, parts, 2) array of X/Y positions of stacked sessions
+## box_corners: (sessions, 4) array of left/right/top/bottom box edges from box_edges()
+## session_ids: (frames,) array with the session index of every frame
+## Returns (frames, parts) mask of positions inside the box
+def box_mask(positions, box_corners, session_ids):
+    edges = box_corners[session_ids]
+    x = positions[:, :, 0]
+    y = positions[:, :, 1]
+    return (x >= edges[:, [0]]) & (x <= edges[:, [1]]) & (y >= edges[:, [2]]) & (y <= edges[:, [3]])
+
+## Normalize body part positions with respect to box edges
+## Arguments
+## positions  : (frames, parts, 2) array of X/Y positions of stacked sessions
+## box_corners: (sessions, 4) array of left/right/top/bottom box edges from box_edges()
+## session_ids: (frames,) array with the session index of every frame
+## reverse    : (sessions,) Boolean flags to indicate mouse running in reverse
+## Returns positions scaled to 0-1 inside the box
+def scale_positions(positions, box_corners, session_ids, reverse):
+    edges  = box_corners[session_ids]
+    left   = edges[:, [0]]
+    right  = edges[:, [1]]
+    top    = edges[:, [2]]
+    bottom = edges[:, [3]]
+
+    ## Normalize X/Y data, reversing coordinates for mice running in reverse direction
+    normalized = np.empty(positions.shape)
+    normalized[:, :, 0] = (positions[:, :, 0] - left) / (right - left)
+    normalized[:, :, 1] = (positions[:, :, 1] - top) / (bottom - top)
+    flip = reverse[session_ids]
+    normalized[flip] = 1 - normalized[flip]
+    return normalized
+
+## Mask and normalize body part positions with respect to box edges
+## Arguments
+## positions  : (frames, parts, 2) array of X/Y positions of stacked sessions
+## box_corners: (sessions, 4) array of left/right/top/bottom box edges from box_edges()
+## session_ids: (frames,) array with the session index of every frame
+## reverse    : (sessions,) Boolean flags to indicate mouse running in reverse
+## Returns normalized positions and (frames, parts) mask of positions inside the box
+def normalize_positions(positions, box_corners, session_ids, reverse):
+    return scale_positions(positions, box_corners, session_ids, reverse), box_mask(positions, box_corners, session_ids)
+
+## Assign every frame to a treadmill speed section
+## A section starts at the frame whose time is nearest to its boundary and
+## ends right before the frame nearest to the next boundary
+## Arguments
+## time    : (frames,) time column shared by all body parts of stacked sessions
+## lengths : (sessions,) number of frames in each session
+## sections: section boundaries
+## Returns (frames,) array of section bins (session * number of sections + section), -1 outside of any section
+def section_labels(time, lengths, sections = SECTIONS):
+    lengths    = np.asarray(lengths)
+    n_sections = len(sections) - 1
+    offsets    = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    ## Find frame index nearest to each boundary with one binary search per session
+    bounds = np.zeros((len(lengths), len(sections)), dtype = np.int64)
+    for index, (offset, length) in enumerate(zip(offsets, lengths)):
+        if length < 2:
+            bounds[index] = offset
+            continue
+        session_time = time[offset:offset + length]
+        right = np.clip(np.searchsorted(session_time, sections), 1, length - 1)
+        left  = (sections - session_time[right - 1]) <= (session_time[right] - sections)
+        bounds[index] = offset + right - left
+
+    ## Label frames by the last boundary at or before them
+    flat    = np.searchsorted(bounds.ravel(), np.arange(len(time)), side = 'right') - 1
+    session = flat // len(sections)
+    section = flat % len(sections)
+    return np.where((flat >= 0) & (section < n_sections), session * n_sections + section, -1)
+
+## Reduce normalized frames into metrics for each section
+## Arguments
+## positions    : (frames, 5, 2) normalized X/Y positions of head, LFP, RFP, LHP, RHP
+## steplengths  : (frames, 4) step lengths of LFP, RFP, LHP, RHP
+## inside       : (frames, 5) mask of positions inside the box
+## labels       : (frames,) section bins from section_labels()
+## n_bins       : number of sessions times number of sections
+## quadrant_locs: X positions splitting the box into quadrants
+## Returns (n_bins, 6) array of E[Q], head Y SD and mean step length of each paw
+def section_reductions(positions, steplengths, inside, labels, n_bins, quadrant_locs = QUADRANT_LOCS):
+    n_quadrants = len(quadrant_locs) - 1
+    results     = np.zeros((n_bins, 6))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ## Step 1: Calculate expectation of mouse quadrant from quadrant histogram
+        ## Only the quadrants in front of the backmost one are weighted, as in the original loop
+        head     = inside[:, 0] & (labels >= 0)
+        bins     = labels[head]
+        x        = positions[head, 0, 0]
+        y        = positions[head, 0, 1]
+        quadrant = np.searchsorted(quadrant_locs, x, side = 'right') - 1
+        counted  = quadrant < n_quadrants - 1
+        histogram = np.bincount(bins[counted] * n_quadrants + quadrant[counted], minlength = n_bins * n_quadrants)
+        histogram = histogram.reshape(n_bins, n_quadrants)
+        results[:, 0] = histogram @ np.arange(1, n_quadrants + 1) / histogram.sum(axis = 1)
+
+        ## Step 2: Calculate Y axis standard deviation (SD)
+        count = np.bincount(bins, minlength = n_bins)
+        mean  = np.bincount(bins, weights = y, minlength = n_bins) / count
+        results[:, 1] = np.sqrt(np.bincount(bins, weights = (y - mean[bins]) ** 2, minlength = n_bins) / count)
+
+        ## Step 3: Calculate mean step length of all paws in one pass
+        paws  = inside[:, 1:] & (labels >= 0)[:, None]
+        bins  = (labels[:, None] * 4 + np.arange(4))[paws]
+        total = np.bincount(bins, weights = steplengths[paws], minlength = n_bins * 4)
+        count = np.bincount(bins, minlength = n_bins * 4)
+        results[:, 2:] = (total / count).reshape(n_bins, 4)
+    return results
+
+## Compute metrics of many sessions stacked along the frame axis in a single call
+## Arguments
+## time         : (frames,) time column of stacked sessions, sorted within each session
+## positions    : (frames, 5, 2) X/Y positions of head, LFP, RFP, LHP, RHP
+## steplengths  : (frames, 4) step lengths of LFP, RFP, LHP, RHP
+## lengths      : (sessions,) number of frames in each session
+## box_corners  : (sessions, 4) array of box edges from box_edges()
+## reverse      : Boolean flag or (sessions,) flags to indicate mouse running in reverse
+## sections     : section boundaries
+## quadrant_locs: X positions splitting the box into quadrants
+## record       : instrumentation record to add stage times and frame counts of all sessions to, None to skip
+## frame_sections: (frames,) section of each frame within its session, -1 outside sections, e.g. from
+##                treadmill_log.log_sections(), None to section frames by time with sections
+## Returns (sessions, speeds, 6) array of E[Q], head Y SD and LFP, RFP, LHP, RHP mean step length
+def batch_metrics(time, positions, steplengths, lengths, box_corners, reverse = False, sections = SECTIONS, quadrant_locs = QUADRANT_LOCS, record = None,
+                  frame_sections = None):
+    lengths     = np.asarray(lengths)
+    box_corners = np.asarray(box_corners, dtype = np.float64)
+    reverse     = np.broadcast_to(np.asarray(reverse, dtype = bool), lengths.shape)
+    session_ids = np.repeat(np.arange(len(lengths)), lengths)
+    n_sections  = len(sections) - 1
+
+    with stage(record, 'mask'):
+        inside = box_mask(positions, box_corners, session_ids)
+    with stage(record, 'normalize'):
+        normalized = scale_positions(positions, box_corners, session_ids, reverse)
+    with stage(record, 'section'):
+        if frame_sections is None:
+            labels = section_labels(time, lengths, sections)
+        else:
+            labels = np.where(frame_sections >= 0, session_ids * n_sections + frame_sections, -1)
+    with stage(record, 'metrics'):
+        results = section_reductions(normalized, steplengths, inside, labels, len(lengths) * n_sections, quadrant_locs)
+    record_mask_loss(record, inside, ['head'] + PAWS)
+    record_sections(record, labels, n_sections, SPEED_NAMES)
+    return results.reshape(len(lengths), n_sections, 6)
+
+## Interactively pick box corners on an image of the treadmill
+## Arguments
+## image: filepath to image with a frame of the video
+## Returns (4, 1, 2) array of bottom left, top left, top right and bottom right corners
+def pick_corners(image):
+    import matplotlib.pyplot as plt
+    import matplotlib.image as mpimg
+    import mplcursors
+
+    ## Plot image of mouse running in treadmill
+    fig = plt.figure()
+    img = mpimg.imread(image)
+    plt.imshow(img)
+
+    ## Create functions to extract box corner coordinates from selected markers on image
+    coordinates = []
+    scatters    = []
+    cursor      = mplcursors.cursor(multiple = True)
+
+    ## Plot callback function for adding point to selection list
+    @cursor.connect("add")
+    def addpoint(selection):
+        if len(coordinates) < 4:
+            point = np.around(selection.target, decimals = 3)
+            coordinates.append(point)
+            text = "X = " + str(point[0]) + "\n" + "Y = " + str(point[1])
+            selection.annotation.set_text(text)
+        else:
+            cursor.remove_selection(selection)
+    
+    ## Plot callback function for removing point from selection list
+    @cursor.connect("remove")
+    def removepoint(selection):
+        point = np.around(selection.target, decimals = 3)
+        val   = None
+        for index, coordinate in enumerate(coordinates):
+            if np.array_equal(coordinate, point):
+                val = index
+                break
+        if (val != None):
+            coordinates.pop(val)
+            scatters[val].remove()
+            scatters.pop(val)
+    
+    ## Plot callback to display selected points with scatter plot markers
+    def pointplot(event):
+        if len(coordinates) > len(scatters):
+            scatters.append(plt.scatter(coordinates[-1][0], coordinates[-1][1], color = "#33BBEE"))
+        fig.canvas.draw()
+    
+    ## Connect callback function and display image
+    fig.canvas.mpl_connect('button_press_event', pointplot)
+    plt.show()
+
+    ## Display error if four box coordinates are not selected
+    if len(coordinates) != 4:
+        message = "You selected {number} point(s) for the box corners, but 4 are required".format(number = len(coordinates))
+        raise ValueError(message)
+
+    ## Organize coordinates array in correct order
+    ## Order: bottom left, top left, top right, bottom right
+    coordinates = sorted(coordinates, key = lambda x: x[0])
+    if (coordinates[1][1] > coordinates[0][1]):
+        coordinates[0], coordinates[1] = coordinates[1], coordinates[0]
+    if (coordinates[3][1] < coordinates[2][1]):
+        coordinates[2], coordinates[3] = coordinates[3], coordinates[2]
+    coordinates = np.array(coordinates)
+    
+    ## Shape (4, 1, 2) like box corners stored in hdf5 file
+    return coordinates[:, None]
+
+## Get box corner positions from corners argument of metrics() or raw DeepLabCut data
+## Arguments
+## corners : None, filepath to image or (4, 1, 2) shaped NumPy array, see metrics()
+## raw_data: Pandas frame with <corner>_x/<corner>_y columns, used when corners is None
+## Returns (4, N, 2) array of bottom left, top left, top right and bottom right positions
+def resolve_corners(corners, raw_data):
+    if (corners is None):
+        ## Load box corners from DeepLabCut CSV file
+        bottom_left  = raw_data[['bottomleft_x', 'bottomleft_y']].to_numpy()
+        top_left     = raw_data[['topleft_x', 'topleft_y']].to_numpy()
+        top_right    = raw_data[['topright_x', 'topright_y']].to_numpy()
+        bottom_right = raw_data[['bottomright_x', 'bottomright_y']].to_numpy()
+    elif (isinstance(corners, np.ndarray)):
+        ## Copy box corners stored in hdf5 file
+        bottom_left  = corners[0]
+        top_left     = corners[1]
+        top_right    = corners[2]
+        bottom_right = corners[3]
+    elif (isinstance(corners, str)):
+        ## Pick box corners on image of mouse running in treadmill
+        coordinates  = pick_corners(corners)
+        bottom_left  = coordinates[0]
+        top_left     = coordinates[1]
+        top_right    = coordinates[2]
+        bottom_right = coordinates[3]
+    else:
+        raise ValueError('Box corners must be either filepath to raw data, filepath to labeled frame, or list of 4 positions')
+    return np.array([bottom_left, top_left, top_right, bottom_right])
+
+## Write metrics of one session to CSV files and/or print them
+## Arguments
+## allmetrics: (speeds, 6) matrix of E[Q], head Y SD and LFP, RFP, LHP, RHP mean step length
+## name, ext : CSV files are written to name + '_quadrant_expectation' + ext etc., None skips writing
+## verbose   : Boolean flag to print metrics
+def report_metrics(allmetrics, name = None, ext = '.csv', verbose = True):
+    quadrant_expectation = allmetrics[:, [0]]
+    y_axis_sd            = allmetrics[:, [1]]
+    steplength           = allmetrics[:, 2:]
+
+    ## Convert back into Pandas frame with row/column names for clarity
+    row_names        = SPEED_NAMES
+    quadrant_headers = ['E[Q]']
+    head_headers     = ['HEAD']
+    paw_headers      = ['LFP', 'RFP', 'LHP', 'RHP']
+    quadrant_expectation_frame = pd.DataFrame(data = quadrant_expectation, index = row_names, columns = quadrant_headers)
+    y_axis_sd_frame = pd.DataFrame(data = y_axis_sd, index = row_names, columns = head_headers)
+    steplength_frame = pd.DataFrame(data = steplength, index = row_names, columns = paw_headers)
+
+    ## Export frames to CSV
+    if name is not None:
+        quadrant_expectation_frame.to_csv(name + '_quadrant_expectation' + ext)
+        y_axis_sd_frame.to_csv(name + '_y_axis_sd' + ext)
+        steplength_frame.to_csv(name + '_steplength' + ext)
+
+    ## Print metrics
+    if verbose:
+        print("### Expectation of Mouse Quadrant ###")
+        print(quadrant_expectation_frame)
+        print("### Y Axis SD ###")
+        print(y_axis_sd_frame)
+        print("### Step Length ###")
+        print(steplength_frame)
+
+## Process mouse data and return statisical metrics to be used for coordination score
+## Arguments
+## file   : analyzed CSV file that contains mouse paw X/Y position and step length
+## rawfile: original CSV or H5 file from DeepLabCut that contains mouse head X/Y position
+## corners: coordinates of box corners from video. 
+##          Can either be a filepath to image or (4, 1, 2) shaped NumPy array
+## reverse: Boolean flag to indicate whether mouse is running in reverse on given day 
+## record : instrumentation record from new_record(), None to skip instrumentation
+## pose   : dictionary to add float32 session columns for the pose archive to, None to skip
+## log_file: serial log of arduino_code.ino to section frames by, None for the fixed SECTIONS
+## sync_part: body part of the raw file tracking the video sync LED, None to align frames to the log by session start
+## fps    : video frame rate
+## Frame i is timed at i / fps seconds like in process_session(), the time column of the
+## analyzed file is a frame counter written by steplength_analysis.py and is not used
+def metrics(file, raw_file, corners = None, reverse = False, record = None, pose = None, log_file = None, sync_part = None,
+            fps = FRAME_RATE):
+    ## Load only needed columns of analyzed and raw DeepLabCut files
+    ## Box corner tracks are only parsed when corners are taken from the raw file
+    with stage(record, 'load'):
+        bodyparts = ['head'] + (CORNER_PARTS if corners is None else [])
+        data      = load_columns(file, [paw + column for paw in PAWS for column in ['_x', '_y', '_steplength']])
+        raw_data  = load_pose(raw_file, bodyparts)
+
+    ## Extract head and paw data
+    head   = raw_data[['head_x', 'head_y']].to_numpy()
+    lf_paw = data[['lfp_x', 'lfp_y', 'lfp_steplength']].to_numpy()
+    rf_paw = data[['rfp_x', 'rfp_y', 'rfp_steplength']].to_numpy()
+    lh_paw = data[['lhp_x', 'lhp_y', 'lhp_steplength']].to_numpy()
+    rh_paw = data[['rhp_x', 'rhp_y', 'rhp_steplength']].to_numpy()
+    extracted_data = [head, lf_paw, rf_paw, lh_paw, rh_paw]
+
+    ## Load box corner data and compute average top/bottom X/Y position using box corners
+    with stage(record, 'corners'):
+        box_coordinates = resolve_corners(corners, raw_data)
+        box_corners     = box_edges(*box_coordinates)
+
+    ## Stack head and paw data for the vectorized metrics kernel
+    time        = np.arange(len(data)) / fps
+    positions   = np.stack([part[:, :2] for part in extracted_data], axis = 1)
+    steplengths = np.stack([part[:, 2] for part in extracted_data[1:]], axis = 1)
+
+    ## Compute mouse metrics
+    frame_sections = session_sections(raw_file, len(time), fps, log_file, sync_part)
+    allmetrics = batch_metrics(time, positions, steplengths, [len(time)], box_corners[None], reverse, record = record,
+                               frame_sections = frame_sections)[0]
+    if pose is not None:
+        pose.update(session_columns(time, positions, steplengths))
+
+    ## Export metrics to CSV files named after the analyzed file next to it and print them
+    ## Only the file name is used, so underscores in folder names never merge the files of different sessions
+    with stage(record, 'report'):
+        folder, name = os.path.split(file)
+        stem, ext    = os.path.splitext(name)
+        report_metrics(allmetrics, os.path.join(folder, stem), ext)
+
+    return allmetrics, box_coordinates
+
+## Process one session straight from the raw DeepLabCut export, without intermediate files
+## The raw file is parsed once, and step lengths, normalization, sections and metrics are computed in memory
+## Arguments
+## raw_file     : original CSV or H5 file from DeepLabCut with head, paw (and box corner) X/Y positions
+## corners      : coordinates of box corners, see metrics()
+## reverse      : Boolean flag to indicate whether mouse is running in reverse on given day
+## fps          : video frame rate, time of frame i is i / fps seconds
+## output       : prefix of metric CSV files (output + '_quadrant_expectation.csv' etc.), None writes no files
+## analyzed_file: CSV file to write time, paw X/Y positions and step lengths to, None writes no file
+## verbose      : Boolean flag to print metrics
+## record       : instrumentation record from new_record(), None to skip instrumentation
+## pose         : dictionary to add float32 session columns for the pose archive to, None to skip
+## log_file     : serial log of arduino_code.ino to section frames by, None for the fixed SECTIONS
+## sync_part    : body part tracking the video sync LED, see metrics()
+## Returns same (metrics matrix, box coordinates) pair as metrics()
+def process_session(raw_file, corners = None, reverse = False, fps = FRAME_RATE, output = None, analyzed_file = None, verbose = False,
+                    record = None, pose = None, log_file = None, sync_part = None):
+    ## Load head, paw and, if needed, box corner tracks in one pass
+    ## Stack head and paw positions and compute step lengths of every paw
+    with stage(record, 'load'):
+        bodyparts   = ['head'] + PAWS + (CORNER_PARTS if corners is None else [])
+        raw_data    = load_pose(raw_file, bodyparts)
+        time        = np.arange(len(raw_data)) / fps
+        positions   = np.stack([raw_data[[part + '_x', part + '_y']].to_numpy(dtype = np.float64) for part in ['head'] + PAWS], axis = 1)
+        steplengths = np.stack([step_lengths(positions[:, part, 0], positions[:, part, 1]) for part in range(1, 5)], axis = 1)
+
+    ## Compute mouse metrics
+    with stage(record, 'corners'):
+        box_coordinates = resolve_corners(corners, raw_data)
+        box_corners     = box_edges(*box_coordinates)
+    frame_sections = session_sections(raw_file, len(time), fps, log_file, sync_part)
+    allmetrics = batch_metrics(time, positions, steplengths, [len(time)], box_corners[None], reverse, record = record,
+                               frame_sections = frame_sections)[0]
+    if pose is not None:
+        pose.update(session_columns(time, positions, steplengths))
+
+    ## Optional intermediate and result output
+    with stage(record, 'report'):
+        write_outputs(allmetrics, time, positions, steplengths, output, analyzed_file, verbose)
+
+    return allmetrics, box_coordinates
+
+## Write optional outputs of process_session()
+## Arguments
+## allmetrics                   : (speeds, 6) metrics matrix
+## time, positions, steplengths : in-memory session data
+## output, analyzed_file, verbose: see process_session()
+def write_outputs(allmetrics, time, positions, steplengths, output, analyzed_file, verbose):
+    if analyzed_file is not None:
+        ## time is the frame counter, starting at 2 like the output of steplength_analysis.py
+        analyzed = pd.DataFrame({'time': np.arange(len(time)) + 2})
+        for part, paw in enumerate(PAWS, start = 1):
+            analyzed[paw + '_x']          = positions[:, part, 0]
+            analyzed[paw + '_y']          = positions[:, part, 1]
+            analyzed[paw + '_steplength'] = steplengths[:, part - 1]
+        analyzed.to_csv(analyzed_file)
+    report_metrics(allmetrics, output, '.csv', verbose)
+
+## Run one database session, from the analyzed CSV if there is one or else straight from the raw export
+## Arguments
+## file, raw_file, corners, reverse: database entry, file is None for sessions without analyzed CSV
+## instrument                      : Boolean flag to record stage timing and frame counts
+## archive                         : Boolean flag to return session columns for the pose archive
+## log_file                        : serial log of arduino_code.ino, None for the fixed SECTIONS
+## sync_part                       : body part tracking the video sync LED, None without
+## fps                             : video frame rate
+## Returns metrics matrix, box coordinates, instrumentation record and pose columns (None when not requested)
+def run_session(file, raw_file, corners, reverse, instrument = False, archive = False, log_file = None, sync_part = None,
+                fps = FRAME_RATE):
+    record = new_record(file = file, raw_file = raw_file) if instrument else None
+    pose   = {} if archive else None
+    start  = perf_counter()
+    if file is None:
+        results, box_coordinates = process_session(raw_file, corners, reverse, fps, record = record, pose = pose, log_file = log_file,
+                                                   sync_part = sync_part)
+    else:
+        results, box_coordinates = metrics(file, raw_file, corners, reverse, record = record, pose = pose, log_file = log_file,
+                                           sync_part = sync_part, fps = fps)
+    if record is not None:
+        record['seconds']     = perf_counter() - start
+        record['peak_rss_mb'] = max(entry['peak_rss_mb'] for entry in record['stages'].values())
+    return results, box_coordinates, record, pose
+
+## Run sessions for a list of database entries, in parallel if requested
+## Arguments
+## tasks: list of ((mouse, day), run_session() arguments) tuples
+## jobs : number of worker processes, 1 runs sessions in this process
+## Yields (mouse, day) followed by the run_session() results as sessions finish
+def run_sessions(tasks, jobs = 1):
+    if jobs <= 1:
+        for key, args in tasks:
+            yield (key,) + run_session(*args)
+        return
+
+    ## Workers are spawned so they never inherit open hdf5 file handles
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = jobs, mp_context = context) as executor:
+        futures = {executor.submit(run_session, *args): key for key, args in tasks}
+        for future in as_completed(futures):
+            yield (futures[future],) + future.result()
+
+## Section of every frame of one session from its treadmill log
+## Frames are aligned to the log clock by the onsets of the sync LED in the likelihood of sync_part when given,
+## or else by the session start and frame rate
+## Arguments
+## raw_file : DeepLabCut export of the session
+## n_frames : number of video frames
+## fps      : video frame rate
+## log_file : serial log of arduino_code.ino, None for sessions without log
+## sync_part: body part tracking the video sync LED, None without
+## Returns (frames,) section of each frame, -1 outside sections, or None without log
+def session_sections(raw_file, n_frames, fps = FRAME_RATE, log_file = None, sync_part = None):
+    if not log_file:
+        return None
+    sync_frames = None
+    if sync_part:
+        signal      = load_pose(raw_file, [sync_part], coords = ('likelihood',))[sync_part + '_likelihood'].to_numpy()
+        sync_frames = pulse_onsets(signal[:n_frames])
+    return log_sections(log_file, n_frames, fps, sync_frames)
+
+## Section of every frame of stacked sessions within its own session
+## Sessions with a treadmill log are sectioned by its motor schedule, the others by time with sections
+## Arguments
+## time, lengths: stacked time column and number of frames in each session, see batch_metrics()
+## entries      : (sessions,) database entries of the sessions
+## sections     : section boundaries of sessions without log
+## fps          : frame rate of entries without their own
+## Returns (frames,) section of each frame, -1 outside sections
+def stacked_sections(time, lengths, entries, sections = SECTIONS, fps = FRAME_RATE):
+    n_sections     = len(sections) - 1
+    labels         = section_labels(time, lengths, sections)
+    frame_sections = np.where(labels >= 0, labels % n_sections, -1)
+    offsets        = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    for offset, length, args in zip(offsets, lengths, entries):
+        if len(args) > 5 and args[5]:
+            frame_sections[offset:offset + length] = session_sections(args[1], length, session_fps(args, fps), args[5],
+                                                                      args[6] if len(args) > 6 else None)
+    return frame_sections
+
+## Recompute metrics of archived sessions without reading any CSV file, e.g. with new quadrant boundaries
+## Sessions are read from the pose archive and stacked into batch_metrics() a batch at a time
+## Sessions with a treadmill log in cohort are sectioned by its motor schedule instead of sections
+## Arguments
+## sessions     : list of (mouse, day) pairs, None for every archived session in database
+## sections     : section boundaries
+## quadrant_locs: X positions splitting the box into quadrants
+## batch        : number of sessions stacked per batch_metrics() call, bounds memory use
+## cohort       : dictionary in the format of database, None for database
+## Returns dictionary of (mouse, day) to (speeds, 6) metrics matrix
+def reanalyze(sessions = None, sections = SECTIONS, quadrant_locs = QUADRANT_LOCS, batch = 64, cohort = None):
+    cohort  = database if cohort is None else cohort
+    results = {}
+    with h5py.File('mice_data.hdf5', 'r') as mice_data:
+        if sessions is None:
+            sessions = [(mouse, day) for mouse, days in cohort.items() for day in days if has_pose(mice_data, mouse, day)]
+        for start in range(0, len(sessions), batch):
+            keys        = sessions[start:start + batch]
+            arrays      = [read_session(mice_data, mouse, day) for mouse, day in keys]
+            box_corners = np.array([box_edges(*mice_data[mouse + '/' + day + '/' + 'box'][...]) for mouse, day in keys])
+            reverse     = np.array([cohort[mouse][day][3] for mouse, day in keys], dtype = bool)
+            entries     = [cohort[mouse][day] for mouse, day in keys]
+            time, positions, steplengths, lengths = stack_sessions(arrays)
+            logged      = any(len(args) > 5 and args[5] for args in entries)
+            frame_sections = stacked_sections(time, lengths, entries, sections) if logged else None
+            allmetrics = batch_metrics(time, positions, steplengths, lengths, box_corners, reverse, sections, quadrant_locs,
+                                       frame_sections = frame_sections)
+            results.update(zip(keys, allmetrics))
+    return results
+
+## Cache keys of the box corners and metrics of one database entry
+## The box key hashes what the corners are resolved from: given corners, the picked image,
+## the raw file and rig fallback of estimated corners, or the raw file whose corner tracks are averaged
+## The metrics key hashes both input files, the box key and the analysis parameters
+## Arguments
+## args       : database entry
+## interactive: flag to pick box corners on images by hand
+## known      : input digests remembered from an earlier run
+## rig_corners: dictionary in the format of rigs, None for rigs
+## fps        : frame rate of entries without their own
+## Returns box key, metrics key and input digests
+def session_keys(args, interactive, known = None, rig_corners = None, fps = FRAME_RATE):
+    rig_corners = rigs if rig_corners is None else rig_corners
+    file, raw_file, corners, reverse = args[:4]
+    rig       = args[4] if len(args) > 4 else None
+    log_file  = args[5] if len(args) > 5 else None
+    sync_part = args[6] if len(args) > 6 else None
+    picked    = isinstance(corners, str) and interactive
+    digests   = input_digests([file, raw_file, corners if picked else None, log_file], known)
+    if picked:
+        box_key = cache_key([digest_of(digests, corners)], method = 'pick')
+    elif isinstance(corners, str):
+        box_key = cache_key([digest_of(digests, raw_file)], method = 'estimate', fallback = rig_corners.get(rig),
+                            min_likelihood = MIN_LIKELIHOOD, min_fraction = MIN_FRACTION, blocks = DRIFT_BLOCKS)
+    elif corners is None:
+        box_key = cache_key([digest_of(digests, raw_file)], method = 'tracks')
+    else:
+        box_key = cache_key([], method = 'given', corners = corners)
+    ## Sessions without log keep the keys they were cached under before logs were supported
+    ## The sync LED track is part of the raw file, which is hashed already
+    schedule    = {'log': digest_of(digests, log_file), 'motor_sections': MOTOR_SECTIONS, 'log_version': LOG_VERSION} if log_file else {}
+    if log_file and sync_part:
+        schedule['sync_part'] = sync_part
+    ## Both metrics() and process_session() time frames by the frame rate, so it is part of every key
+    metrics_key = cache_key([digest_of(digests, file), digest_of(digests, raw_file)], box = box_key, reverse = bool(reverse),
+                            sections = SECTIONS, quadrant_locs = QUADRANT_LOCS, fps = session_fps(args, fps), **schedule)
+    return box_key, metrics_key, digests
+
+## Store results of one analyzed session with their cache keys
+## Arguments
+## mice_data   : open h5py file with session metrics, box corners and pose archive
+## mice_metrics: open h5py file with the cohort metrics store
+## index       : session index of the cohort metrics store from session_index()
+## mouse, day  : session keys
+## results     : (speeds, 6) metrics matrix
+## box_corners : box corners the metrics were computed with
+## keys        : box key, metrics key and input digests from session_keys()
+## drift       : corner drift of estimated corners, None for given or picked corners
+## pose        : session columns to archive, None to keep the archive as it is
+def store_session(mice_data, mice_metrics, index, mouse, day, results, box_corners, keys, drift = None, pose = None):
+    data_key       = mouse + '/' + day + '/' + 'metrics'
+    box_corner_key = mouse + '/' + day + '/' + 'box'
+    box_value, metrics_value, digests = keys
+    ## Store mouse's metrics in h5py file with their cache key
+    if data_key in mice_data:
+        mice_data[data_key][...] = results
+    else:
+        mice_data.create_dataset(data_key, data = results)
+    write_key(mice_data[data_key], metrics_value, digests)
+
+    ## Archive session columns
+    if pose is not None:
+        write_pose(mice_data, mouse, day, pose)
+
+    ## Store box coordinates in h5py file, replacing corners resolved from other inputs
+    if box_corner_key in mice_data and not is_cached(mice_data, box_corner_key, box_value):
+        del mice_data[box_corner_key]
+    if box_corner_key not in mice_data:
+        mice_data.create_dataset(box_corner_key, data = box_corners)
+        write_key(mice_data[box_corner_key], box_value)
+        if drift is not None:
+            mice_data[box_corner_key].attrs['drift'] = drift
+
+    ## Replace or append session column of cohort metrics
+    write_session(mice_metrics, mouse, day, results, index)
+
+## Add sessions analyzed in earlier runs that are missing from the store
+## and, when asked, evict stored and cached sessions that are no longer in the cohort
+## Without prune, sessions of other manifests sharing the store are kept
+## The reverse flag and treadmill log of every stored session are kept as attributes of its group
+## Sessions with cached corner estimates drifting more than tolerance are collected for review
+## Arguments
+## mice_data, mice_metrics, index: as in store_session()
+## cohort   : dictionary in the format of database
+## tolerance: corner drift in pixels above which a session is reported for manual review
+## fps      : frame rate of entries without their own
+## prune    : flag to remove every stored session that is not in cohort
+## Returns list of (mouse, day) sessions whose estimated box corners drift more than tolerance
+def finalize_store(mice_data, mice_metrics, index, cohort, tolerance = DRIFT_TOLERANCE, fps = FRAME_RATE, prune = False):
+    keep    = set()
+    flagged = []
+    for mouse, days in cohort.items():
+        for day in days:
+            keep.add((mouse, day))
+            data_key       = mouse + '/' + day + '/' + 'metrics'
+            box_corner_key = mouse + '/' + day + '/' + 'box'
+            if (mouse, day) not in index and data_key in mice_data:
+                write_session(mice_metrics, mouse, day, mice_data[data_key][...], index)
+            if data_key in mice_data:
+                args = days[day]
+                mice_data[mouse + '/' + day].attrs['reverse']   = bool(args[3])
+                mice_data[mouse + '/' + day].attrs['raw_file']  = args[1]
+                mice_data[mouse + '/' + day].attrs['log_file']  = (args[5] if len(args) > 5 else None) or ''
+                mice_data[mouse + '/' + day].attrs['sync_part'] = (args[6] if len(args) > 6 else None) or ''
+                mice_data[mouse + '/' + day].attrs['fps']       = session_fps(args, fps)
+            if box_corner_key in mice_data and 'drift' in mice_data[box_corner_key].attrs:
+                if np.max(mice_data[box_corner_key].attrs['drift']) > tolerance:
+                    flagged.append((mouse, day))
+    if prune:
+        prune_sessions(mice_metrics, keep)
+        evict_sessions(mice_data, keep)
+    return flagged
+
+## Get the reverse flag and treadmill log a stored session was analyzed with
+## Arguments
+## mice_data : open h5py file with session metrics
+## mouse, day: session keys
+## Returns reverse flag, log file, raw file, sync LED body part (None when missing) and frame rate,
+## or None for sessions stored before the flags were kept
+def session_flags(mice_data, mouse, day):
+    attrs = mice_data[mouse + '/' + day].attrs
+    if 'reverse' not in attrs:
+        return None
+    return (bool(attrs['reverse']), attrs.get('log_file') or None, attrs.get('raw_file') or None, attrs.get('sync_part') or None,
+            float(attrs.get('fps', FRAME_RATE)))
+
+## Write instrumentation records, report sessions where the box mask threw away most frames
+## and sessions that need manual review of box corners
+## Arguments
+## records   : list of instrumentation records of analyzed sessions
+## flagged   : list of (mouse, day) sessions from finalize_store()
+## tolerance : corner drift in pixels the sessions were flagged with
+## instrument: None, 'jsonl' or 'hdf5' as in main()
+def report_sessions(records, flagged, tolerance, instrument = None):
+    if instrument == 'jsonl':
+        write_jsonl(RECORDS_FILE, records)
+    for record in records:
+        if record['flagged']:
+            print("Box mask of {mouse} {day} removed most frames: {lost}".format(mouse = record['mouse'], day = record['day'], lost = record['lost_fraction']))
+    for mouse, day in flagged:
+        print("Box corners of {mouse} {day} drift more than {tolerance} pixels, check them with --pick".format(mouse = mouse, day = day, tolerance = tolerance))
+
+## Run metrics() function on CSV files in database
+## Store in h5py file for use in mouse_coordination_score.py
+## Results are cached in mice_data.hdf5 under content hashes of the input files and analysis parameters,
+## only sessions whose inputs or parameters changed are recomputed and sessions no longer in database are evicted
+## force      : flag to recompute metrics and estimate or pick box corners of every session again
+## jobs       : number of worker processes running metrics() in parallel
+## interactive: flag to pick box corners on images by hand instead of estimating them from corner tracks
+## tolerance  : corner drift in pixels above which a session is reported for manual review
+## instrument : None, or 'jsonl' to append per-session stage timing and frame counts to RECORDS_FILE,
+##              or 'hdf5' to store them as 'instrumentation' attribute of each session's metrics
+## archive    : flag to store float32 pose columns of analyzed sessions in mice_data.hdf5 for reanalyze()
+## cohort     : dictionary in the format of database, e.g. from manifest.read_manifest(), None for database
+## rig_corners: dictionary in the format of rigs, None for rigs
+## fps        : video frame rate of sessions without their own
+## prune      : flag to remove stored sessions that are not in cohort
+## Returns list of (mouse, day) sessions whose estimated box corners drift more than tolerance
+def main(force = False, jobs = 1, interactive = False, tolerance = DRIFT_TOLERANCE, instrument = None, archive = False,
+         cohort = None, rig_corners = None, fps = FRAME_RATE, prune = False):
+    cohort      = database if cohort is None else cohort
+    rig_corners = rigs if rig_corners is None else rig_corners
+    with ExitStack() as stack:
+        ## Open h5py file to store all analyzed metrics
+        ## This process is the only one writing to either file
+        mice_data    = stack.enter_context(h5py.File('mice_data.hdf5', 'a'))
+        mice_metrics = stack.enter_context(h5py.File('mice_metrics.hdf5', 'a'))
+        
+        ## Create resizable datasets for each metric separately
+        ## Contains results from all mice for specific metric, one column per (mouse, day) session
+        create_store(mice_metrics)
+        index = session_index(mice_metrics)
+
+        ## Collect sessions whose cache key changed
+        ## Box corners are resolved serially first so interactive picking never blocks the worker pool
+        ## Without interactive picking, corners are estimated from DeepLabCut corner tracks and cached with their drift
+        tasks  = []
+        keys   = {}
+        drifts = {}
+        for mouse, days in cohort.items():
+            for day, args in days.items():
+                ## Create hdf5 keys
+                data_key       = mouse + '/' + day + '/' + 'metrics'
+                box_corner_key = mouse + '/' + day + '/' + 'box'
+                ## Check if metrics for given mouse and day were computed from the same inputs before running metrics()
+                box_value, metrics_value, digests = session_keys(args, interactive, stored_digests(mice_data, data_key), rig_corners, fps)
+                if not force and is_cached(mice_data, data_key, metrics_value) and (not archive or has_pose(mice_data, mouse, day)):
+                    continue
+                file, raw_file, corners, reverse = args[:4]
+                rig       = args[4] if len(args) > 4 else None
+                log_file  = args[5] if len(args) > 5 else None
+                sync_part = args[6] if len(args) > 6 else None
+                ## Check if box corners resolved from the same inputs exist and pass to metrics()
+                if not force and is_cached(mice_data, box_corner_key, box_value):
+                    corners = mice_data[box_corner_key][...]
+                elif isinstance(corners, str) and interactive:
+                    corners = pick_corners(corners)
+                elif isinstance(corners, str):
+                    corners, drifts[(mouse, day)] = estimate_corners(raw_file, rig_corners.get(rig))
+                keys[(mouse, day)] = (box_value, metrics_value, digests)
+                tasks.append(((mouse, day), (file, raw_file, corners, reverse, instrument is not None, archive, log_file, sync_part,
+                                             session_fps(args, fps))))
+
+        ## Compute mouse metrics for given mice and store them as sessions finish
+        ## Contains results of all metrics for a specific mouse on a specific day
+        records = []
+        for (mouse, day), results, box_corners, record, pose in run_sessions(tasks, jobs):
+            store_session(mice_data, mice_metrics, index, mouse, day, results, box_corners, keys[(mouse, day)], drifts.get((mouse, day)), pose)
+
+            ## Keep instrumentation record of session
+            if record is not None:
+                record.update(mouse = mouse, day = day)
+                records.append(record)
+                if instrument == 'hdf5':
+                    write_attribute(mice_data[mouse + '/' + day + '/' + 'metrics'], record)
+
+        flagged = finalize_store(mice_data, mice_metrics, index, cohort, tolerance, fps, prune)
+
+    report_sessions(records, flagged, tolerance, instrument)
+    return flagged
+
+## Command line entry point
+## argv: list of arguments, None for sys.argv
+def cli(argv = None):
+    parser = argparse.ArgumentParser(description = 'Compute mouse coordination metrics for sessions in a manifest')
+    parser.add_argument('manifest', help = 'CSV file with one row per session, see manifest.py')
+    parser.add_argument('--rigs', default = None, help = 'JSON file of rig name to fallback box corners')
+    parser.add_argument('--jobs', type = int, default = 1, help = 'number of worker processes running metrics() in parallel')
+    parser.add_argument('--pick', action = 'store_true', help = 'pick box corners on images by hand instead of estimating them')
+    parser.add_argument('--force', action = 'store_true', help = 'recompute every session instead of only sessions whose inputs changed')
+    parser.add_argument('--tolerance', type = float, default = DRIFT_TOLERANCE, help = 'corner drift in pixels reported for manual review')
+    parser.add_argument('--instrument', choices = ['jsonl', 'hdf5'], default = None, help = 'record per-session stage timing and frame counts')
+    parser.add_argument('--archive', action = 'store_true', help = 'store float32 pose columns of analyzed sessions for reanalyze()')
+    parser.add_argument('--fps', type = float, default = FRAME_RATE, help = 'video frame rate of sessions without an fps in the manifest')
+    parser.add_argument('--prune', action = 'store_true', help = 'remove stored sessions that are not in the manifest')
+    args = parser.parse_args(argv)
+    main(force = args.force, jobs = args.jobs, interactive = args.pick, tolerance = args.tolerance, instrument = args.instrument,
+         archive = args.archive, cohort = read_manifest(args.manifest), rig_corners = read_rigs(args.rigs) if args.rigs else rigs,
+         fps = args.fps, prune = args.prune)
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,543 @@
+## 
+## mouse_coordination_score.py
+## Mice Motor Coordination
+##
+## Compute coordination score based on statistical analysis data
+## generated from mouse_metrics.py
+##
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import starmap
+import argparse
+import multiprocessing
+import os
+import warnings
+import numpy as np
+from .manifest import read_manifest
+
+## Weights of expectation, SD and the four paw stabilities in the weighted average score
+COORDINATION_WEIGHTS = np.array([40.0, 40.0, 5.0, 5.0, 5.0, 5.0])
+
+## Compute paw stability metric
+## steplengths: Array containing average step lengths for a certain treadmill speed
+## value      : A single element from the steplengths array 
+def paw_stability(steplengths, value):
+    ## Compute median of average step length data
+    median = np.median(steplengths)
+
+    ## Compute distance of step length from median
+    if value < median:
+        center = np.count_nonzero(steplengths < median)
+        left = np.count_nonzero(steplengths < value)
+        stability = np.abs(left - center)
+    else:
+        center = np.count_nonzero(steplengths > median)
+        right = np.count_nonzero(steplengths > value)
+        stability = np.abs(right - center)
+    
+    ## Normalize from 0 to 100
+    stability /= center
+    return (1 - stability) * 100
+
+## Compute paw stability metric for many values at once
+## Sorts the step length data once and matches paw_stability() for every value
+## steplengths: Array containing average step lengths for a certain treadmill speed
+## values     : Array of elements to compute paw stability for
+def paw_stabilities(steplengths, values):
+    return ranked_stabilities(np.sort(steplengths[~np.isnan(steplengths)]), np.median(steplengths), values)
+
+## Compute paw stability metric for many values against already sorted step length data
+## ranked: Sorted step lengths without NaN
+## median: Median of all step lengths, NaN if any step length is NaN
+## values: Array of elements to compute paw stability for
+def ranked_stabilities(ranked, median, values):
+    count  = len(ranked)
+    values = np.asarray(values, dtype = np.float64)
+
+    ## Count step lengths below/above median and below/above each value with binary search
+    center_left  = np.searchsorted(ranked, median, side = 'left')
+    center_right = count - np.searchsorted(ranked, median, side = 'right')
+    left         = np.searchsorted(ranked, values, side = 'left')
+    right        = count - np.searchsorted(ranked, values, side = 'right')
+    return counted_stabilities(left, right, center_left, center_right, values < median)
+
+## Compute paw stabilities from counts of step lengths
+## left, right              : numbers of step lengths below/above each value
+## center_left, center_right: numbers of step lengths below/above the median
+## below                    : Boolean array of values below the median
+def counted_stabilities(left, right, center_left, center_right, below):
+    ## Compute distance of step length from median and normalize from 0 to 100
+    center = np.where(below, center_left, center_right)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        stability = np.abs(np.where(below, left - center_left, right - center_right)) / center
+    return (1 - stability) * 100
+
+## Compute percentiles of many scores against one reference distribution
+## Sorts the reference once and matches stats.percentileofscore(reference, score, kind = 'rank')
+## reference: Array containing reference distribution
+## scores   : Array of scores to compute percentiles for
+def percentiles_of_scores(reference, scores):
+    return ranked_percentiles(np.sort(np.ravel(reference)), scores)
+
+## Compute percentiles of many scores against an already sorted reference distribution
+## ranked: Sorted reference distribution, NaN last
+## scores: Array of scores to compute percentiles for
+def ranked_percentiles(ranked, scores):
+    scores = np.asarray(scores, dtype = np.float64)
+    count  = len(ranked)
+
+    ## NaN in the reference distribution makes every percentile NaN, as in SciPy
+    if count == 0 or np.isnan(ranked[-1]):
+        return np.full(scores.shape, np.nan)
+
+    left  = np.searchsorted(ranked, scores, side = 'left')
+    right = np.searchsorted(ranked, scores, side = 'right')
+    return counted_percentiles(left, right, count, scores)
+
+## Compute percentiles from strict and weak counts of scores in a reference distribution without NaN
+## left, right: numbers of reference values below and at most each score
+## count      : size of the reference distribution
+## scores     : Array of scores the counts belong to
+def counted_percentiles(left, right, count, scores):
+    ## Ties are ranked by averaging strict and weak counts
+    percentiles = (left + right + (left < right)) * (50.0 / count)
+    percentiles[np.isnan(scores)] = np.nan
+    return percentiles
+
+## Compute metric scores of many sessions against the cohort metrics
+## cohort  : (6, speeds, sessions) array of cohort metrics (expectation, SD and four paw step lengths)
+## sessions: (N, speeds, 6) array of metrics of sessions to score
+## Returns (N, speeds, 6) array of percentiles and paw stabilities
+def metric_scores(cohort, sessions):
+    intermediate_scores = np.zeros(sessions.shape)
+    for i in range(sessions.shape[1]):
+        ## Step 1: Percentile of mouse quadrant
+        ## 100 - percentile is used because smaller expectation is better
+        intermediate_scores[:, i, 0] = 100 - percentiles_of_scores(cohort[0, i], sessions[:, i, 0])
+        ## Step 2: Percentile of SD
+        ## 100 - percentile is used because smaller SD is better
+        intermediate_scores[:, i, 1] = 100 - percentiles_of_scores(cohort[1, i], sessions[:, i, 1])
+        ## Step 3: Paw stability
+        for paw in range(2, 6):
+            intermediate_scores[:, i, paw] = paw_stabilities(cohort[paw, i], sessions[:, i, paw])
+    return intermediate_scores
+
+## Rescale percentiles of weighted average scores into coordination scores from 1 to 5
+## percentiles: Array of percentiles
+def coordination_bins(percentiles):
+    return np.where(percentiles < 100, np.floor(percentiles / 20) + 1, 5)
+
+## Compute coordination scores from 1 to 5 of many sessions
+## Weighted average is computed using percentiles of each metrics
+## 40% for expectation of mouse quadrant, 40% for Y axis SD, 5% for each paw step length
+## cohort   : (6, speeds, sessions) array of cohort metrics
+## sessions : (N, speeds, 6) array of metrics of sessions to score
+## positions: list of N (mouse, day) indexes of sessions in the scores matrix
+## n_mice   : number of mice
+## n_days   : number of days in the scores matrix, unused days are scored as zero like in the original matrix
+## Returns (n_mice, speeds, n_days) array of coordination scores
+def score_sessions(cohort, sessions, positions, n_mice, n_days = 12):
+    ## Declare matrix for raw weighted average scores
+    raw_scores = np.zeros((n_mice, cohort.shape[1], n_days))
+
+    ## Compute percentiles for each metric of all sessions at once
+    if len(positions):
+        intermediate_scores = metric_scores(cohort, sessions)
+
+        ## Step 4: Weighted average
+        index1, index2 = np.array(positions).T
+        raw_scores[index1, :, index2] = np.average(intermediate_scores, axis = 2, weights = COORDINATION_WEIGHTS)
+
+    ## Flatten weighted average scores matrix into 1 dimension for computing percentiles
+    ## Compute percentile for every weighted average score and rescale coordination score from 1 to 5
+    raw_scores_merged = raw_scores.flatten()
+    return coordination_bins(percentiles_of_scores(raw_scores_merged, raw_scores))
+
+## Number of bootstrap replicates rescored together, bounds memory of one chunk
+BOOTSTRAP_CHUNK = 200
+
+## Sort a reference distribution once and count how many times each replicate draws its values
+## Replicates are the last axis, so counts of one reference value in all replicates are contiguous
+## reference: Array containing reference distribution
+## draws    : (count, replicates) number of times each reference value is drawn in each replicate
+## Returns sorted reference, number of non-NaN values and (count + 1, replicates) cumulative draws starting at zero
+def resampled_ranks(reference, draws):
+    order      = np.argsort(reference, kind = 'stable')
+    ranked     = reference[order]
+    valid      = np.count_nonzero(~np.isnan(ranked))
+    cumulative = np.zeros((len(ranked) + 1, draws.shape[1]), dtype = np.int64)
+    np.cumsum(draws[order], axis = 0, out = cumulative[1:])
+    return ranked[:valid], valid, cumulative
+
+## Compute percentiles of many scores against many resampled copies of one reference distribution
+## Matches percentiles_of_scores() on the reference values repeated by their number of draws
+## reference: Array containing reference distribution
+## draws    : (count, replicates) number of times each reference value is drawn in each replicate
+## scores   : (N,) array of scores
+## Returns (N, replicates) array of percentiles
+def resampled_percentiles(reference, draws, scores):
+    ranked, valid, cumulative = resampled_ranks(reference, draws)
+    count = cumulative[-1]
+
+    ## Weighted strict and weak counts share one binary search over the sorted reference
+    left  = cumulative[np.searchsorted(ranked, scores, side = 'left')]
+    right = cumulative[np.searchsorted(ranked, scores, side = 'right')]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        percentiles = (left + right + (left < right)) * (50.0 / count)
+
+    ## Replicates drawing a NaN reference value have NaN percentiles, as in SciPy
+    percentiles[:, (cumulative[valid] < count) | (count == 0)] = np.nan
+    percentiles[np.isnan(scores)] = np.nan
+    return percentiles
+
+## Compute paw stabilities of many values against many resampled copies of one step length distribution
+## Matches paw_stabilities() on the step lengths repeated by their number of draws
+## steplengths: Array containing average step lengths for a certain treadmill speed
+## draws      : (count, replicates) number of times each step length is drawn in each replicate
+## values     : (N,) array of elements to compute paw stability for
+## Returns (N, replicates) array of paw stabilities
+def resampled_stabilities(steplengths, draws, values):
+    ranked, valid, cumulative = resampled_ranks(steplengths, draws)
+    count = cumulative[-1]
+    drawn = cumulative[valid]
+
+    ## Median of each replicate is the mean of its two middle order statistics, NaN if a NaN was drawn
+    lower  = np.count_nonzero(cumulative[1:] <= (count - 1) // 2, axis = 0)
+    upper  = np.count_nonzero(cumulative[1:] <= count // 2, axis = 0)
+    padded = np.append(ranked, np.nan)
+    median = (padded[np.minimum(lower, valid)] + padded[np.minimum(upper, valid)]) / 2
+    median[drawn < count] = np.nan
+
+    ## Count step lengths below/above median and below/above each value with binary search
+    replicates   = np.arange(len(median))
+    below        = values[:, None] < median
+    center_left  = cumulative[np.searchsorted(ranked, median, side = 'left'), replicates]
+    center_right = drawn - cumulative[np.searchsorted(ranked, median, side = 'right'), replicates]
+    left         = cumulative[np.searchsorted(ranked, values, side = 'left')]
+    right        = drawn - cumulative[np.searchsorted(ranked, values, side = 'right')]
+
+    ## Compute distance of step length from median and normalize from 0 to 100
+    center = np.where(below, center_left, center_right)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        stability = np.abs(np.where(below, left - center_left, right - center_right)) / center
+    return (1 - stability) * 100
+
+## Compute percentiles of every value within its own row, like percentiles_of_scores(row, row)
+## values: (replicates, N) array
+## Returns (replicates, N) array of percentiles
+def row_percentiles(values):
+    count  = values.shape[1]
+    order  = np.argsort(values, axis = 1, kind = 'stable')
+    ranked = np.take_along_axis(values, order, axis = 1)
+    index  = np.broadcast_to(np.arange(count), ranked.shape)
+
+    ## Strict count of a value is the position of its first tie, weak count is one past its last tie
+    starts = np.ones(ranked.shape, dtype = bool)
+    starts[:, 1:] = ranked[:, 1:] != ranked[:, :-1]
+    ends   = np.ones(ranked.shape, dtype = bool)
+    ends[:, :-1]  = starts[:, 1:]
+    left   = np.maximum.accumulate(np.where(starts, index, 0), axis = 1)
+    right  = np.minimum.accumulate(np.where(ends, index + 1, count)[:, ::-1], axis = 1)[:, ::-1]
+
+    ## Scatter ranks back to the original order, rows containing NaN are NaN
+    percentiles = np.empty(values.shape)
+    np.put_along_axis(percentiles, order, (left + right + (left < right)) * (50.0 / count), axis = 1)
+    percentiles[np.isnan(ranked[:, -1])] = np.nan
+    return percentiles
+
+## Compute coordination scores of many sessions against many resampled cohorts at once
+## Matches score_sessions() on the cohort sessions repeated by their multiplicities
+## cohort        : (6, speeds, sessions) array of cohort metrics
+## sessions      : (N, speeds, 6) array of metrics of sessions to score
+## positions     : list of N (mouse, day) indexes of sessions in the scores matrix
+## n_mice        : number of mice
+## n_days        : number of days in the scores matrix
+## multiplicities: (replicates, cohort sessions) number of times each cohort session is drawn in each replicate
+## Returns (replicates, n_mice, speeds, n_days) array of coordination scores
+def replicate_scores(cohort, sessions, positions, n_mice, n_days, multiplicities):
+    replicates = len(multiplicities)
+    raw_scores = np.zeros((replicates, n_mice, cohort.shape[1], n_days))
+
+    if len(positions):
+        ## Percentiles and paw stabilities of all sessions in all replicates, one speed and metric at a time
+        draws = np.ascontiguousarray(multiplicities.T)
+        intermediate_scores = np.zeros((sessions.shape[2], sessions.shape[1], len(sessions), replicates))
+        for i in range(sessions.shape[1]):
+            intermediate_scores[0, i] = 100 - resampled_percentiles(cohort[0, i], draws, sessions[:, i, 0])
+            intermediate_scores[1, i] = 100 - resampled_percentiles(cohort[1, i], draws, sessions[:, i, 1])
+            for paw in range(2, 6):
+                intermediate_scores[paw, i] = resampled_stabilities(cohort[paw, i], draws, sessions[:, i, paw])
+
+        ## Weighted average, scattered into the zero padded scores matrix of each replicate
+        index1, index2 = np.array(positions).T
+        averages = np.average(intermediate_scores, axis = 0, weights = COORDINATION_WEIGHTS)
+        raw_scores[:, index1, :, index2] = averages.transpose(1, 2, 0)
+
+    ## Percentile of every weighted average score within its replicate, rescaled from 1 to 5
+    percentiles = row_percentiles(raw_scores.reshape(replicates, -1))
+    return coordination_bins(percentiles.reshape(raw_scores.shape))
+
+## Compute day-wise cohort means of coordination scores with weighted mice
+## scores   : (replicates, n_mice, speeds, n_days) array of coordination scores
+## present  : (n_mice, n_days) Boolean mask of recorded sessions
+## weights  : (replicates, n_mice) weight of each mouse, e.g. number of times it is drawn
+## Returns (replicates, speeds, n_days) array of means over recorded sessions
+def cohort_means(scores, present, weights):
+    weights = weights[:, :, None] * present[None]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.einsum('bmd,bmsd->bsd', weights, scores) / weights.sum(axis = 1)[:, None, :]
+
+## Get mask of recorded sessions in the scores matrix
+## positions: list of (mouse, day) indexes of sessions
+def session_mask(positions, n_mice, n_days):
+    present = np.zeros((n_mice, n_days), dtype = bool)
+    if len(positions):
+        index1, index2 = np.array(positions).T
+        present[index1, index2] = True
+    return present
+
+## Rescore one chunk of bootstrap replicates
+## Each replicate draws the cohort sessions with replacement to rescore every session,
+## and draws the mice with replacement to average the day-wise cohort means
+## Arguments as in bootstrap_scores(), plus
+## replicates: number of replicates in the chunk
+## seed      : seed sequence of the chunk
+## Returns (n_mice, speeds, n_days, 5) counts of each coordination score and (replicates, speeds, n_days) cohort means
+def bootstrap_chunk(cohort, sessions, positions, n_mice, n_days, replicates, seed):
+    rng        = np.random.default_rng(seed)
+    n_sessions = cohort.shape[2]
+    multiplicities = rng.multinomial(n_sessions, np.full(n_sessions, 1.0 / n_sessions), size = replicates)
+    mice           = rng.multinomial(n_mice, np.full(n_mice, 1.0 / n_mice), size = replicates)
+
+    scores = replicate_scores(cohort, sessions, positions, n_mice, n_days, multiplicities)
+    counts = np.stack([np.count_nonzero(scores == score, axis = 0) for score in range(1, 6)], axis = -1)
+    return counts, cohort_means(scores, session_mask(positions, n_mice, n_days), mice)
+
+## Bootstrap confidence intervals of coordination scores and day-wise cohort means
+## Replicates are rescored in chunks of vectorized arrays, chunks run in worker processes if jobs > 1
+## Results depend on the seed and chunk size, not on the number of jobs
+## Arguments
+## cohort    : (6, speeds, sessions) array of cohort metrics
+## sessions  : (N, speeds, 6) array of metrics of sessions to score
+## positions : list of N (mouse, day) indexes of sessions in the scores matrix
+## n_mice    : number of mice
+## n_days    : number of days in the scores matrix
+## replicates: number of bootstrap replicates
+## confidence: confidence level of the intervals
+## chunk     : number of replicates rescored together
+## jobs      : number of worker processes, 1 rescores in this process
+## seed      : random seed
+## Returns dictionary of score_low/score_high (n_mice, speeds, n_days) and mean_low/mean_high (speeds, n_days)
+## bounds, day_low/day_high (n_days,) bounds of the means over all speeds, and score_counts of each score from 1 to 5
+def bootstrap_scores(cohort, sessions, positions, n_mice, n_days = 12, replicates = 10000, confidence = 0.95,
+                     chunk = BOOTSTRAP_CHUNK, jobs = 1, seed = 0):
+    sizes = [min(chunk, replicates - start) for start in range(0, replicates, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(cohort, sessions, positions, n_mice, n_days, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+
+    counts = np.zeros((n_mice, cohort.shape[1], n_days, 5), dtype = np.int64)
+    means  = []
+    with ExitStack() as stack:
+        if jobs > 1:
+            context  = multiprocessing.get_context('spawn')
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers = jobs, mp_context = context))
+            results  = executor.map(bootstrap_chunk, *zip(*tasks))
+        else:
+            results  = starmap(bootstrap_chunk, tasks)
+        for chunk_counts, chunk_means in results:
+            counts += chunk_counts
+            means.append(chunk_means)
+    means = np.concatenate(means) if means else np.full((0, cohort.shape[1], n_days), np.nan)
+
+    ## Percentile intervals, scores from 1 to 5 use the smallest score whose cumulative share reaches each bound
+    alpha      = (1 - confidence) / 2
+    cumulative = np.cumsum(counts, axis = -1) / max(replicates, 1)
+    ## Days without any recorded session have NaN bounds
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        bounds     = np.nanpercentile(means, [100 * alpha, 100 * (1 - alpha)], axis = 0)
+        day_bounds = np.nanpercentile(means.mean(axis = 1), [100 * alpha, 100 * (1 - alpha)], axis = 0)
+    return {'score_low'   : np.argmax(cumulative >= alpha, axis = -1) + 1,
+            'score_high'  : np.argmax(cumulative >= 1 - alpha, axis = -1) + 1,
+            'score_counts': counts,
+            'mean_low'    : bounds[0],
+            'mean_high'   : bounds[1],
+            'day_low'     : day_bounds[0],
+            'day_high'    : day_bounds[1]}
+
+## Permutation test of the difference of day-wise cohort means between two groups of mice
+## Group labels are shuffled in batches of permutations and all means are computed at once
+## Arguments
+## scores      : (n_mice, speeds, n_days) array of coordination scores
+## present     : (n_mice, n_days) Boolean mask of recorded sessions
+## group       : (n_mice,) Boolean array, True for mice of the first group
+## permutations: number of label permutations
+## chunk       : number of permutations computed together
+## seed        : random seed
+## Returns (speeds, n_days) observed differences and two-sided p-values
+def permutation_test(scores, present, group, permutations = 10000, chunk = BOOTSTRAP_CHUNK, seed = 0):
+    rng    = np.random.default_rng(seed)
+    group  = np.asarray(group, dtype = bool)
+
+    ## Difference of means of the first and second group for each row of labels
+    def differences(labels):
+        batch = np.broadcast_to(scores, (len(labels),) + scores.shape)
+        return cohort_means(batch, present, labels.astype(np.float64)) - cohort_means(batch, present, (~labels).astype(np.float64))
+
+    observed = differences(group[None])[0]
+    extreme  = np.zeros(observed.shape, dtype = np.int64)
+    for start in range(0, permutations, chunk):
+        labels   = rng.permuted(np.tile(group, (min(chunk, permutations - start), 1)), axis = 1)
+        extreme += np.count_nonzero(np.abs(differences(labels)) >= np.abs(observed), axis = 0)
+    return observed, (extreme + 1) / (permutations + 1)
+
+## Read cohort metrics and the metrics of every session to score
+## Arguments
+## mice_data   : open h5py file with session metrics
+## mice_metrics: open h5py file with the cohort metrics store
+## manifest    : dictionary of mouse to days to score, None for every mouse in mice_data
+## Returns cohort array, (N, speeds, 6) session metrics, their (mouse, day) positions, mouse names and day names of each mouse
+def read_cohort(mice_data, mice_metrics, manifest = None):
+    ## Extract metrics keys into matrices
+    ## Probability and expectation of quadrant
+    ## Used to determine mouse head's expected position in box
+    ## If expectation is closer to 1, motor coordination is better 
+    expectation = mice_metrics['expectation'][...]
+
+    ## Y axis standard deviation (SD)
+    ## Used to determine whether mouse moves sideways on treadmill
+    ## If SD is smaller, motor coordination is better
+    sd = mice_metrics['sd'][...]
+
+    ## Step length mean
+    ## Used to determine whether mouse is actually moving or staying in place
+    ## If step length is larger, motor coordination is better        
+    lfp_steplength = mice_metrics['lfp_steplength'][...] # Left Front Paw Step Length Mean
+    rfp_steplength = mice_metrics['rfp_steplength'][...] # Right Front Paw Step Length Mean
+    lhp_steplength = mice_metrics['lhp_steplength'][...] # Left Hind Paw Step Length Mean
+    rhp_steplength = mice_metrics['rhp_steplength'][...] # Right Hind Paw Step Length Mean
+    cohort = np.array([expectation, sd, lfp_steplength, rfp_steplength, lhp_steplength, rhp_steplength])
+
+    ## Get mice data keys from hdf5 file
+    mice_keys = list(mice_data.keys()) if manifest is None else list(manifest)
+    mice_days = {mouse: list(mice_data[mouse].keys()) if manifest is None else list(manifest[mouse]) for mouse in mice_keys}
+
+    ## Extract metrics for every mouse on every day
+    positions = []
+    sessions  = []
+    for index1, mouse in enumerate(mice_keys):
+        day_keys = mice_days[mouse]
+        for index2, day in enumerate(day_keys):
+            key = mouse + '/' + day + '/' + 'metrics'
+            positions.append((index1, index2))
+            sessions.append(mice_data[key][...])
+    return cohort, np.array(sessions), positions, mice_keys, mice_days
+
+## Arguments
+## replicates: number of bootstrap replicates for confidence intervals, 0 to plot standard errors only
+## confidence: confidence level of the intervals
+## jobs      : number of worker processes rescoring bootstrap replicates
+## manifest  : dictionary of mouse to days to score, e.g. from manifest.read_manifest(), None for every mouse in mice_data.hdf5
+## show      : Boolean flag to show the cohort plot after saving it, blocks until the window is closed
+## incremental: Boolean flag to score against the persistent ranks of rank_store.py and only rewrite
+##              CSV files of mice whose coordination scores changed since the last incremental scoring
+def main(replicates = 0, confidence = 0.95, jobs = 1, manifest = None, show = True, incremental = False):
+    import pandas as pd
+    import h5py
+    import matplotlib.pyplot as plt
+    from .metrics_store import read_metrics
+    from .rank_store import incremental_scores
+
+    ## Import mice metrics from file
+    with ExitStack() as stack:
+        ## Import analyzed mice data and mice metrics
+        mice_data    = stack.enter_context(h5py.File('mice_data.hdf5', 'a'))
+        mice_metrics = stack.enter_context(h5py.File('mice_metrics.hdf5', 'a'))
+        
+        ## Compute coordination scores of all sessions
+        ## Incremental scoring reads the cohort from the metrics store only and reports mice whose scores changed
+        if incremental:
+            cohort, sessions, positions, mice_keys, mice_days, all_scores, changed = incremental_scores(mice_metrics, manifest)
+        else:
+            ## Mice may have different numbers of days, the scores matrix has room for the longest one
+            cohort, sessions, positions, mice_keys, mice_days = read_cohort(mice_data, mice_metrics, manifest)
+            n_days     = max([12] + [len(days) for days in mice_days.values()])
+            all_scores = score_sessions(cohort, sessions, positions, len(mice_keys), n_days)
+            changed    = set(mice_keys)
+        n_days  = all_scores.shape[2]
+        present = session_mask(positions, len(mice_keys), n_days)
+        if replicates > 0:
+            ## Incremental scoring does not read the cohort, bootstrap replicates resample it
+            if cohort is None:
+                cohort = read_metrics(mice_metrics)
+            intervals = bootstrap_scores(cohort, sessions, positions, len(mice_keys), n_days, replicates = replicates,
+                                         confidence = confidence, jobs = jobs)
+        row_names = ['3m/min', '6m/min', '8m/min', '10m/min', '12m/min']
+        ## Store coordination score for each mouse
+        for index, mouse in enumerate(mice_keys):
+            
+            ## Declare matrix for coordination scores
+            ## Coordination score is computed using percentiles of weighted average score
+            day_keys = mice_days[mouse]
+            coordination_scores = all_scores[index, :, :len(day_keys)]
+            
+            ## Convert to Pandas frame with row/column names for clarity
+            ## Export frame to CSV, unless scores of the mouse did not change since it was written
+            if mouse in changed or not os.path.exists(mouse + '_coordination_scores.csv'):
+                coordination_scores_frame = pd.DataFrame(data = coordination_scores, index = row_names, columns = day_keys)
+                coordination_scores_frame.to_csv(mouse + '_coordination_scores.csv')
+
+            ## Export lower and upper bootstrap bounds of every score
+            if replicates > 0:
+                bounds = np.vstack((intervals['score_low'][index, :, :len(day_keys)], intervals['score_high'][index, :, :len(day_keys)]))
+                bounds_index = pd.MultiIndex.from_product([['low', 'high'], row_names], names = ['bound', 'speed'])
+                pd.DataFrame(data = bounds, index = bounds_index, columns = day_keys).to_csv(mouse + '_coordination_scores_ci.csv')
+
+        ## Compute mean and standard error of coordination scores of every speed of every mouse, up to the last recorded day
+        ## Days a mouse was not recorded on are left out, so mice with fewer days do not count as zero scores
+        days = present.any(axis = 0).nonzero()[0].max() + 1 if present.any() else 0
+        coordination_scores_matrix = np.where(present[:, None, :days], all_scores[:, :, :days], np.nan).reshape(-1, days)
+        count = np.count_nonzero(~np.isnan(coordination_scores_matrix), axis = 0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            coordination_score_means = np.nansum(coordination_scores_matrix, axis = 0) / count
+            coordination_score_error = np.nanstd(coordination_scores_matrix, axis = 0, ddof = 1) / np.sqrt(count)
+
+        ## Replace standard errors by bootstrap confidence intervals of the day-wise means
+        if replicates > 0:
+            days = len(coordination_score_means)
+            low  = intervals['day_low'][:days]
+            high = intervals['day_high'][:days]
+            coordination_score_error = np.maximum([coordination_score_means - low, high - coordination_score_means], 0)
+            pd.DataFrame(data = [coordination_score_means, low, high], index = ['mean', 'low', 'high'],
+                         columns = range(1, days + 1)).to_csv('coordination_score_means_ci.csv')
+
+        ## Plot results
+        days = range(1, len(coordination_score_means) + 1)
+        plt.errorbar(days, coordination_score_means, yerr = coordination_score_error, marker = 'o', capsize = 4)
+        plt.xticks(days)
+        plt.yticks(range(6))
+        plt.xlabel('Day')
+        plt.ylabel('Average Coordination Score')
+        plt.tight_layout()
+        plt.savefig('coordinationscore.png', dpi = 300)
+        if show:
+            plt.show()
+
+## Command line entry point
+## argv: list of arguments, None for sys.argv
+def cli(argv = None):
+    parser = argparse.ArgumentParser(description = 'Compute coordination scores of all sessions in mice_data.hdf5')
+    parser.add_argument('manifest', nargs = '?', default = None, help = 'CSV file of sessions to score, every stored session if omitted')
+    parser.add_argument('--bootstrap', type = int, default = 0, help = 'number of bootstrap replicates for confidence intervals')
+    parser.add_argument('--confidence', type = float, default = 0.95, help = 'confidence level of bootstrap intervals')
+    parser.add_argument('--jobs', type = int, default = 1, help = 'number of worker processes rescoring bootstrap replicates')
+    parser.add_argument('--no-show', action = 'store_true', help = 'only save the cohort plot, do not open a window')
+    parser.add_argument('--incremental', action = 'store_true', help = 'rank new sessions into mice_ranks.hdf5 and only rewrite changed CSV files')
+    args = parser.parse_args(argv)
+    main(replicates = args.bootstrap, confidence = args.confidence, jobs = args.jobs,
+         manifest = read_manifest(args.manifest) if args.manifest else None, show = not args.no_show, incremental = args.incremental)
+
+if __name__ == '__main__':
+    cli()
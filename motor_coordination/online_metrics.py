@@ -0,0 +1,281 @@
+##
+## online_metrics.py
+## Mouse Motor Coordination
+##
+## Streaming session metrics from live pose frames and treadmill serial events
+## Running accumulators per speed section give provisional metrics during the session
+## and the same 5 x 6 matrix as metrics() at session end
+##
+
+import argparse
+import re
+import sys
+import time
+import numpy as np
+from .mouse_coordination_metrics import QUADRANT_LOCS, SECTIONS, box_edges
+
+## Body parts of pose lines, X and Y of each in this order
+POSE_PARTS = ['head', 'lfp', 'rfp', 'lhp', 'rhp']
+
+## Motor PWM values of arduino_code.ino for each section: default speed, then motorArr
+MOTOR_VALUES = [64, 98, 122, 156, 190]
+
+## Serial lines printed by arduino_code.ino, and pose lines "pose,<millis>,<head_x>,<head_y>,<lfp_x>,..."
+START_PATTERN = re.compile(r'START SESSION.*millis\s*=\s*(\d+)')
+END_PATTERN   = re.compile(r'END session.*millis\s*=\s*(\d+)')
+MOTOR_PATTERN = re.compile(r'motorVal\s*=\s*(\d+),\s*millis\s*=\s*(\d+)')
+SYNC_PATTERN  = re.compile(r'syncOut,\s*millis\s*=\s*(\d+)')
+
+## Create running accumulators of one session
+## Memory does not grow with session length
+## Arguments
+## box_corners  : (4, N, 2) bottom left, top left, top right and bottom right corners, e.g. from the hdf5 box cache
+## reverse      : Boolean flag to indicate mouse running in reverse
+## sections     : section boundaries in seconds
+## quadrant_locs: X positions splitting the box into quadrants
+## Returns accumulator dictionary
+def new_accumulator(box_corners, reverse = False, sections = SECTIONS, quadrant_locs = QUADRANT_LOCS):
+    n_sections  = len(sections) - 1
+    n_quadrants = len(quadrant_locs) - 1
+    return {'edges': box_edges(*np.asarray(box_corners, dtype = np.float64)), 'reverse': bool(reverse),
+            'sections': np.asarray(sections, dtype = np.float64), 'quadrant_locs': np.asarray(quadrant_locs, dtype = np.float64),
+            'histogram': np.zeros((n_sections, n_quadrants)),
+            'y_count': np.zeros(n_sections), 'y_mean': np.zeros(n_sections), 'y_m2': np.zeros(n_sections),
+            'step_sum': np.zeros((n_sections, 4)), 'step_count': np.zeros((n_sections, 4)),
+            'previous': None, 'pending': None, 'frames': 0}
+
+## Find section of a frame from its time and the time of the next frame
+## Like section_labels(), a section starts at the frame nearest to its boundary, ties going to the earlier frame,
+## so a frame right before a boundary is only placed once the next frame is known
+## Arguments
+## sections: section boundaries
+## current : time of frame
+## following: time of next frame, None at session end
+## Returns section index, -1 outside of any section
+def frame_section(sections, current, following):
+    passed = sections <= current
+    if following is None:
+        ## Boundaries after the last frame start at the last frame
+        passed |= sections > current
+    else:
+        passed |= (sections > current) & (sections <= following) & (sections - current <= following - sections)
+    section = np.count_nonzero(passed) - 1
+    return section if 0 <= section < len(sections) - 1 else -1
+
+## Add a placed frame to the running accumulators of its section
+## Arguments
+## state      : accumulator dictionary
+## section    : section index from frame_section()
+## positions  : (5, 2) X/Y positions of head, LFP, RFP, LHP, RHP in pixels
+## steplengths: (4,) step lengths of LFP, RFP, LHP, RHP
+def accumulate(state, section, positions, steplengths):
+    if section < 0:
+        return
+    left, right, top, bottom = state['edges']
+    x = positions[:, 0]
+    y = positions[:, 1]
+    inside = (x >= left) & (x <= right) & (y >= top) & (y <= bottom)
+    normalized = np.column_stack(((x - left) / (right - left), (y - top) / (bottom - top)))
+    if state['reverse']:
+        normalized = 1 - normalized
+
+    ## Quadrant histogram and Welford update of head Y
+    if inside[0]:
+        quadrant = np.searchsorted(state['quadrant_locs'], normalized[0, 0], side = 'right') - 1
+        if quadrant < state['histogram'].shape[1] - 1:
+            state['histogram'][section, quadrant] += 1
+        state['y_count'][section] += 1
+        delta = normalized[0, 1] - state['y_mean'][section]
+        state['y_mean'][section] += delta / state['y_count'][section]
+        state['y_m2'][section]   += delta * (normalized[0, 1] - state['y_mean'][section])
+
+    ## Running sums of step lengths of paws inside the box
+    paws = inside[1:]
+    state['step_sum'][section, paws]   += steplengths[paws]
+    state['step_count'][section, paws] += 1
+
+## Add a new pose frame
+## Step length is taken from the previous frame, and the previous frame is placed into its section now that its successor is known
+## Arguments
+## state    : accumulator dictionary
+## seconds  : frame time since session start
+## positions: (5, 2) X/Y positions of head, LFP, RFP, LHP, RHP in pixels, NaN where not tracked
+def add_frame(state, seconds, positions):
+    positions = np.asarray(positions, dtype = np.float64).reshape(len(POSE_PARTS), 2)
+    previous  = state['previous'] if state['previous'] is not None else np.full(positions.shape, np.nan)
+    steplengths = np.hypot(*(positions[1:] - previous[1:]).T)
+    if state['pending'] is not None:
+        pending_seconds, pending_positions, pending_steplengths = state['pending']
+        accumulate(state, frame_section(state['sections'], pending_seconds, seconds), pending_positions, pending_steplengths)
+    state['pending']  = (float(seconds), positions, steplengths)
+    state['previous'] = positions
+    state['frames']  += 1
+
+## Get metrics from the running accumulators
+## Arguments
+## state: accumulator dictionary
+## Returns (speeds, 6) matrix of E[Q], head Y SD and LFP, RFP, LHP, RHP mean step length, NaN for sections without frames
+def current_metrics(state):
+    results = np.zeros((len(state['sections']) - 1, 6))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        histogram     = state['histogram']
+        results[:, 0] = histogram @ np.arange(1, histogram.shape[1] + 1) / histogram.sum(axis = 1)
+        results[:, 1] = np.sqrt(state['y_m2'] / state['y_count'])
+        results[:, 2:] = state['step_sum'] / state['step_count']
+    return results
+
+## Finish the session, placing the last frame, and get final metrics
+## Arguments
+## state: accumulator dictionary
+## Returns same (speeds, 6) matrix as metrics()
+def finish(state):
+    if state['pending'] is not None:
+        pending_seconds, pending_positions, pending_steplengths = state['pending']
+        accumulate(state, frame_section(state['sections'], pending_seconds, None), pending_positions, pending_steplengths)
+        state['pending'] = None
+    return current_metrics(state)
+
+## Read lines from a file path, '-' for standard input, or any iterable of lines such as an open serial port or pipe
+## Arguments
+## source: path or iterable of str/bytes lines
+## Yields lines without trailing newline
+def read_lines(source):
+    if isinstance(source, str):
+        handle = sys.stdin if source == '-' else open(source)
+        try:
+            for line in handle:
+                yield line.rstrip('\r\n')
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+        return
+    for line in source:
+        if isinstance(line, bytes):
+            line = line.decode('ascii', errors = 'replace')
+        yield line.rstrip('\r\n')
+
+## Score a session from a stream of serial lines
+## Pose lines before START SESSION are ignored, times are taken relative to the START SESSION millis
+## Arguments
+## lines      : iterable of lines from read_lines()
+## box_corners: (4, N, 2) box corners, None to take them from a "box=" header line
+## reverse    : Boolean flag to indicate mouse running in reverse
+## every      : seconds of session time between provisional results, None for no provisional results
+## callback   : function called with (seconds, provisional metrics) every interval, prints them if None
+## Returns final (speeds, 6) metrics matrix and list of (event, millis, value) treadmill events
+def score_stream(lines, box_corners = None, reverse = False, every = None, callback = None):
+    state  = None
+    start  = None
+    events = []
+    next_report = every
+    for line in lines:
+        if line.startswith('box='):
+            if box_corners is None:
+                box_corners = np.array(line[4:].split(','), dtype = np.float64).reshape(4, 1, 2)
+            continue
+        match = START_PATTERN.search(line)
+        if match:
+            start = int(match.group(1))
+            if box_corners is None:
+                raise ValueError('Box corners must be given or sent in a box= header line before the session starts')
+            state = new_accumulator(box_corners, reverse)
+            events.append(('start', start, None))
+            continue
+        if start is None:
+            continue
+        if line.startswith('pose,'):
+            values  = line.split(',')
+            seconds = (float(values[1]) - start) / 1000
+            add_frame(state, seconds, np.array(values[2:], dtype = np.float64))
+            if every is not None and seconds >= next_report:
+                next_report += every
+                provisional = current_metrics(state)
+                if callback is None:
+                    print('### Provisional metrics at {seconds:.0f} s ###'.format(seconds = seconds))
+                    print(np.array2string(provisional, precision = 3))
+                else:
+                    callback(seconds, provisional)
+            continue
+        match = MOTOR_PATTERN.search(line)
+        if match:
+            events.append(('motor', int(match.group(2)), int(match.group(1))))
+            continue
+        match = SYNC_PATTERN.search(line)
+        if match:
+            events.append(('sync', int(match.group(1)), None))
+            continue
+        match = END_PATTERN.search(line)
+        if match:
+            events.append(('end', int(match.group(1)), None))
+            break
+    if state is None:
+        raise ValueError('No START SESSION line found in serial stream')
+    return finish(state), events
+
+## Replay a recorded DeepLabCut session as serial lines, to run the online scorer without hardware
+## Lines follow arduino_code.ino: header, START SESSION, motor and sync events, END session,
+## with a pose line for every video frame
+## Arguments
+## raw_file   : DeepLabCut CSV or H5 export
+## box_corners: (4, N, 2) box corners sent in the header, None to send none
+## fps        : video frame rate
+## realtime   : Boolean flag to pace lines like the live session
+## Yields serial lines
+def simulate_serial(raw_file, box_corners = None, fps = 30.0, realtime = False):
+    from .deeplabcut_loader import load_pose
+
+    pose      = load_pose(raw_file, POSE_PARTS)
+    positions = pose[[part + coord for part in POSE_PARTS for coord in ['_x', '_y']]].to_numpy(dtype = np.float64)
+    millis    = np.arange(len(positions)) * 1000.0 / fps
+
+    yield 'programName=online_metrics_simulator'
+    if box_corners is not None:
+        corners = np.asarray(box_corners, dtype = np.float64).reshape(4, -1, 2).mean(axis = 1)
+        yield 'box=' + ','.join(str(float(value)) for value in corners.ravel())
+    yield 'END HEADER'
+    yield 'START SESSION button, millis = 0'
+
+    ## Motor and sync events interleaved with frames in time order, one motor speed per section
+    events  = [(boundary * 1000, 'motorVal={value}, millis = {millis}'.format(value = value, millis = int(boundary * 1000)))
+               for boundary, value in zip(SECTIONS[:-1], MOTOR_VALUES)]
+    events += [(sync, 'syncOut, millis = {millis}'.format(millis = int(sync))) for sync in np.arange(0, millis[-1] + 1 if len(millis) else 0, 5000)]
+    events.sort()
+    event  = 0
+    begin  = time.monotonic()
+    for frame, values in zip(millis, positions):
+        while event < len(events) and events[event][0] <= frame:
+            yield events[event][1]
+            event += 1
+        if realtime:
+            time.sleep(max(0.0, begin + frame / 1000 - time.monotonic()))
+        yield 'pose,' + str(float(frame)) + ',' + ','.join(str(float(value)) for value in values)
+    yield 'END session button, millis={millis}'.format(millis = int(millis[-1]) + 1 if len(millis) else 0)
+
+## Command line entry point
+## argv: list of arguments, None for sys.argv
+def cli(argv = None):
+    parser   = argparse.ArgumentParser(description = 'Score a treadmill session while it runs')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    simulate = commands.add_parser('simulate', help = 'replay a DeepLabCut export as serial lines on standard output')
+    simulate.add_argument('raw_file', help = 'DeepLabCut CSV or H5 export')
+    simulate.add_argument('--box', type = float, nargs = 8, default = None, help = 'bottom left, top left, top right and bottom right X/Y')
+    simulate.add_argument('--fps', type = float, default = 30.0, help = 'video frame rate')
+    simulate.add_argument('--realtime', action = 'store_true', help = 'pace lines like the live session')
+    score = commands.add_parser('score', help = 'score serial lines from a log file or standard input')
+    score.add_argument('source', nargs = '?', default = '-', help = 'serial log file, - for standard input')
+    score.add_argument('--box', type = float, nargs = 8, default = None, help = 'bottom left, top left, top right and bottom right X/Y')
+    score.add_argument('--reverse', action = 'store_true', help = 'mouse is running in reverse')
+    score.add_argument('--every', type = float, default = 30.0, help = 'seconds between provisional metrics')
+    args = parser.parse_args(argv)
+
+    box_corners = None if args.box is None else np.array(args.box).reshape(4, 1, 2)
+    if args.command == 'simulate':
+        for line in simulate_serial(args.raw_file, box_corners, args.fps, args.realtime):
+            print(line, flush = args.realtime)
+    else:
+        final, events = score_stream(read_lines(args.source), box_corners, args.reverse, args.every)
+        print('### Final metrics ###')
+        print(np.array2string(final, precision = 3))
+
+if __name__ == '__main__':
+    cli()
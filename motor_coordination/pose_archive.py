@@ -0,0 +1,87 @@
+##
+## pose_archive.py
+## Mouse Motor Coordination
+##
+## Compact per-session pose archive in mice_data.hdf5
+## Time, head/paw X/Y and step length columns of each session are stored as separate
+## float32, chunked and compressed datasets in the <mouse>/<day>/pose group, so
+## re-analysis reads only the columns it needs without going back to the CSV files
+##
+
+import numpy as np
+
+## Body parts with archived X/Y columns, in order of the positions array of batch_metrics()
+ARCHIVE_PARTS = ['head', 'lfp', 'rfp', 'lhp', 'rhp']
+
+## Number of frames per chunk of archived columns
+CHUNK_FRAMES = 16384
+
+## Get hdf5 key of the pose group of a session
+def pose_key(mouse, day):
+    return mouse + '/' + day + '/' + 'pose'
+
+## Split session arrays into named archive columns
+## Arguments
+## time       : (frames,) time column
+## positions  : (frames, 5, 2) X/Y positions of head, LFP, RFP, LHP, RHP
+## steplengths: (frames, 4) step lengths of LFP, RFP, LHP, RHP
+## Returns dictionary of column name to float32 array
+def session_columns(time, positions, steplengths):
+    columns = {'time': np.asarray(time, dtype = np.float32)}
+    for index, part in enumerate(ARCHIVE_PARTS):
+        columns[part + '_x'] = np.asarray(positions[:, index, 0], dtype = np.float32)
+        columns[part + '_y'] = np.asarray(positions[:, index, 1], dtype = np.float32)
+    for index, paw in enumerate(ARCHIVE_PARTS[1:]):
+        columns[paw + '_steplength'] = np.asarray(steplengths[:, index], dtype = np.float32)
+    return columns
+
+## Store columns of one session, replacing an earlier archive of the session
+## Arguments
+## mice_data: open h5py file
+## mouse, day: session keys
+## columns  : dictionary from session_columns()
+def write_pose(mice_data, mouse, day, columns):
+    key = pose_key(mouse, day)
+    if key in mice_data:
+        del mice_data[key]
+    group = mice_data.create_group(key)
+    for name, values in columns.items():
+        chunks = (min(CHUNK_FRAMES, len(values)),) if len(values) else None
+        group.create_dataset(name, data = values, dtype = np.float32, chunks = chunks,
+                             compression = 'gzip' if chunks else None, shuffle = bool(chunks))
+
+## Check whether a session is archived
+def has_pose(mice_data, mouse, day):
+    return pose_key(mouse, day) in mice_data
+
+## Read selected columns of one archived session
+## Only the chunks of the requested columns are read and decompressed
+## Arguments
+## mice_data: open h5py file
+## mouse, day: session keys
+## columns  : list of column names, e.g. 'head_x' or 'lfp_steplength'
+## Returns dictionary of column name to float32 array
+def read_pose(mice_data, mouse, day, columns):
+    group = mice_data[pose_key(mouse, day)]
+    return {name: group[name][...] for name in columns}
+
+## Read the arrays batch_metrics() needs for one archived session
+## Arguments
+## mice_data: open h5py file
+## mouse, day: session keys
+## Returns float32 time, (frames, 5, 2) positions and (frames, 4) step lengths
+def read_session(mice_data, mouse, day):
+    group       = mice_data[pose_key(mouse, day)]
+    frames      = group['time'].shape[0]
+    positions   = np.empty((frames, len(ARCHIVE_PARTS), 2), dtype = np.float32)
+    steplengths = np.empty((frames, len(ARCHIVE_PARTS) - 1), dtype = np.float32)
+    if frames == 0:
+        return np.empty(0, dtype = np.float32), positions, steplengths
+
+    ## Read each column straight into its slice of the preallocated arrays
+    for index, part in enumerate(ARCHIVE_PARTS):
+        group[part + '_x'].read_direct(positions, dest_sel = np.s_[:, index, 0])
+        group[part + '_y'].read_direct(positions, dest_sel = np.s_[:, index, 1])
+    for index, paw in enumerate(ARCHIVE_PARTS[1:]):
+        group[paw + '_steplength'].read_direct(steplengths, dest_sel = np.s_[:, index])
+    return group['time'][...], positions, steplengths
@@ -0,0 +1,317 @@
+##
+## rank_store.py
+## Mouse Motor Coordination
+##
+## Persistent ranks of the cohort in mice_ranks.hdf5 next to mice_metrics.hdf5, for incremental scoring
+## Every stored session has a slot with its metrics and its last coordination scores, and the metrics of
+## the cohort are kept sorted in runs, resizable (6, speeds, values) datasets sorted along the last axis.
+## New values are sorted into a new run, which is merged into the runs before it only while they are at
+## most twice its size, so there are O(log n) runs and every value is moved O(log n) times. Old values of
+## changed and removed sessions are kept in runs of their own and subtracted from the counts, until they
+## outnumber the live values and the runs are rebuilt from the slots.
+## Only sessions stamped with a newer generation in mice_metrics.hdf5 are read from it, and only the
+## slots, runs and scores that changed are written. Percentiles are relative to the size of the cohort,
+## so every scored session is ranked again when the cohort changes, by binary searches in the runs
+## without sorting the cohort, but only mice whose coordination scores changed have their CSV file
+## rewritten. Scores equal score_sessions()
+##
+
+import os
+import numpy as np
+import h5py
+
+from .metrics_store import CHUNK_SESSIONS, METRIC_NAMES, create_generations, read_columns, session_index
+from .mouse_coordination_score import COORDINATION_WEIGHTS, coordination_bins, counted_percentiles, counted_stabilities
+from .result_cache import cache_key
+
+## File of the persistent ranks
+RANKS_FILE = 'mice_ranks.hdf5'
+
+## Layout version of the ranks file, bump to rebuild the ranks after changing it
+RANKS_VERSION = 2
+
+## Open persistent ranks of a metrics store
+## Ranks that are missing, from another layout, of another or an older copy of the store, or that were
+## interrupted while updating are started over
+## Arguments
+## mice_metrics: open h5py file with the metrics store
+## path        : ranks file
+## Returns open h5py file
+def open_ranks(mice_metrics, path = RANKS_FILE):
+    n_speeds = mice_metrics[METRIC_NAMES[0]].shape[0]
+    store_id = mice_metrics.attrs['store_id']
+    if os.path.exists(path):
+        ranks = h5py.File(path, 'a')
+        attrs = ranks.attrs
+        if attrs.get('version') == RANKS_VERSION and attrs.get('store_id') == store_id and not attrs.get('pending', True) \
+                and attrs['generation'] <= mice_metrics.attrs['generation'] and ranks['metrics'].shape[1] == n_speeds:
+            return ranks
+        ranks.close()
+    ranks = h5py.File(path, 'w')
+    ranks.attrs['version']    = RANKS_VERSION
+    ranks.attrs['store_id']   = store_id
+    ranks.attrs['generation'] = -1
+    ranks.attrs['pending']    = False
+    ranks.create_dataset('keys', shape = (0, 2), maxshape = (None, 2), chunks = (CHUNK_SESSIONS, 2), dtype = h5py.string_dtype())
+    ranks.create_dataset('metrics', shape = (0, n_speeds, len(METRIC_NAMES)), maxshape = (None, n_speeds, len(METRIC_NAMES)),
+                         chunks = (CHUNK_SESSIONS, n_speeds, len(METRIC_NAMES)), dtype = np.float64)
+    ranks.create_dataset('scores', shape = (0, n_speeds), maxshape = (None, n_speeds), chunks = (CHUNK_SESSIONS, n_speeds),
+                         dtype = np.float64)
+    ranks.create_group('runs')
+    ranks.create_group('removed')
+    return ranks
+
+## Read the runs of a group, oldest first
+def read_runs(group):
+    return [group[name][...] for name in sorted(group, key = int)]
+
+## Number of values in every row of the runs of a group
+def run_size(group):
+    return sum(group[name].shape[2] for name in group)
+
+## Sort values into a new run of a group and merge it into the runs before it that are at most twice its size
+## The oldest merged run is resized in place, so only the merged runs are written
+## Arguments
+## group : h5py group of runs named by their order
+## values: (6, speeds, k) values to add
+def add_run(group, values):
+    if values.shape[2] == 0:
+        return
+    names  = sorted(group, key = int)
+    run    = np.sort(values, axis = 2)
+    merged = []
+    while names and group[names[-1]].shape[2] <= 2 * run.shape[2]:
+        merged.append(names.pop())
+        run = np.sort(np.concatenate((group[merged[-1]][...], run), axis = 2), axis = 2, kind = 'stable')
+    for name in merged[:-1]:
+        del group[name]
+    if merged:
+        group[merged[-1]].resize(run.shape[2], axis = 2)
+        group[merged[-1]][...] = run
+    else:
+        group.create_dataset(str(int(names[-1]) + 1) if names else '0', data = run, maxshape = run.shape[:2] + (None,),
+                             chunks = True)
+
+## Count values of runs below and at most each value, NaN counting as above every value
+## Arguments
+## runs          : list of (6, speeds, size) runs sorted along the last axis, NaN last
+## metric, speed : row of the runs to count in
+## values        : (N,) values
+## Returns (N,) strict and weak counts of non-NaN values
+def run_counts(runs, metric, speed, values):
+    left  = np.zeros(len(values), dtype = np.int64)
+    right = np.zeros(len(values), dtype = np.int64)
+    for run in runs:
+        row    = run[metric, speed]
+        valid  = np.searchsorted(row, np.nan, side = 'left')
+        left  += np.minimum(np.searchsorted(row, values, side = 'left'), valid)
+        right += np.minimum(np.searchsorted(row, values, side = 'right'), valid)
+    return left, right
+
+## Count live values of the cohort below and at most each value, see run_counts()
+## runs, removed: runs of all values and of the removed values
+def live_counts(runs, removed, metric, speed, values):
+    left, right           = run_counts(runs, metric, speed, values)
+    gone_left, gone_right = run_counts(removed, metric, speed, values)
+    return left - gone_left, right - gone_right
+
+## Find the k-th smallest live value of a row without merging the runs
+## The binary searches of all runs advance together, each step counting the probed values in every run
+## Arguments
+## runs, removed: runs of all values and of the removed values, without live NaN in the row
+## metric, speed: row of the runs
+## k            : rank of the value from 0
+def order_statistic(runs, removed, metric, speed, k):
+    rows  = [run[metric, speed] for run in runs]
+    valid = np.array([np.searchsorted(row, np.nan, side = 'left') for row in rows])
+    low   = np.zeros(len(rows), dtype = np.int64)
+    high  = valid.copy()
+    ## First position of every run whose value has more than k live values at or below it
+    while np.any(low < high):
+        active = low < high
+        middle = (low + high) // 2
+        probe  = np.array([row[position] if searching else np.nan for row, position, searching in zip(rows, middle, active)])
+        above  = live_counts(runs, removed, metric, speed, probe)[1] > k
+        high   = np.where(active & above, middle, high)
+        low    = np.where(active & ~above, middle + 1, low)
+    return min(row[position] for row, position, size in zip(rows, low, valid) if position < size)
+
+## Median of the live values of a row like np.median(), NaN if the row has NaN
+def live_median(runs, removed, metric, speed, count, valid):
+    if count == 0 or valid < count:
+        return np.nan
+    return (order_statistic(runs, removed, metric, speed, (count - 1) // 2) + order_statistic(runs, removed, metric, speed, count // 2)) / 2
+
+## Compute metric scores of many sessions against the live values of the runs
+## Matches metric_scores() on the cohort the runs hold
+## Arguments
+## runs, removed: runs of all values and of the removed values
+## sessions     : (N, speeds, 6) array of metrics of sessions to score
+## Returns (N, speeds, 6) array of percentiles and paw stabilities
+def run_metric_scores(runs, removed, sessions):
+    count  = sum(run.shape[2] for run in runs) - sum(run.shape[2] for run in removed)
+    scores = np.zeros(sessions.shape)
+    for i in range(sessions.shape[1]):
+        for metric in range(sessions.shape[2]):
+            values      = sessions[:, i, metric]
+            left, right = live_counts(runs, removed, metric, i, values)
+            valid       = live_counts(runs, removed, metric, i, np.array([np.nan]))[0][0]
+            if metric < 2:
+                ## 100 - percentile is used because smaller expectation and SD are better, NaN in the cohort makes every percentile NaN
+                scores[:, i, metric] = np.nan if count == 0 or valid < count else 100 - counted_percentiles(left, right, count, values)
+            else:
+                median = live_median(runs, removed, metric, i, count, valid)
+                center_left, center_right = live_counts(runs, removed, metric, i, np.array([median]))
+                scores[:, i, metric] = counted_stabilities(left, valid - right, center_left[0], valid - center_right[0], values < median)
+    return scores
+
+## Compute percentiles of weighted average scores against the scored sessions and the zero scores of unused days
+## Matches ranked_percentiles() on the sorted scores with the zeros inserted
+## Arguments
+## ranked : sorted weighted average scores of the scored sessions, NaN last
+## padding: number of zero scores of unused days
+## scores : array of scores to compute percentiles for
+def padded_percentiles(ranked, padding, scores):
+    count = len(ranked) + padding
+    if count == 0 or (len(ranked) and np.isnan(ranked[-1])):
+        return np.full(np.shape(scores), np.nan)
+    left  = np.searchsorted(ranked, scores, side = 'left') + padding * (scores > 0)
+    right = np.searchsorted(ranked, scores, side = 'right') + padding * (scores >= 0)
+    return counted_percentiles(left, right, count, scores)
+
+## Bring persistent ranks up to date with the metrics store
+## Sessions written to the store since the last update are read from it, their old values are added to the
+## removed runs and their new values to the runs. Slots of removed sessions are filled with the last slot
+## Arguments
+## ranks       : h5py file from open_ranks()
+## mice_metrics: open h5py file with the metrics store
+## index       : dictionary from session_index()
+## Returns dictionary of (mouse, day) to slot and list of removed sessions
+def update_ranks(ranks, mice_metrics, index):
+    slot_keys = [tuple(key) for key in ranks['keys'].asstr()[...]]
+    slots     = {key: slot for slot, key in enumerate(slot_keys)}
+    if mice_metrics.attrs['generation'] == ranks.attrs['generation']:
+        return slots, []
+
+    keys    = sorted(index, key = index.get)
+    columns = np.flatnonzero(mice_metrics['generation'][...] > ranks.attrs['generation'])
+    changed = [keys[column] for column in columns]
+    gone    = [key for key in slot_keys if key not in index]
+    old     = sorted(slots[key] for key in changed + gone if key in slots)
+    values  = read_columns(mice_metrics, columns)
+    if old:
+        add_run(ranks['removed'], ranks['metrics'][old].transpose(2, 1, 0))
+    add_run(ranks['runs'], values.transpose(2, 1, 0))
+
+    ## Move the last slot into the slot of every removed session
+    for key in gone:
+        slot = slots.pop(key)
+        last = len(slot_keys) - 1
+        if slot != last:
+            moved = slot_keys[last]
+            for name in ['keys', 'metrics', 'scores']:
+                ranks[name][slot] = ranks[name][last]
+            slots[moved]    = slot
+            slot_keys[slot] = moved
+        slot_keys.pop()
+        for name in ['keys', 'metrics', 'scores']:
+            ranks[name].resize(last, axis = 0)
+
+    ## Overwrite slots of changed sessions and append slots of new ones
+    present = sorted((slots[key], row) for row, key in enumerate(changed) if key in slots)
+    if present:
+        ranks['metrics'][[slot for slot, row in present]] = values[[row for slot, row in present]]
+    added = [row for row, key in enumerate(changed) if key not in slots]
+    if added:
+        start = len(slot_keys)
+        for name in ['keys', 'metrics', 'scores']:
+            ranks[name].resize(start + len(added), axis = 0)
+        ranks['keys'][start:]    = [list(changed[row]) for row in added]
+        ranks['metrics'][start:] = values[added]
+        ranks['scores'][start:]  = np.nan
+        slots.update({changed[row]: start + offset for offset, row in enumerate(added)})
+
+    ## Rebuild the runs from the slots once removed values outnumber the live ones
+    if 2 * run_size(ranks['removed']) > run_size(ranks['runs']):
+        for group in [ranks['runs'], ranks['removed']]:
+            for name in list(group):
+                del group[name]
+        add_run(ranks['runs'], ranks['metrics'][...].transpose(2, 1, 0))
+    ranks.attrs['generation'] = mice_metrics.attrs['generation']
+    return slots, gone
+
+## Score sessions of the metrics store against persistent ranks and update the ranks
+## Arguments
+## mice_metrics: open h5py file with the metrics store, whose sessions are the cohort
+## manifest    : dictionary of mouse to days to score, None for every stored session
+## path        : ranks file
+## Returns the same cohort, sessions, positions, mice_keys and mice_days as read_cohort(), with None for the cohort,
+## which is only read when needed, (n_mice, speeds, n_days) coordination scores and the set of mice whose
+## scores changed since the last scoring
+def incremental_scores(mice_metrics, manifest = None, path = RANKS_FILE):
+    if 'generation' not in mice_metrics:
+        create_generations(mice_metrics, len(mice_metrics['index']))
+    index = session_index(mice_metrics)
+    with open_ranks(mice_metrics, path) as ranks:
+        ## An update interrupted before pending is cleared starts the ranks over
+        ranks.attrs['pending'] = True
+        synced      = ranks.attrs['generation']
+        slots, gone = update_ranks(ranks, mice_metrics, index)
+
+        ## Scored sessions in the order of read_cohort(), mice and days sorted by name without a manifest
+        if manifest is None:
+            grouped = {}
+            for mouse, day in index:
+                grouped.setdefault(mouse, []).append(day)
+            mice_keys = sorted(grouped)
+            mice_days = {mouse: sorted(grouped[mouse]) for mouse in mice_keys}
+        else:
+            mice_keys = list(manifest)
+            mice_days = {mouse: list(manifest[mouse]) for mouse in mice_keys}
+        scored    = [(mouse, day) for mouse in mice_keys for day in mice_days[mouse]]
+        positions = [(index1, index2) for index1, mouse in enumerate(mice_keys) for index2 in range(len(mice_days[mouse]))]
+        scored_slots = np.array([slots[key] for key in scored], dtype = np.int64)
+        order        = np.argsort(scored_slots)
+        n_speeds     = ranks['metrics'].shape[1]
+        sessions     = np.zeros((len(scored),) + ranks['metrics'].shape[1:])
+        if scored:
+            sessions[order] = ranks['metrics'][list(scored_slots[order])]
+
+        ## Scores are still current when neither the cohort nor the scored sessions changed
+        n_days  = max([12] + [len(days) for days in mice_days.values()])
+        layout  = cache_key([], mice = mice_keys, days = mice_days)
+        current = ranks.attrs['generation'] == synced and ranks.attrs.get('layout') == layout
+        if current:
+            scores = np.zeros((len(scored), n_speeds))
+            if scored:
+                scores[order] = ranks['scores'][list(scored_slots[order])]
+            unused  = ranks.attrs['unused_score']
+            changed = set()
+        else:
+            ## Weighted average scores of scored sessions, ranked together with the zero scores of unused days like score_sessions()
+            runs       = read_runs(ranks['runs'])
+            removed    = read_runs(ranks['removed'])
+            raw_scores = np.average(run_metric_scores(runs, removed, sessions), axis = 2, weights = COORDINATION_WEIGHTS) if scored else np.zeros((0, n_speeds))
+            ranked     = np.sort(raw_scores.ravel())
+            padding    = len(mice_keys) * n_speeds * n_days - raw_scores.size
+            scores     = coordination_bins(padded_percentiles(ranked, padding, raw_scores))
+            unused     = coordination_bins(padded_percentiles(ranked, padding, np.zeros(1)))[0]
+
+            ## Mice with a session that is new, removed, no longer scored or whose coordination scores changed
+            ## Only the slots whose scores changed are written
+            previous = ranks['scores'][...]
+            written  = np.full(previous.shape, np.nan)
+            written[scored_slots] = scores
+            rows     = np.flatnonzero(~np.all((previous == written) | (np.isnan(previous) & np.isnan(written)), axis = 1))
+            keys     = [tuple(key) for key in ranks['keys'].asstr()[list(rows)]] if len(rows) else []
+            changed  = {mouse for mouse, day in keys + gone if mouse in mice_days}
+            if len(rows):
+                ranks['scores'][list(rows)] = written[rows]
+            ranks.attrs['layout']       = layout
+            ranks.attrs['unused_score'] = unused
+        all_scores = np.full((len(mice_keys), n_speeds, n_days), unused)
+        if scored:
+            index1, index2 = np.array(positions).T
+            all_scores[index1, :, index2] = scores
+        ranks.attrs['pending'] = False
+    return None, sessions, positions, mice_keys, mice_days, all_scores, changed
@@ -0,0 +1,254 @@
+##
+## report.py
+## Mouse Motor Coordination
+##
+## Headless report of stored results: a coordination score heatmap of every mouse,
+## cohort trends of every speed, and a quality control plot of the normalized head
+## trajectory of every archived session
+## Figures are drawn on Agg canvases in worker processes from mice_data.hdf5 and
+## mice_metrics.hdf5 without re-running analysis, figures with unchanged inputs are skipped
+##
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+import argparse
+import json
+import multiprocessing
+import os
+import numpy as np
+import h5py
+
+from .manifest import read_manifest
+from .mouse_coordination_metrics import FRAME_RATE, SECTIONS, SPEED_NAMES, box_edges, box_mask, scale_positions, section_labels, session_flags, session_fps, \
+    session_sections
+from .mouse_coordination_score import read_cohort, score_sessions, session_mask
+from .pose_archive import has_pose, read_session
+from .result_cache import cache_key, digest_of, input_digests, stored_digests
+
+## Folder of the report and file of the input keys of its figures
+REPORT_DIRECTORY = 'report'
+KEYS_FILE = 'report_keys.json'
+
+## Version of the figures, bump to redraw every figure after changing how they are drawn
+REPORT_VERSION = 1
+
+## Resolution of saved figures
+DPI = 150
+
+## Largest number of frames drawn in a trajectory plot, longer sessions are thinned
+MAX_POINTS = 20000
+
+## Create a figure that is drawn with the Agg backend without pyplot or a display
+def new_figure(width, height):
+    from matplotlib.figure import Figure
+    return Figure(figsize = (width, height))
+
+## Draw coordination score heatmap of one mouse
+## Arguments
+## path  : PNG file to write
+## mouse : mouse name
+## days  : day names
+## scores: (speeds, days) coordination scores from 1 to 5
+def draw_mouse_scores(path, mouse, days, scores):
+    figure = new_figure(1.5 + 0.6 * len(days), 3.5)
+    axes   = figure.subplots()
+    image  = axes.imshow(scores, cmap = 'viridis', vmin = 1, vmax = 5, aspect = 'auto')
+    for (row, column), score in np.ndenumerate(scores):
+        axes.text(column, row, '{score:.0f}'.format(score = score), ha = 'center', va = 'center', color = 'white', fontsize = 8)
+    axes.set_xticks(range(len(days)), days, rotation = 90)
+    axes.set_yticks(range(len(SPEED_NAMES)), SPEED_NAMES)
+    axes.set_title(mouse + ' coordination scores')
+    figure.colorbar(image, ax = axes, ticks = range(1, 6))
+    figure.tight_layout()
+    figure.savefig(path, dpi = DPI)
+    return path
+
+## Draw cohort mean coordination score of each speed over days
+## Arguments
+## path  : PNG file to write
+## means : (speeds, days) mean coordination scores over mice
+## errors: (speeds, days) standard errors of the means
+def draw_speed_trends(path, means, errors):
+    figure = new_figure(7, 4)
+    axes   = figure.subplots()
+    days   = range(1, means.shape[1] + 1)
+    for name, mean, error in zip(SPEED_NAMES, means, errors):
+        axes.errorbar(days, mean, yerr = error, marker = 'o', capsize = 3, label = name)
+    axes.set_xticks(days)
+    axes.set_yticks(range(6))
+    axes.set_xlabel('Day')
+    axes.set_ylabel('Average Coordination Score')
+    axes.legend(fontsize = 8)
+    figure.tight_layout()
+    figure.savefig(path, dpi = DPI)
+    return path
+
+## Draw normalized head trajectory of one archived session, colored by speed section
+## Reads the pose archive and box corners in the worker, so only the session keys are sent to it
+## Arguments
+## path   : PNG file to write
+## mouse, day: session keys
+## reverse: Boolean flag to indicate mouse running in reverse
+## log_file : serial log of arduino_code.ino to section frames by, None for the fixed SECTIONS
+## raw_file : DeepLabCut export of the session, read for the sync LED only
+## sync_part: body part tracking the video sync LED, None to align frames to the log by session start
+## fps      : video frame rate of the session
+## data_file: hdf5 file with the pose archive
+def draw_session_qc(path, mouse, day, reverse, log_file = None, raw_file = None, sync_part = None, fps = FRAME_RATE,
+                    data_file = 'mice_data.hdf5'):
+    with h5py.File(data_file, 'r') as mice_data:
+        time, positions, _ = read_session(mice_data, mouse, day)
+        box_corners = box_edges(*mice_data[mouse + '/' + day + '/' + 'box'][...])[None]
+
+    ## Normalize head positions like batch_metrics() and label frames by speed section
+    session_ids = np.zeros(len(time), dtype = np.int64)
+    head        = positions[:, :1].astype(np.float64)
+    normalized  = scale_positions(head, box_corners, session_ids, np.array([reverse]))[:, 0]
+    inside      = box_mask(head, box_corners, session_ids)[:, 0]
+    labels      = session_sections(raw_file, len(time), fps, log_file, sync_part) if log_file else section_labels(time, [len(time)], SECTIONS)
+    step        = max(1, len(time) // MAX_POINTS)
+
+    figure = new_figure(9, 3.5)
+    trajectory, over_time = figure.subplots(1, 2, gridspec_kw = {'width_ratios': [1, 2]})
+    for section, name in enumerate(SPEED_NAMES):
+        frames = np.flatnonzero((labels == section) & inside)[::step]
+        trajectory.scatter(normalized[frames, 0], normalized[frames, 1], s = 1, label = name, rasterized = True)
+        over_time.plot(time[frames], normalized[frames, 0], '.', markersize = 1, rasterized = True)
+    trajectory.plot([0, 1, 1, 0, 0], [0, 0, 1, 1, 0], 'k--', linewidth = 0.8)
+    trajectory.set_xlim(-0.05, 1.05)
+    trajectory.set_ylim(1.05, -0.05)
+    trajectory.set_xlabel('Normalized X')
+    trajectory.set_ylabel('Normalized Y')
+    trajectory.legend(fontsize = 6, markerscale = 5)
+    over_time.set_xlabel('Time')
+    over_time.set_ylabel('Normalized head X')
+    lost = 1 - np.count_nonzero(inside) / max(len(inside), 1)
+    figure.suptitle('{mouse} {day}: {lost:.1%} of head frames outside the box'.format(mouse = mouse, day = day, lost = lost))
+    figure.tight_layout()
+    figure.savefig(path, dpi = DPI)
+    return path
+
+## Compute day-wise means and standard errors of coordination scores of each speed over recorded sessions
+## scores : (n_mice, speeds, n_days) coordination scores
+## present: (n_mice, n_days) Boolean mask of recorded sessions
+## Returns (speeds, days) means and standard errors, up to the last recorded day
+def speed_trends(scores, present):
+    days    = present.any(axis = 0).nonzero()[0].max() + 1 if present.any() else 0
+    scores  = np.where(present[:, None, :days], scores[:, :, :days], np.nan)
+    count   = present[:, :days].sum(axis = 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        means  = np.nanmean(scores, axis = 0) if days else np.zeros((len(SPEED_NAMES), 0))
+        errors = np.nanstd(scores, axis = 0, ddof = 1) / np.sqrt(count) if days else np.zeros((len(SPEED_NAMES), 0))
+    return means, errors
+
+## Collect figures of the report and the keys of their inputs
+## Arguments
+## mice_data   : open h5py file with session metrics, box corners and pose archive
+## mice_metrics: open h5py file with the cohort metrics store
+## manifest    : dictionary of mouse to days to report, None for every mouse in mice_data
+## Reverse flags and treadmill logs are the ones stored with each session, or taken from the manifest
+## for sessions stored before they were kept. QC figures of other sessions are skipped
+## Returns list of (file name, input key, drawing function, arguments)
+def report_figures(mice_data, mice_metrics, manifest = None):
+    cohort, sessions, positions, mice_keys, mice_days = read_cohort(mice_data, mice_metrics, manifest)
+    n_days  = max([12] + [len(days) for days in mice_days.values()])
+    scores  = score_sessions(cohort, sessions, positions, len(mice_keys), n_days)
+    figures = []
+
+    ## Score figures depend on the scores only
+    for index, mouse in enumerate(mice_keys):
+        days         = mice_days[mouse]
+        mouse_scores = scores[index, :, :len(days)]
+        key = cache_key([], figure = 'scores', version = REPORT_VERSION, mouse = mouse, days = days, scores = mouse_scores)
+        figures.append((mouse + '_scores.png', key, draw_mouse_scores, (mouse, days, mouse_scores)))
+    means, errors = speed_trends(scores, session_mask(positions, len(mice_keys), n_days))
+    key = cache_key([], figure = 'trends', version = REPORT_VERSION, means = means, errors = errors)
+    figures.append(('speed_trends.png', key, draw_speed_trends, (means, errors)))
+
+    ## Trajectory figures depend on the cached session inputs and box corners
+    for mouse in mice_keys:
+        for day in mice_days[mouse]:
+            if not has_pose(mice_data, mouse, day):
+                continue
+            flags = session_flags(mice_data, mouse, day)
+            if flags is None and manifest is not None:
+                entry = manifest[mouse][day]
+                flags = (bool(entry[3]), entry[5] if len(entry) > 5 else None, entry[1], entry[6] if len(entry) > 6 else None,
+                         session_fps(entry))
+            if flags is None:
+                print('Skipped QC figure of {mouse} {day} without stored reverse flag, run motor-coordination-metrics to store it'.format(mouse = mouse, day = day))
+                continue
+            reverse, log, raw_file, sync_part, fps = flags
+            if log and sync_part and not (raw_file and os.path.exists(raw_file)):
+                print('Skipped QC figure of {mouse} {day} without the raw file tracking its sync LED'.format(mouse = mouse, day = day))
+                continue
+            data_key = mouse + '/' + day + '/' + 'metrics'
+            metrics  = mice_data[data_key]
+            box      = mice_data[mouse + '/' + day + '/' + 'box'][...]
+            ## The log is hashed itself, so editing it redraws the figure even if the metrics were not recomputed
+            digests  = input_digests([log], stored_digests(mice_data, data_key))
+            key = cache_key([digest_of(digests, log)], figure = 'qc', version = REPORT_VERSION, metrics = metrics.attrs.get('cache_key', metrics[...]),
+                            box = box, reverse = reverse, sections = SECTIONS, sync_part = sync_part if log else None,
+                            fps = fps if log else None)
+            figures.append((mouse + '_' + day + '_qc.png', key, draw_session_qc, (mouse, day, reverse, log, raw_file, sync_part, fps)))
+    return figures
+
+## Render the report, drawing only figures whose inputs changed since the last report
+## Arguments
+## directory: folder to write figures to
+## manifest : dictionary of mouse to days to report, None for every mouse in mice_data.hdf5
+## jobs     : number of worker processes drawing figures
+## force    : Boolean flag to redraw every figure
+## Returns list of drawn figure files
+def render_report(directory = REPORT_DIRECTORY, manifest = None, jobs = 1, force = False):
+    os.makedirs(directory, exist_ok = True)
+    keys_file = os.path.join(directory, KEYS_FILE)
+    keys = {}
+    if os.path.exists(keys_file) and not force:
+        with open(keys_file) as handle:
+            keys = json.load(handle)
+
+    with ExitStack() as stack:
+        mice_data    = stack.enter_context(h5py.File('mice_data.hdf5', 'r'))
+        mice_metrics = stack.enter_context(h5py.File('mice_metrics.hdf5', 'r'))
+        figures = report_figures(mice_data, mice_metrics, manifest)
+
+    ## Keep keys of current figures only, so figures of removed sessions are drawn again if they return
+    names = {figure[0] for figure in figures}
+    keys  = {name: key for name, key in keys.items() if name in names}
+    stale = [figure for figure in figures if keys.get(figure[0]) != figure[1] or not os.path.exists(os.path.join(directory, figure[0]))]
+    drawn = []
+    with ExitStack() as stack:
+        if jobs > 1:
+            ## Workers are spawned so they never inherit open hdf5 file handles
+            context  = multiprocessing.get_context('spawn')
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers = jobs, mp_context = context))
+            futures  = {executor.submit(function, os.path.join(directory, name), *args): (name, key) for name, key, function, args in stale}
+            results  = ((futures[future], future.result()) for future in as_completed(futures))
+        else:
+            results  = (((name, key), function(os.path.join(directory, name), *args)) for name, key, function, args in stale)
+
+        ## Record each key as soon as its figure is written, so an interrupted report resumes where it stopped
+        for (name, key), path in results:
+            keys[name] = key
+            drawn.append(path)
+            with open(keys_file, 'w') as handle:
+                json.dump(keys, handle, indent = 1)
+    with open(keys_file, 'w') as handle:
+        json.dump(keys, handle, indent = 1)
+    return drawn
+
+## Command line entry point
+## argv: list of arguments, None for sys.argv
+def cli(argv = None):
+    parser = argparse.ArgumentParser(description = 'Draw report figures of stored results without a display')
+    parser.add_argument('manifest', nargs = '?', default = None, help = 'CSV file of sessions to report, every stored session if omitted')
+    parser.add_argument('--output', default = REPORT_DIRECTORY, help = 'folder to write figures to')
+    parser.add_argument('--jobs', type = int, default = 1, help = 'number of worker processes drawing figures')
+    parser.add_argument('--force', action = 'store_true', help = 'redraw figures whose inputs did not change')
+    args  = parser.parse_args(argv)
+    drawn = render_report(args.output, read_manifest(args.manifest) if args.manifest else None, args.jobs, args.force)
+    print('Drew {count} figures in {directory}'.format(count = len(drawn), directory = args.output))
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,113 @@
+##
+## result_cache.py
+## Mouse Motor Coordination
+##
+## Content-addressed keys of session results cached in mice_data.hdf5
+## A key hashes the content of the input files of a session together with the analysis
+## parameters and is stored as attribute of the cached dataset, so a session is only
+## recomputed when its key changes. File digests are remembered with size and modification
+## time, unchanged files are not read again to check a session
+##
+
+import hashlib
+import json
+import os
+import numpy as np
+
+## Version of cached results, bump to recompute every session after changing the analysis code
+CACHE_VERSION = 1
+
+## Number of bytes hashed per read
+BLOCK_SIZE = 2 ** 20
+
+## Hash the content of a file
+## path: file to hash
+## Returns hexadecimal SHA-256 digest
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+## Get content digests of input files
+## Digests remembered for a file with unchanged size and modification time are reused without reading the file,
+## and so are digests of files that are no longer on disk, e.g. raw videos of a finalized cohort moved to an archive
+## Arguments
+## paths: list of file paths, None entries are skipped
+## known: dictionary of path to [size, mtime_ns, digest] from an earlier call
+## Returns dictionary of path to [size, mtime_ns, digest]
+def input_digests(paths, known = None):
+    known   = known or {}
+    digests = {}
+    for path in paths:
+        if path is None:
+            continue
+        entry = known.get(path)
+        if entry is not None and not os.path.exists(path):
+            digests[path] = list(entry)
+            continue
+        status = os.stat(path)
+        if entry is None or list(entry[:2]) != [status.st_size, status.st_mtime_ns]:
+            entry = [status.st_size, status.st_mtime_ns, file_digest(path)]
+        digests[path] = list(entry)
+    return digests
+
+## Hash file contents and analysis parameters into a cache key
+## File names are not part of the key, so moving or renaming an input keeps its results
+## Arguments
+## digests   : list of file digests or None for missing inputs, in a fixed order
+## parameters: values the results depend on, NumPy arrays are hashed as lists
+## Returns hexadecimal SHA-256 key
+def cache_key(digests, **parameters):
+    content = json.dumps({'version': CACHE_VERSION, 'files': digests, 'parameters': parameters},
+                         sort_keys = True, default = lambda value: np.asarray(value).tolist())
+    return hashlib.sha256(content.encode()).hexdigest()
+
+## Get digest of one input from the dictionary of input_digests(), None if the input is missing
+def digest_of(digests, path):
+    return digests[path][2] if path in digests else None
+
+## Check whether a cached dataset was computed with a key
+## Arguments
+## group: open h5py file or group
+## key  : hdf5 key of the cached dataset
+## value: cache key the dataset should have
+def is_cached(group, key, value):
+    return key in group and group[key].attrs.get('cache_key') == value
+
+## Get input digests remembered on a cached dataset, empty if there are none
+## Arguments
+## group: open h5py file or group
+## key  : hdf5 key of the cached dataset
+def stored_digests(group, key):
+    if key not in group:
+        return {}
+    return json.loads(group[key].attrs.get('cache_inputs', '{}'))
+
+## Store cache key and input digests on a cached dataset
+## Arguments
+## node   : h5py dataset
+## value  : cache key from cache_key()
+## digests: dictionary from input_digests(), None to store only the key
+def write_key(node, value, digests = None):
+    node.attrs['cache_key'] = value
+    if digests is not None:
+        node.attrs['cache_inputs'] = json.dumps(digests)
+
+## Evict cached sessions that are no longer wanted from a <mouse>/<day> hdf5 layout
+## Deleted objects are unlinked, their space is reused by later writes or reclaimed with h5repack
+## Arguments
+## group: open h5py file or group
+## keep : set of (mouse, day) pairs to keep
+## Returns list of evicted (mouse, day) pairs
+def evict_sessions(group, keep):
+    evicted = []
+    for mouse in list(group.keys()):
+        for day in list(group[mouse].keys()):
+            if (mouse, day) not in keep:
+                del group[mouse][day]
+                evicted.append((mouse, day))
+        if len(group[mouse]) == 0:
+            del group[mouse]
+    return evicted
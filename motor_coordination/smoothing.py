@@ -0,0 +1,266 @@
+##
+## smoothing.py
+## Mouse Motor Coordination
+##
+## Batched LOWESS smoothing of many signals sampled on one shared x axis
+## Neighborhoods and tricube weights are computed once per fitted point and
+## applied to all signals together, following statsmodels' lowess() step by step
+##
+
+import numpy as np
+
+## Upper bound on the number of (point, neighbor, signal) weights held in memory at once
+BLOCK_ELEMENTS = 4000000
+
+## Find neighborhood of each fitted point, same as statsmodels' update_neighborhood()
+## Arguments
+## x      : sorted x values
+## anchors: indexes of points to fit
+## k      : number of neighbors
+## Returns left end of each neighborhood and its radius
+def neighborhoods(x, anchors, k):
+    n    = len(x)
+    mids = (x[:n - k] + x[k:]) / 2.0
+    left = np.minimum(np.searchsorted(mids, x[anchors], side = 'left'), n - k)
+    radius = np.fmax(x[anchors] - x[left], x[left + k - 1] - x[anchors])
+    return left, radius
+
+## Choose points to fit with regression, same as statsmodels' update_indices()
+## Points in between are linearly interpolated
+## Arguments
+## x    : sorted x values
+## delta: distance within which interpolation is used instead of regression
+def fit_points(x, delta):
+    n = len(x)
+    if delta <= 0:
+        return np.arange(n)
+    anchors = [0]
+    while anchors[-1] < n - 1:
+        last = anchors[-1]
+        next_point = min(np.searchsorted(x, x[last] + delta, side = 'right'), n - 1)
+        anchors.append(max(next_point - 1, last + 1))
+    return np.array(anchors)
+
+## Evaluate local linear regressions from weighted sums, same formula as statsmodels' calculate_y_fit()
+## Sums are taken over neighbors with x measured from the fitted point
+## Arguments
+## sums : (5, points, m) sums of weight, weight * x, weight * x^2, weight * y, weight * x * y
+## count: (points, m) number of neighbors with positive weight
+## own  : (points, m) values of the fitted points, used when regression is not possible
+def regression(sums, count, own):
+    total, sum_x, sum_xx, sum_y, sum_xy = sums
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean_x  = sum_x / total
+        sqdev_x = np.fmax(sum_xx / total - mean_x * mean_x, 1e-12)
+        mean_y  = sum_y / total
+        fitted  = mean_y - mean_x * (sum_xy / total - mean_x * mean_y) / sqdev_x
+    return np.where(count >= 2, fitted, own)
+
+## Convolve every column of signals with kernel through FFT
+## Arguments
+## signals: (n, m) array
+## kernel : (k,) array
+## Returns (n + k - 1, m) full convolution
+def convolve_columns(signals, kernel):
+    size  = len(signals) + len(kernel) - 1
+    fast  = 1 << (size - 1).bit_length()
+    full  = np.fft.irfft(np.fft.rfft(signals, fast, axis = 0) * np.fft.rfft(kernel, fast)[:, None], fast, axis = 0)
+    return full[:size]
+
+## Fit points whose neighborhoods are all alike on a uniformly spaced x axis
+## Tricube weights become one kernel, so weighted sums are FFT correlations over the whole signal
+## Arguments
+## x            : sorted, uniformly spaced x values
+## Y            : (n, m) signals without missing values
+## points       : indexes of points to fit, all with neighborhood [point + offset, point + offset + k)
+## offset, k    : neighborhood start relative to fitted point and number of neighbors
+## radius       : neighborhood radius shared by all points
+## resid_weights: (n, m) robustness weights from previous iteration
+def fit_uniform(x, Y, points, offset, k, radius, resid_weights):
+    step     = (x[-1] - x[0]) / (len(x) - 1)
+    distance = (offset + np.arange(k)) * step
+    tricube  = 1.0 - (np.abs(distance) / radius) ** 3
+    tricube  = tricube ** 3
+
+    ## Correlate weighted signals with kernels of tricube * distance^p
+    signals  = np.concatenate((resid_weights, resid_weights * Y, (resid_weights > 0).astype(np.float64)), axis = 1)
+    m        = Y.shape[1]
+    shift    = offset + k - 1
+    sums     = []
+    for power, columns in ((0, slice(0, 2 * m)), (1, slice(0, 2 * m)), (2, slice(0, m))):
+        kernel = (tricube * distance ** power)[::-1]
+        full   = convolve_columns(signals[:, columns], kernel)
+        sums.append(full[points + shift])
+    count = convolve_columns(signals[:, 2 * m:], (tricube > 0)[::-1].astype(np.float64))
+    count = np.rint(count[points + shift])
+
+    total, sum_y  = sums[0][:, :m], sums[0][:, m:]
+    sum_x, sum_xy = sums[1][:, :m], sums[1][:, m:]
+    return regression(np.array([total, sum_x, sums[2], sum_y, sum_xy]), count, Y[points])
+
+## Fit points in blocks with dense banded tricube matrices shared by all signals
+## Arguments
+## x            : sorted x values
+## Y            : (n, m) signals without missing values
+## points       : indexes of points to fit
+## left, radius : neighborhood left ends and radii of points
+## k            : number of neighbors
+## resid_weights: (n, m) robustness weights from previous iteration
+def fit_banded(x, Y, points, left, radius, k, resid_weights):
+    fitted = np.empty((len(points), Y.shape[1]))
+    start  = 0
+    while start < len(points):
+        ## Grow block while its dense tricube matrix stays small
+        stop = start + 1
+        while stop < len(points) and (stop + 1 - start) * (left[stop] + k - left[start]) <= BLOCK_ELEMENTS:
+            stop += 1
+        low, high = left[start], left[stop - 1] + k
+
+        ## Tricube weights of block
+        ## Points outside a neighborhood are at least one radius away, so their weight is zero
+        center  = x[points[start:stop]].mean()
+        xs      = x[low:high] - center
+        xval    = x[points[start:stop]] - center
+        tricube = np.abs(xs - xval[:, None])
+        tricube /= radius[start:stop, None]
+        tricube = np.maximum(1.0 - tricube * tricube * tricube, 0.0)
+        tricube = tricube * tricube * tricube
+
+        ## Weighted sums of all signals as one matrix product
+        weights  = resid_weights[low:high]
+        signals  = np.concatenate((weights, weights * xs[:, None], weights * (xs ** 2)[:, None],
+                                   weights * Y[low:high], weights * (xs[:, None] * Y[low:high])), axis = 1)
+        products = (tricube @ signals).reshape(stop - start, 5, -1).transpose(1, 0, 2)
+        count    = (tricube > 0).astype(np.float64) @ (weights > 0).astype(np.float64)
+
+        ## Measure x from each fitted point
+        xi = xval[:, None]
+        total, sum_x, sum_xx, sum_y, sum_xy = products
+        sums = np.array([total, sum_x - xi * total, sum_xx - 2 * xi * sum_x + xi * xi * total, sum_y, sum_xy - xi * sum_y])
+        fitted[start:stop] = regression(sums, count, Y[points[start:stop]])
+        start = stop
+    return fitted
+
+## Fit local linear regressions at anchor points for all signals at once
+## Arguments
+## x            : sorted x values
+## Y            : (n, m) signals without missing values
+## anchors      : indexes of points to fit
+## k            : number of neighbors
+## resid_weights: (n, m) robustness weights from previous iteration
+## Returns (len(anchors), m) fitted values
+def fit_anchors(x, Y, anchors, k, resid_weights):
+    left, radius = neighborhoods(x, anchors, k)
+    fitted = np.empty((len(anchors), Y.shape[1]))
+    banded = np.ones(len(anchors), dtype = bool)
+
+    ## On a uniform x axis, interior points share the neighborhood shape of the middle point
+    n = len(x)
+    if len(anchors) == n and n > 2 and np.allclose(np.diff(x), (x[-1] - x[0]) / (n - 1), rtol = 1e-9, atol = 0):
+        middle   = n // 2
+        offset   = left - anchors
+        interior = (offset == offset[middle]) & np.isclose(radius, radius[middle], rtol = 1e-9, atol = 0)
+        fitted[interior] = fit_uniform(x, Y, anchors[interior], offset[middle], k, radius[middle], resid_weights)
+        banded = ~interior
+    if np.any(banded):
+        fitted[banded] = fit_banded(x, Y, anchors[banded], left[banded], radius[banded], k, resid_weights)
+    return fitted
+
+## Compute bisquare robustness weights from residuals, same as statsmodels
+## Arguments
+## Y     : (n, m) signals
+## fitted: (n, m) fitted values
+def residual_weights(Y, fitted):
+    residuals = np.abs(Y - fitted)
+    median    = np.median(residuals, axis = 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        scaled = np.where(median == 0, (residuals > 0).astype(np.float64), residuals / (6.0 * median))
+    scaled = np.minimum(scaled, 1.0)
+    return (1.0 - scaled * scaled) ** 2
+
+## Smooth a group of signals that share the same valid points with LOWESS
+## Arguments
+## x    : sorted x values without missing values
+## Y    : (n, m) signals without missing values
+## frac : fraction of points used for each local regression
+## it   : number of robustifying iterations
+## delta: distance within which interpolation is used instead of regression
+def lowess_group(x, Y, frac, it, delta):
+    n = len(x)
+    k = min(max(int(frac * n + 1e-10), 2), n)
+    anchors = fit_points(x, delta)
+    weights = np.ones(Y.shape)
+    for iteration in range(it + 1):
+        fitted = fit_anchors(x, Y, anchors, k, weights)
+        if len(anchors) < n:
+            fitted = np.column_stack([np.interp(x, x[anchors], fitted[:, column]) for column in range(Y.shape[1])])
+        if iteration < it:
+            weights = residual_weights(Y, fitted)
+    return fitted
+
+## Smooth a group of signals with a Savitzky-Golay filter of about the same span as LOWESS
+## Arguments
+## x   : sorted x values without missing values
+## Y   : (n, m) signals without missing values
+## frac: fraction of points in the filter window
+def savgol_group(x, Y, frac, polyorder = 2):
+    from scipy.signal import savgol_filter
+
+    n      = len(x)
+    window = min(max(int(frac * n + 1e-10), polyorder + 2), n)
+    window = window if window % 2 == 1 else window - 1
+    if window <= polyorder:
+        return Y.copy()
+    return savgol_filter(Y, window, polyorder, axis = 0)
+
+## Smooth many signals sampled on one shared x axis
+## Signals are grouped by their missing values, so each group shares neighborhoods exactly
+## Arguments
+## x     : (n,) sorted x values shared by all signals
+## Y     : (n, m) signals, NaN where missing
+## frac  : fraction of points used for each local regression
+## it    : number of robustifying iterations
+## delta : distance within which interpolation is used instead of regression
+##         0 fits every point like statsmodels' default, about 0.01 * range of x is much faster
+## method: 'lowess' or 'savgol' for a Savitzky-Golay filter
+## Returns (n, m) smoothed signals, NaN where input is missing
+## like statsmodels' lowess(missing = 'drop', return_sorted = False)
+def smooth(x, Y, frac = 0.1, it = 3, delta = 0.0, method = 'lowess'):
+    x = np.asarray(x, dtype = np.float64)
+    Y = np.asarray(Y, dtype = np.float64)
+    if Y.ndim == 1:
+        return smooth(x, Y[:, None], frac, it, delta, method)[:, 0]
+
+    valid    = np.isfinite(Y) & np.isfinite(x)[:, None]
+    smoothed = np.full(Y.shape, np.nan)
+    groups   = {}
+    for column in range(Y.shape[1]):
+        groups.setdefault(valid[:, column].tobytes(), []).append(column)
+    for columns in groups.values():
+        rows = valid[:, columns[0]]
+        if np.count_nonzero(rows) == 0:
+            continue
+        if method == 'lowess':
+            smoothed[np.ix_(rows, columns)] = lowess_group(x[rows], Y[np.ix_(rows, columns)], frac, it, delta)
+        elif method == 'savgol':
+            smoothed[np.ix_(rows, columns)] = savgol_group(x[rows], Y[np.ix_(rows, columns)], frac)
+        else:
+            raise ValueError("Smoothing method must be either 'lowess' or 'savgol'")
+    return smoothed
+
+## Report how far smoothed signals are from exact statsmodels LOWESS output
+## Arguments
+## x       : (n,) sorted x values shared by all signals
+## Y       : (n, m) signals, NaN where missing
+## smoothed: (n, m) output of smooth()
+## frac, it: LOWESS parameters used as reference
+## Returns (m,) largest absolute difference of each signal
+def smoothing_error(x, Y, smoothed, frac = 0.1, it = 3):
+    from statsmodels.nonparametric.smoothers_lowess import lowess
+
+    Y     = np.asarray(Y, dtype = np.float64).reshape(len(x), -1)
+    error = np.zeros(Y.shape[1])
+    for column in range(Y.shape[1]):
+        exact = lowess(Y[:, column], x, frac = frac, it = it, missing = 'drop', return_sorted = False)
+        error[column] = np.nanmax(np.abs(exact - np.reshape(smoothed, Y.shape)[:, column]), initial = 0.0)
+    return error
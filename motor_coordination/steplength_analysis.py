@@ -0,0 +1,155 @@
+##
+## steplength_analysis.py
+## Mouse Motor Coordination
+##
+## Compute paw step lengths and their rolling variance from DeepLabCut data
+##
+
+import os
+import numpy as np
+import pandas as pd
+from .deeplabcut_loader import iter_columns, load_pose
+from .smoothing import smooth, smoothing_error
+
+## in raw data from DeepLabCut body parts are labeled with acronym: left front paw = lfp, right front paw = rfp, left hind paw = lhp, right hind paw = rhp
+PAWS = ['lfp', 'rfp', 'lhp', 'rhp']
+
+## Number of frames in rolling variance window
+WINDOW = 50
+
+## Compute step length between consecutive positions
+## Arguments
+## x, y    : arrays of X/Y positions
+## previous: (X, Y) position of the frame before x[0], or None at the start of a recording
+## Returns array of step lengths, NaN for the first frame of a recording
+def step_lengths(x, y, previous = None):
+    if previous is None:
+        previous = (np.nan, np.nan)
+    return np.hypot(np.diff(x, prepend = previous[0]), np.diff(y, prepend = previous[1]))
+
+## Compute rolling sample variance with Pandas rolling(window).var(), which updates running sums in O(n)
+## time and memory, prefixed with the values carried over from the previous chunk
+## Arguments
+## values: array of values
+## window: number of values in each window
+## carry : last (window - 1) values before values[0], or None at the start of a recording
+## Returns array of variances, NaN until a full window without NaN is available
+def rolling_variance(values, window = WINDOW, carry = None):
+    if carry is None:
+        carry = np.full(window - 1, np.nan)
+    extended = pd.Series(np.concatenate((carry, values)))
+    return extended.rolling(window).var().to_numpy()[len(carry):]
+
+## Add time, step length and rolling variance columns to a chunk of pose data
+## Arguments
+## data : Pandas frame with <paw>_x and <paw>_y columns, indexed by frame number
+## state: dictionary with the last position and step lengths of the previous chunk, updated in place
+##        An empty dictionary starts a new recording
+def add_steplength_columns(data, state):
+    ## time is the frame counter, starting at 2 as in earlier outputs of this script
+    data['time'] = data.index + 2
+    steplengths  = {}
+    for paw in PAWS:
+        x = data[paw + '_x'].to_numpy(dtype = np.float64)
+        y = data[paw + '_y'].to_numpy(dtype = np.float64)
+        steplengths[paw] = step_lengths(x, y, state.get(paw + '_position'))
+        state[paw + '_position'] = (x[-1], y[-1])
+    for paw in PAWS:
+        data[paw + '_steplength'] = steplengths[paw]
+    for paw in PAWS:
+        carry = state.get(paw + '_carry', np.full(WINDOW - 1, np.nan))
+        data[paw + '_steplength_roll_var'] = rolling_variance(steplengths[paw], WINDOW, carry)
+        ## Carry last window of step lengths over to the next chunk
+        state[paw + '_carry'] = np.concatenate((carry, steplengths[paw]))[-(WINDOW - 1):]
+    return data
+
+## Analyze a whole recording in memory, including LOWESS smoothed columns
+## All eight signals share the time axis and are smoothed together in one batched pass
+## Arguments
+## input_file : DeepLabCut CSV or H5 export
+## output_file: CSV file to write analyzed data to
+## delta      : LOWESS interpolation distance in frames, 0 fits every frame exactly like statsmodels
+## method     : 'lowess' or 'savgol' for a faster Savitzky-Golay approximation
+## check      : Boolean flag to print the largest difference from statsmodels' lowess() for each signal
+def analyze(input_file, output_file, delta = 0.0, method = 'lowess', check = False):
+    ## load_pose() reads the X/Y columns of every body part and caches them in a binary sidecar
+    data = load_pose(input_file)
+    data = add_steplength_columns(data, {})
+
+    names    = [paw + '_steplength' for paw in PAWS] + [paw + '_steplength_roll_var' for paw in PAWS]
+    signals  = data[names].to_numpy(dtype = np.float64)
+    time     = data['time'].to_numpy(dtype = np.float64)
+    smoothed = smooth(time, signals, frac = 0.1, delta = delta, method = method)
+    for position, name in enumerate(names):
+        data[name + '_smooth'] = smoothed[:, position]
+
+    if check:
+        for name, error in zip(names, smoothing_error(time, signals, smoothed, frac = 0.1)):
+            print(name + ' smoothing error: ' + str(error))
+
+    ## Write under a temporary name first, so an interrupted run never leaves a truncated output that looks up to date
+    temporary = output_file + '.' + str(os.getpid()) + '.tmp'
+    data.to_csv(temporary)
+    os.replace(temporary, output_file)
+
+## Analyze a recording in fixed-size chunks so peak memory does not grow with recording length
+## Step length and rolling variance state is carried between chunks, so values match analyze()
+## LOWESS smoothing needs the whole recording and is left out of the streamed output
+## Arguments
+## input_file : DeepLabCut CSV or table-format H5 export
+## output_file: CSV file to write analyzed data to, one chunk at a time
+## chunksize  : number of frames per chunk
+def stream_analyze(input_file, output_file, chunksize = 50000):
+    state     = {}
+    temporary = output_file + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary, 'w', newline = '') as handle:
+        for index, chunk in enumerate(iter_columns(input_file, chunksize = chunksize)):
+            chunk = add_steplength_columns(chunk, state)
+            chunk.to_csv(handle, header = (index == 0))
+    os.replace(temporary, output_file)
+
+## Analyze one manifest session unless its output is newer than its input
+## Arguments
+## input_file : DeepLabCut CSV or H5 export
+## output_file: CSV file to write analyzed data to
+## force      : Boolean flag to analyze even if the output is up to date
+## stream     : Boolean flag to use stream_analyze() without smoothed columns
+## method     : smoothing method of analyze()
+## Returns True if the session was analyzed
+def preprocess(input_file, output_file, force = False, stream = False, method = 'lowess'):
+    if not force and os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(input_file):
+        return False
+    if stream:
+        stream_analyze(input_file, output_file)
+    else:
+        analyze(input_file, output_file, method = method)
+    return True
+
+## Command line entry point, writes the step length file of every manifest session that has one
+## argv: list of arguments, None for sys.argv
+def cli(argv = None):
+    import argparse
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from .manifest import read_manifest
+
+    parser = argparse.ArgumentParser(description = 'Compute step length files of sessions in a manifest')
+    parser.add_argument('manifest', help = 'CSV file with one row per session, see manifest.py')
+    parser.add_argument('--method', choices = ['lowess', 'savgol'], default = 'lowess', help = 'smoothing method')
+    parser.add_argument('--stream', action = 'store_true', help = 'analyze in chunks without smoothed columns')
+    parser.add_argument('--force', action = 'store_true', help = 'analyze sessions whose step length file is up to date')
+    parser.add_argument('--jobs', type = int, default = 1, help = 'number of worker processes')
+    args  = parser.parse_args(argv)
+    tasks = [(entry[1], entry[0]) for days in read_manifest(args.manifest).values() for entry in days.values() if entry[0]]
+
+    options = [args.force] * len(tasks), [args.stream] * len(tasks), [args.method] * len(tasks)
+    if args.jobs <= 1:
+        analyzed = list(map(preprocess, *zip(*tasks), *options)) if tasks else []
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers = args.jobs, mp_context = context) as executor:
+            analyzed = list(executor.map(preprocess, *zip(*tasks), *options)) if tasks else []
+    print('Analyzed {count} of {total} sessions'.format(count = sum(analyzed), total = len(tasks)))
+
+if __name__ == '__main__':
+    cli()
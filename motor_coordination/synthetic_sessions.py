@@ -0,0 +1,198 @@
+##
+## synthetic_sessions.py
+## Mouse Motor Coordination
+##
+## Generate synthetic treadmill sessions in DeepLabCut export format
+## Used to benchmark the pipeline on cohorts of any size without real recordings
+##
+
+import os
+import numpy as np
+import pandas as pd
+from scipy import signal
+from .steplength_analysis import stream_analyze
+
+## Body parts tracked in DeepLabCut exports, in column order
+BODYPARTS = ['head', 'lfp', 'rfp', 'lhp', 'rhp', 'base', 'tail', 'topleft', 'topright', 'bottomleft', 'bottomright']
+
+## Paws with step length columns in analyzed files
+PAWS = ['lfp', 'rfp', 'lhp', 'rhp']
+
+## Box corner body parts and their positions in pixels: bottom left, top left, top right and bottom right
+CORNER_PARTS = ['bottomleft', 'topleft', 'topright', 'bottomright']
+BOX          = np.array([[102.0, 300.0], [100.0, 50.0], [500.0, 52.0], [498.0, 298.0]])
+
+## Treadmill speed in m/min starting at each time in seconds, matches sections of mouse_coordination_metrics.py
+SPEED_TIMES = np.array([0.0, 30.0, 90.0, 150.0, 210.0, 270.0, 330.0])
+SPEEDS      = np.array([0.0, 3.0, 6.0, 8.0, 10.0, 12.0, 12.0])
+
+## Motor values of arduino_code.ino driving the belt at SPEEDS
+MOTOR_VALUES = np.array([0, 64, 98, 122, 156, 190, 190])
+
+## Encoder clicks per meter of belt and interval of encoder messages in milliseconds in treadmill logs
+CLICKS_PER_METER = 900 / (23 * 0.0254)
+ENCODER_INTERVAL = 50
+
+## Scorer name written in DeepLabCut headers
+SCORER = 'DLC_resnet50_synthetic'
+
+## Simulate tracked body parts of one mouse running on the treadmill
+## Head and body drift smoothly inside the box, paws follow a gait cycle whose
+## step length and frequency grow with treadmill speed, and a few frames per
+## body part are badly tracked with low likelihood and positions anywhere in the image
+## Arguments
+## frames : number of video frames
+## fps    : video frame rate
+## skill  : coordination of the mouse from 0 to 1, better mice stay in front and move less sideways
+## reverse: Boolean flag to mirror the mouse in the box, as for mice running in reverse direction
+## seed   : random seed
+## outlier_rate: fraction of badly tracked frames of each body part
+## Returns dictionary of body part to (frames, 3) array of X, Y and likelihood
+def simulate_pose(frames, fps = 30.0, skill = 0.5, reverse = False, seed = 0, outlier_rate = 0.01):
+    rng   = np.random.default_rng(seed)
+    time  = np.arange(frames) / fps
+    speed = SPEEDS[np.searchsorted(SPEED_TIMES, time, side = 'right') - 1]
+    left, right = BOX[:, 0].min(), BOX[:, 0].max()
+    top, bottom = BOX[:, 1].min(), BOX[:, 1].max()
+    length = right - left
+    width  = bottom - top
+
+    ## Body center follows a mean-reverting random walk, slower mice fall back towards the end of the box
+    target_x = left + length * (0.25 + 0.35 * (1 - skill) + 0.02 * speed * (1 - skill))
+    target_y = top + width / 2
+    noise    = rng.normal(0, 1, (frames, 2)) * np.array([3.0, 1.0 + 3.0 * (1 - skill)])
+    drive    = 0.02 * np.column_stack((target_x, np.full(frames, target_y))) + noise
+    start    = np.array([[target_x[0], target_y]])
+    center   = signal.lfilter([1.0], [1.0, -0.98], drive, axis = 0, zi = 0.98 * start)[0]
+    center[:, 0] = np.clip(center[:, 0], left + 50, right - 50)
+    center[:, 1] = np.clip(center[:, 1], top + 30, bottom - 30)
+
+    ## Gait cycle of each paw, diagonal paws move together
+    frequency = 2.0 + 0.3 * speed
+    phase     = 2 * np.pi * np.cumsum(frequency) / fps
+    amplitude = (5.0 + 2.0 * speed) * (0.5 + 0.5 * skill)
+    offsets   = {'lfp': (-30.0, -15.0, 0.0), 'rfp': (-30.0, 15.0, np.pi), 'lhp': (20.0, -18.0, np.pi), 'rhp': (20.0, 18.0, 0.0)}
+
+    parts = {}
+    parts['head'] = center + np.array([-50.0, 0.0]) + rng.normal(0, 1.5, (frames, 2))
+    for paw, (dx, dy, shift) in offsets.items():
+        step = amplitude * np.sin(phase + shift)
+        parts[paw] = center + np.column_stack((dx + step, dy + 0.1 * step)) + rng.normal(0, 1.0, (frames, 2))
+    parts['base'] = center + np.array([35.0, 0.0]) + rng.normal(0, 1.0, (frames, 2))
+    parts['tail'] = center + np.array([80.0, 0.0]) + rng.normal(0, 4.0, (frames, 2))
+    for name, corner in zip(CORNER_PARTS, BOX):
+        parts[name] = corner + rng.normal(0, 0.5, (frames, 2))
+
+    pose = {}
+    for name in BODYPARTS:
+        positions = parts[name]
+        if reverse and name not in CORNER_PARTS:
+            positions = np.array([left + right, top + bottom]) - positions
+        likelihood = np.clip(rng.normal(0.98, 0.02, frames), 0.0, 1.0)
+        outliers   = rng.random(frames) < outlier_rate
+        count      = np.count_nonzero(outliers)
+        positions[outliers] = rng.uniform([0.0, 0.0], [right + left, bottom + top], (count, 2))
+        likelihood[outliers] = rng.uniform(0.0, 0.5, count)
+        pose[name] = np.column_stack((positions, likelihood))
+    return pose
+
+## Simulate the tracked video sync LED, which is on for width milliseconds at every sync pulse of write_treadmill_log()
+## Arguments
+## frames: number of video frames
+## fps   : video frame rate
+## sync  : interval of sync pulses in milliseconds
+## width : duration of sync pulses in milliseconds
+## Returns (frames, 3) array of X, Y and likelihood, high while the LED is on
+def simulate_led(frames, fps = 30.0, sync = 5000, width = 500):
+    time = np.arange(frames) * 1000 / fps
+    on   = time % sync < width
+    return np.column_stack((np.full(frames, 20.0), np.full(frames, 20.0), np.where(on, 0.99, 0.05)))
+
+## Convert simulated pose into a frame with DeepLabCut (scorer, bodyparts, coords) columns
+## Arguments
+## pose: dictionary from simulate_pose(), optionally with more body parts such as the sync LED
+def pose_frame(pose):
+    columns = pd.MultiIndex.from_product([[SCORER], list(pose), ['x', 'y', 'likelihood']], names = ['scorer', 'bodyparts', 'coords'])
+    return pd.DataFrame(np.hstack(list(pose.values())), columns = columns)
+
+## Write simulated pose as DeepLabCut CSV export with three header rows
+## Arguments
+## path: CSV file to write
+## pose: dictionary from simulate_pose()
+def write_dlc_csv(path, pose):
+    pose_frame(pose).to_csv(path, float_format = '%.4f')
+
+## Write simulated pose as DeepLabCut table-format H5 export
+## Arguments
+## path: H5 file to write
+## pose: dictionary from simulate_pose()
+def write_dlc_h5(path, pose):
+    pose_frame(pose).to_hdf(path, key = 'df_with_missing', format = 'table', mode = 'w')
+
+## Write a serial log of arduino_code.ino for a session following SPEED_TIMES
+## The session starts with the first video frame at start milliseconds of the Arduino clock
+## Arguments
+## path  : log file to write
+## frames: number of video frames
+## fps   : video frame rate
+## start : Arduino clock at session start in milliseconds
+## sync  : interval of sync pulses in milliseconds
+def write_treadmill_log(path, frames, fps = 30.0, start = 1000, sync = 5000):
+    end     = start + int(round(frames * 1000 / fps))
+    events  = [(start, 'START SESSION button, millis = {millis}'), (start, 'trigTime, millis={millis}')]
+    events += [(start + int(round(time * 1000)), 'motorVal=' + str(value) + ', millis = {millis}')
+               for time, value in zip(SPEED_TIMES, MOTOR_VALUES) if start + time * 1000 < end]
+    events += [(millis, 'syncOut, millis = {millis}') for millis in range(start, end, sync)]
+    encoder = np.arange(start + ENCODER_INTERVAL, end, ENCODER_INTERVAL)
+    speeds  = SPEEDS[np.searchsorted(SPEED_TIMES, (encoder - start) / 1000, side = 'right') - 1]
+    clicks  = np.round(speeds * CLICKS_PER_METER / 60 * ENCODER_INTERVAL / 1000).astype(int)
+    events += [(millis, 'dy=' + str(dy) + ', millis={millis}') for millis, dy in zip(encoder, clicks)]
+    events += [(end, 'END session button, millis={millis}')]
+    with open(path, 'w', newline = '') as handle:
+        handle.write('programName=synthetic\r\nisButtonStart=1\r\nEND HEADER\r\n')
+        for millis, line in sorted(events, key = lambda event: event[0]):
+            handle.write(line.format(millis = millis) + '\r\n')
+
+## Generate a synthetic cohort of sessions on disk
+## Mice improve over days, and the last third of days are recorded in reverse direction
+## Arguments
+## directory: folder to write files to, one subfolder per mouse
+## mice     : number of mice
+## days     : number of training days per mouse
+## frames   : number of video frames per session
+## fps      : video frame rate
+## fmt      : 'csv' or 'h5' format of DeepLabCut exports
+## seed     : random seed
+## logs     : flag to write a treadmill log of every session as sixth database element, and track
+##            its sync pulses as 'led' body part named by a seventh database element
+## Returns database dictionary in the format of mouse_coordination_metrics.py, with paths relative to directory
+def make_cohort(directory, mice = 4, days = 12, frames = 360 * 30, fps = 30.0, fmt = 'csv', seed = 0, logs = False):
+    rng      = np.random.default_rng(seed)
+    database = {}
+    for mouse in range(mice):
+        mouse_id = 'M{mouse:03d}'.format(mouse = mouse + 1)
+        os.makedirs(os.path.join(directory, mouse_id), exist_ok = True)
+        baseline = rng.uniform(0.1, 0.6)
+        database[mouse_id] = {}
+        for day in range(days):
+            day_id  = 'd{day:02d}'.format(day = day + 1)
+            skill   = min(1.0, baseline + 0.4 * day / max(days - 1, 1) + rng.normal(0, 0.05))
+            reverse = day >= days - days // 3
+            pose    = simulate_pose(frames, fps, max(skill, 0.0), reverse, seed = rng.integers(2 ** 32))
+            if logs:
+                pose['led'] = simulate_led(frames, fps)
+
+            raw_file      = mouse_id + '/' + mouse_id + '-TMday' + day_id[1:] + '.' + fmt
+            analyzed_file = mouse_id + '/' + day_id + '.csv'
+            if fmt == 'h5':
+                write_dlc_h5(os.path.join(directory, raw_file), pose)
+            else:
+                write_dlc_csv(os.path.join(directory, raw_file), pose)
+            ## Step length file is written by steplength_analysis.py from the export, like for real sessions
+            stream_analyze(os.path.join(directory, raw_file), os.path.join(directory, analyzed_file))
+            database[mouse_id][day_id] = [analyzed_file, raw_file, None, reverse]
+            if logs:
+                log_file = mouse_id + '/' + day_id + '.log'
+                write_treadmill_log(os.path.join(directory, log_file), frames, fps)
+                database[mouse_id][day_id] += [None, log_file, 'led']
+    return database
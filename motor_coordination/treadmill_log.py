@@ -0,0 +1,202 @@
+##
+## treadmill_log.py
+## Mouse Motor Coordination
+##
+## Parse serial logs written by arduino_code.ino and align video frames to the treadmill schedule
+## The log is read in large blocks and each block is parsed with array operations on its bytes,
+## without a Python loop over lines. frame_index() maps every video frame to the log clock,
+## the motor value, the belt speed and the speed section, so sectioning a session is a single
+## array lookup that follows the logged protocol instead of the fixed SECTIONS schedule
+##
+
+import numpy as np
+
+## Event lines of arduino_code.ino by line prefix, each ending in the Arduino clock in milliseconds
+## dy=<clicks>, millis=<ms>             : rotary encoder displacement of the belt
+## motorVal=<pwm>, millis = <ms>        : motor speed change
+## syncOut, millis = <ms>               : onset of a sync pulse, also shown by the video sync LED
+## START SESSION button, millis = <ms>  : session start, motor runs at its default value
+## END session button, millis=<ms>      : session end, motor stopped
+EVENTS = [b'dy=', b'motorVal=', b'syncOut', b'START SESSION', b'END session']
+ENCODER, MOTOR, SYNC, START, END = range(len(EVENTS))
+
+## Powers of ten of the digits of an int64 number
+POWERS = 10 ** np.arange(19, dtype = np.int64)
+
+## Number of bytes parsed per block
+BLOCK_SIZE = 2 ** 24
+
+## Default motor value of arduino_code.ino from session start until the first motor change
+DEFAULT_MOTOR = 64
+
+## Motor values of arduino_code.ino and the section of SPEED_NAMES each one drives the belt at
+## Frames at other motor values, or outside the session, are not part of any section. The motor falls
+## back to DEFAULT_MOTOR between and after the protocol steps, so frames at DEFAULT_MOTOR only count
+## for its section from the first time it is set, e.g. by START SESSION, until the motor value changes
+MOTOR_SECTIONS = {64: 0, 98: 1, 122: 2, 156: 3, 190: 4}
+
+## Version of the frame sectioning, bump to recompute sessions sectioned by a log after changing it
+LOG_VERSION = 2
+
+## Encoder clicks per meter of belt, 900 clicks per 23 inches of wheel circumference
+CLICKS_PER_METER = 900 / (23 * 0.0254)
+
+## Parse the event lines of a block of complete log lines
+## Every run of digits is converted to a number at once, the first number of a line is its value
+## and the last number its time
+## Arguments
+## data: bytes ending with a newline
+## Returns (events,) arrays of event index in EVENTS, value and time in milliseconds
+def parse_block(data):
+    buf    = np.frombuffer(data, dtype = np.uint8)
+    ends   = np.flatnonzero(buf == ord('\n'))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    ## Classify lines by comparing their first bytes with each event prefix
+    padded = np.concatenate((buf, np.zeros(max(map(len, EVENTS)), dtype = np.uint8)))
+    kind   = np.full(len(starts), -1, dtype = np.int64)
+    for code, prefix in enumerate(EVENTS):
+        match = np.ones(len(starts), dtype = bool)
+        for offset, byte in enumerate(prefix):
+            match &= padded[starts + offset] == byte
+        kind[match] = code
+
+    ## Sum digits of each run weighted by their power of ten, negative after a minus sign
+    digit  = (buf >= ord('0')) & (buf <= ord('9'))
+    edges  = np.diff(digit.astype(np.int8), prepend = np.int8(0), append = np.int8(0))
+    first  = np.flatnonzero(edges == 1)
+    last   = np.flatnonzero(edges == -1)
+    length = last - first
+    places = np.flatnonzero(digit)
+    run    = np.repeat(np.arange(len(first)), length)
+    digits = (buf[places] - ord('0')) * POWERS[np.minimum(last[run] - places - 1, len(POWERS) - 1)]
+    number = np.add.reduceat(digits, np.cumsum(length) - length) if len(places) else np.zeros(0, dtype = np.int64)
+    number = np.where(buf[np.maximum(first - 1, 0)] == ord('-'), -number, number)
+
+    ## Take first and last number of each event line
+    count  = np.bincount(np.searchsorted(ends, first), minlength = len(starts))[:len(starts)]
+    final  = np.cumsum(count) - 1
+    events = (kind >= 0) & (count > 0)
+    return kind[events], number[(final - count + 1)[events]], number[final[events]]
+
+## Read the events of a treadmill log
+## Arguments
+## path      : serial log of arduino_code.ino
+## block_size: number of bytes read and parsed at once
+## Returns dictionary of session start and end, sync pulse times, motor change times and values,
+## and encoder times and clicks, all in milliseconds of the Arduino clock
+def read_log(path, block_size = BLOCK_SIZE):
+    ## Parse whole blocks, carrying the unfinished last line of each block over to the next
+    blocks = []
+    tail   = b''
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            block = tail + block
+            cut   = block.rfind(b'\n') + 1
+            blocks.append(parse_block(block[:cut]))
+            tail  = block[cut:]
+    blocks.append(parse_block(tail + b'\n'))
+    kind, values, millis = (np.concatenate(column) for column in zip(*blocks))
+
+    ## Keep events of the first session in the log
+    starts = millis[kind == START]
+    start  = starts[0] if len(starts) else (millis[0] if len(millis) else 0)
+    ends   = millis[(kind == END) & (millis >= start)]
+    end    = ends[0] if len(ends) else (millis[-1] if len(millis) else start)
+    inside = (millis >= start) & (millis <= end)
+    return {'start'         : int(start),
+            'end'           : int(end),
+            'sync'          : millis[inside & (kind == SYNC)],
+            'motor_time'    : millis[inside & (kind == MOTOR)],
+            'motor_value'   : values[inside & (kind == MOTOR)],
+            'encoder_time'  : millis[inside & (kind == ENCODER)],
+            'encoder_clicks': values[inside & (kind == ENCODER)]}
+
+## Find frames where the video sync LED turns on
+## Arguments
+## signal   : (frames,) brightness or tracking likelihood of the sync LED in each frame
+## threshold: level separating LED on from off, None for halfway between the lowest and highest level
+## Returns frame indices of rising edges
+def pulse_onsets(signal, threshold = None):
+    signal    = np.asarray(signal, dtype = np.float64)
+    threshold = (np.nanmin(signal) + np.nanmax(signal)) / 2 if threshold is None else threshold
+    high      = signal > threshold
+    return np.flatnonzero(high[1:] & ~high[:-1]) + 1
+
+## Arduino clock time of each video frame
+## The camera is triggered at session start and assumed to run at a constant frame rate. With sync pulse
+## frames, each LED onset is paired with the logged pulse nearest to its time on that clock, and the clock
+## is fitted to the pairs, which corrects both the offset and the drift of the camera clock. Onsets further
+## than half a pulse interval from any pulse, e.g. a pulse already on in the first frame, are left out
+## Arguments
+## log        : dictionary from read_log()
+## n_frames   : number of video frames
+## fps        : video frame rate
+## sync_frames: frame indices of sync pulse onsets, e.g. from pulse_onsets(), None to use the session start
+## Returns (frames,) times in milliseconds
+def frame_clock(log, n_frames, fps, sync_frames = None):
+    frames = np.arange(n_frames, dtype = np.float64)
+    clock  = log['start'] + frames * 1000.0 / fps
+    if sync_frames is None or len(sync_frames) < 2 or len(log['sync']) < 2:
+        return clock
+
+    onsets   = np.asarray(sync_frames, dtype = np.float64)
+    pulses   = log['sync'].astype(np.float64)
+    expected = log['start'] + onsets * 1000.0 / fps
+    nearest  = np.clip(np.searchsorted(pulses, expected), 1, len(pulses) - 1)
+    nearest  = np.where(expected - pulses[nearest - 1] < pulses[nearest] - expected, nearest - 1, nearest)
+    paired   = np.abs(pulses[nearest] - expected) < np.median(np.diff(pulses)) / 2
+    if len(np.unique(nearest[paired])) < 2:
+        return clock
+    slope, intercept = np.polyfit(onsets[paired], pulses[nearest[paired]], 1)
+    return intercept + slope * frames
+
+## Map every video frame to the treadmill state
+## Arguments
+## log           : dictionary from read_log()
+## n_frames      : number of video frames
+## fps           : video frame rate
+## sync_frames   : frame indices of sync pulse onsets, see frame_clock()
+## motor_sections: dictionary of motor value to section index
+## Returns dictionary of (frames,) arrays: Arduino clock in milliseconds, motor value (0 outside the session),
+## belt speed in m/min from the encoder (NaN without encoder events) and section (-1 outside sections)
+def frame_index(log, n_frames, fps, sync_frames = None, motor_sections = MOTOR_SECTIONS):
+    clock   = frame_clock(log, n_frames, fps, sync_frames)
+    running = (clock >= log['start']) & (clock < log['end'])
+
+    ## Motor value in effect at a frame is the last one set at or before it
+    times  = np.concatenate(([log['start']], log['motor_time']))
+    values = np.concatenate(([DEFAULT_MOTOR], log['motor_value']))
+    event  = np.searchsorted(times, clock, side = 'right') - 1
+    motor  = np.where(running & (event >= 0), values[np.maximum(event, 0)], 0)
+
+    ## Sections are looked up in a table indexed by motor value
+    table = np.full(max(list(motor_sections) + [DEFAULT_MOTOR]) + 1, -1, dtype = np.int64)
+    table[list(motor_sections)] = list(motor_sections.values())
+    known   = (motor >= 0) & (motor < len(table))
+    section = np.where(known, table[np.clip(motor, 0, len(table) - 1)], -1)
+
+    ## Only the first run of frames at the default motor value is part of its section
+    default = np.flatnonzero(motor == DEFAULT_MOTOR)
+    if len(default):
+        begin   = event[default[0]]
+        changed = np.flatnonzero((values != DEFAULT_MOTOR) & (np.arange(len(values)) > begin))
+        first   = (event >= begin) & (event < (changed[0] if len(changed) else len(values)))
+        section = np.where((motor == DEFAULT_MOTOR) & ~first, -1, section)
+
+    ## Belt speed is the slope of the cumulative encoder position at the frame times
+    speed = np.full(n_frames, np.nan)
+    if len(log['encoder_time']) >= 2 and n_frames >= 2:
+        position = np.interp(clock, log['encoder_time'], np.cumsum(log['encoder_clicks']))
+        speed    = np.gradient(position, clock / 1000.0) / CLICKS_PER_METER * 60
+    return {'millis': clock, 'motor': motor, 'speed': speed, 'section': section}
+
+## Speed section of every video frame of a session from its treadmill log
+## Arguments
+## log_file   : serial log of arduino_code.ino
+## n_frames   : number of video frames
+## fps        : video frame rate
+## sync_frames: frame indices of sync pulse onsets, see frame_clock()
+## Returns (frames,) section of each frame, -1 outside sections
+def log_sections(log_file, n_frames, fps, sync_frames = None):
+    return frame_index(read_log(log_file), n_frames, fps, sync_frames)['section']
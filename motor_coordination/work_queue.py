@@ -0,0 +1,508 @@
+##
+## work_queue.py
+## Mouse Motor Coordination
+##
+## Resumable work queue of per-session tasks in a folder on shared storage, without a central service
+## enqueue() writes one task file per manifest session whose results are not cached in mice_data.hdf5.
+## Any number of work() processes on any machine mounting the folder claim tasks with exclusive lease
+## files, refresh the lease while the session runs and write each result atomically under the task name.
+## Failed tasks are retried up to MAX_ATTEMPTS times and leases of crashed workers expire after
+## LEASE_TIMEOUT seconds, so a crash only loses the session that was running. merge() stores finished
+## results in mice_data.hdf5 and mice_metrics.hdf5 like mouse_coordination_metrics.main() and can be
+## run again while tasks are still pending
+##
+## Queue folder layout
+## tasks/<task>.json   : session entry and analysis options
+## leases/<task>.lease : owner and claim time, the modification time is the heartbeat
+## results/<task>.npz  : metrics, box corners, cache keys and optional drift, record and pose columns
+## failures/<task>.json: number of failed attempts and the last error
+##
+
+from contextlib import ExitStack
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+import traceback
+import numpy as np
+import h5py
+
+from .box_corners import DRIFT_TOLERANCE, estimate_corners
+from .manifest import read_manifest, read_rigs
+from .mouse_coordination_metrics import FRAME_RATE, rigs, finalize_store, pick_corners, report_sessions, run_session, session_fps, session_keys, \
+    store_session
+from .metrics_store import create_store, session_index
+from .pose_archive import has_pose
+from .result_cache import cache_key, is_cached, stored_digests
+from .instrumentation import write_attribute
+from .steplength_analysis import preprocess
+
+## Default queue folder
+QUEUE_DIRECTORY = 'queue'
+
+## Queue folders and the extension of the task files in each
+FOLDERS = {'tasks': '.json', 'leases': '.lease', 'results': '.npz', 'failures': '.json'}
+
+## Seconds without heartbeat after which a lease is taken over by another worker
+## Workers sharing a queue need clocks synchronized well within this timeout
+LEASE_TIMEOUT = 600.0
+
+## Number of failed attempts after which a task is no longer retried
+MAX_ATTEMPTS = 3
+
+## Seconds an idle worker waits before looking for claimable tasks again
+POLL_INTERVAL = 30.0
+
+## Path of a task file in one of the queue folders
+def queue_path(queue, folder, name):
+    return os.path.join(queue, folder, name + FOLDERS[folder])
+
+## Name of a temporary file next to path that is unique across machines sharing the folder
+def temporary_path(path):
+    return path + '.' + socket.gethostname() + '.' + str(os.getpid()) + '.tmp'
+
+## Write a JSON file atomically, readers see either the old or the new file
+def write_json(path, value):
+    temporary = temporary_path(path)
+    with open(temporary, 'w') as handle:
+        json.dump(value, handle)
+    os.replace(temporary, path)
+
+## Read a JSON file, None if it does not exist
+def read_json(path):
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return None
+
+## List task names in a queue folder, skipping temporary files
+def list_tasks(queue, folder):
+    extension = FOLDERS[folder]
+    names     = os.listdir(os.path.join(queue, folder)) if os.path.isdir(os.path.join(queue, folder)) else []
+    return sorted(name[:-len(extension)] for name in names if name.endswith(extension))
+
+## Name of the task of a session, readable session keys followed by a hash of the task options
+def task_name(mouse, day, spec):
+    readable = re.sub(r'[^A-Za-z0-9_.-]', '_', mouse + '__' + day)
+    return readable + '__' + cache_key([], task = spec)[:12]
+
+## Arguments of a database entry as stored in a task, with NumPy box corners and flags as plain lists and values
+def task_args(args):
+    return [value.tolist() if isinstance(value, (np.ndarray, np.generic)) else value for value in args]
+
+## Remove a task file if it exists
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+## Write one task per session of a cohort that is not cached in mice_data.hdf5
+## Tasks of an earlier enqueue() that are still wanted keep their results, failures and leases,
+## tasks of sessions that were merged or changed since are removed
+## Arguments
+## queue      : queue folder on shared storage
+## cohort     : dictionary in the format of database, e.g. from manifest.read_manifest()
+## interactive: flag to pick box corners on images here, workers never open a window
+## analyze    : flag to let workers compute step length files that are older than their raw file first
+## method     : smoothing method of step length files
+## instrument : flag to record per-session stage timing and frame counts
+## archive    : flag to archive float32 pose columns of analyzed sessions
+## force      : flag to recompute every session and drop results and failures of earlier runs
+## rig_corners: dictionary in the format of rigs, None for rigs
+## data_file  : hdf5 file with cached session metrics
+## fps        : video frame rate of sessions without their own
+## Returns list of task names in the queue
+def enqueue(queue, cohort, interactive = False, analyze = False, method = 'lowess', instrument = False, archive = False,
+            force = False, rig_corners = None, data_file = 'mice_data.hdf5', fps = FRAME_RATE):
+    rig_corners = rigs if rig_corners is None else rig_corners
+    for folder in FOLDERS:
+        os.makedirs(os.path.join(queue, folder), exist_ok = True)
+
+    names = []
+    with ExitStack() as stack:
+        mice_data = stack.enter_context(h5py.File(data_file, 'r')) if os.path.exists(data_file) else {}
+        for mouse, days in cohort.items():
+            for day, args in days.items():
+                data_key       = mouse + '/' + day + '/' + 'metrics'
+                box_corner_key = mouse + '/' + day + '/' + 'box'
+                file, raw_file, corners, reverse = args[:4]
+                rig    = args[4] if len(args) > 4 else None
+                stale  = analyze and file is not None and (not os.path.exists(file) or os.path.getmtime(file) < os.path.getmtime(raw_file))
+                spec   = {'mouse': mouse, 'day': day, 'args': task_args(args), 'fallback': rig_corners.get(rig), 'interactive': bool(interactive),
+                          'analyze': bool(analyze and file is not None), 'method': method, 'instrument': bool(instrument), 'archive': bool(archive),
+                          'fps': session_fps(args, fps)}
+                name   = task_name(mouse, day, spec)
+                task   = queue_path(queue, 'tasks', name)
+
+                ## Skip sessions cached from the same inputs, unless the step length file has to be computed first
+                box_value = None
+                if not stale and (file is None or os.path.exists(file)):
+                    box_value, metrics_value, _ = session_keys(args, interactive, stored_digests(mice_data, data_key), rig_corners, fps)
+                    if not force and is_cached(mice_data, data_key, metrics_value) and (not archive or has_pose(mice_data, mouse, day)):
+                        continue
+                names.append(name)
+                if force:
+                    remove_file(queue_path(queue, 'results', name))
+                    remove_file(queue_path(queue, 'failures', name))
+                elif os.path.exists(task):
+                    continue
+
+                ## Pass cached or picked box corners with the key they were resolved from
+                ## The box key does not depend on the step length file, which may not exist yet
+                if box_value is None:
+                    box_value = session_keys([None] + list(args[1:]), interactive, stored_digests(mice_data, data_key), rig_corners)[0]
+                if not force and is_cached(mice_data, box_corner_key, box_value):
+                    spec.update(corners = mice_data[box_corner_key][...].tolist(), box_key = box_value)
+                elif isinstance(corners, str) and interactive:
+                    spec.update(corners = np.asarray(pick_corners(corners)).tolist(), box_key = box_value)
+                write_json(task, spec)
+
+    ## Remove tasks that are no longer wanted with their results and failures
+    ## Leases are left to their workers, a result written after removal is removed by the next enqueue()
+    for name in set(list_tasks(queue, 'tasks') + list_tasks(queue, 'results') + list_tasks(queue, 'failures')) - set(names):
+        for folder in ['tasks', 'results', 'failures']:
+            remove_file(queue_path(queue, folder, name))
+    return names
+
+## Claim a task by creating its lease file exclusively
+## A lease whose heartbeat is older than timeout is taken over with take_over()
+## Arguments
+## queue  : queue folder
+## name   : task name
+## owner  : worker name stored in the lease
+## timeout: seconds after which a lease is stale
+## Returns True if the task was claimed
+def claim(queue, name, owner, timeout = LEASE_TIMEOUT):
+    path  = queue_path(queue, 'leases', name)
+    lease = {'owner': owner, 'time': time.time()}
+    try:
+        descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return take_over(path, lease, timeout)
+    with os.fdopen(descriptor, 'w') as handle:
+        json.dump(lease, handle)
+    return True
+
+## Take over a stale lease
+## Workers that find the same stale lease compete for an exclusive takeover token named after its
+## modification time. The winner swaps in its own lease only if the lease still has that modification
+## time, so a lease renewed by its owner or claimed again by another worker in the meantime is never taken,
+## and reads the lease back to check it holds it. Tokens left by crashed workers expire after timeout
+## Arguments
+## path   : lease file
+## lease  : owner and claim time of the new lease
+## timeout: seconds after which a lease is stale
+## Returns True if the lease was taken over
+def take_over(path, lease, timeout):
+    try:
+        generation = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    if time.time() - generation / 1e9 < timeout:
+        return False
+    token = path + '.' + str(generation) + '.takeover'
+    try:
+        os.close(os.open(token, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        try:
+            if time.time() - os.stat(token).st_mtime > timeout:
+                os.remove(token)
+        except FileNotFoundError:
+            pass
+        return False
+
+    ## The new lease is written under a temporary name and renamed over the stale one,
+    ## so the lease file never disappears and no plain claim() can slip in
+    temporary = temporary_path(path)
+    try:
+        write_json(temporary, lease)
+        try:
+            current = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            current = None
+        if current != generation:
+            return False
+        os.replace(temporary, path)
+    finally:
+        remove_file(temporary)
+        remove_file(token)
+    try:
+        return read_json(path) == lease
+    except ValueError:
+        return False
+
+## Remove a lease if it is still held by owner
+def release(queue, name, owner):
+    path  = queue_path(queue, 'leases', name)
+    lease = None
+    try:
+        lease = read_json(path)
+    except ValueError:
+        pass
+    if lease is not None and lease.get('owner') == owner:
+        remove_file(path)
+
+## Refresh modification time of a lease until stop is set
+## Arguments
+## path    : lease file
+## stop    : threading.Event set when the task finished
+## interval: seconds between heartbeats
+def heartbeat(path, stop, interval):
+    while not stop.wait(interval):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+## Run the session of a task
+## Arguments
+## spec: task dictionary written by enqueue()
+## Returns metrics matrix, box corners, (box key, metrics key, input digests), drift, record and pose columns
+def run_task(spec):
+    args = spec['args']
+    file, raw_file, corners, reverse = args[:4]
+    rig  = args[4] if len(args) > 4 else None
+    log  = args[5] if len(args) > 5 else None
+    sync = args[6] if len(args) > 6 else None
+    fps  = spec.get('fps', FRAME_RATE)
+    if isinstance(corners, list):
+        ## Box corners given in the database are stored in the task as nested lists
+        corners = np.array(corners)
+    if spec['analyze']:
+        preprocess(raw_file, file, method = spec['method'])
+
+    ## Keys are computed after the step length file is written, so they hash the file the metrics are computed from
+    keys  = session_keys(args, spec['interactive'], None, {rig: spec['fallback']}, fps)
+    drift = None
+    if spec.get('corners') is not None and spec.get('box_key') == keys[0]:
+        corners = np.array(spec['corners'])
+    elif isinstance(corners, str) and spec['interactive']:
+        raise ValueError('Box corner image of ' + spec['mouse'] + ' ' + spec['day'] + ' changed since it was picked, enqueue the session again')
+    elif isinstance(corners, str):
+        corners, drift = estimate_corners(raw_file, spec['fallback'])
+    results, box_corners, record, pose = run_session(file, raw_file, corners, reverse, spec['instrument'], spec['archive'], log, sync, fps)
+    return results, box_corners, keys, drift, record, pose
+
+## Write the result of a task atomically
+## Arguments
+## path: result file
+## results, box_corners, keys, drift, record, pose: run_task() results
+def write_result(path, results, box_corners, keys, drift = None, record = None, pose = None):
+    arrays = {'results': results, 'box_corners': box_corners, 'keys': np.array(json.dumps(keys))}
+    if drift is not None:
+        arrays['drift'] = drift
+    if record is not None:
+        arrays['record'] = np.array(json.dumps(record))
+    for column, values in (pose or {}).items():
+        arrays['pose_' + column] = values
+    temporary = temporary_path(path)
+    with open(temporary, 'wb') as handle:
+        np.savez(handle, **arrays)
+    os.replace(temporary, path)
+
+## Read the result of a task
+## path: result file
+## Returns dictionary with the arguments of write_result()
+def read_result(path):
+    with np.load(path) as arrays:
+        pose = {name[5:]: arrays[name] for name in arrays.files if name.startswith('pose_')}
+        return {'results'    : arrays['results'],
+                'box_corners': arrays['box_corners'],
+                'keys'       : tuple(json.loads(str(arrays['keys']))),
+                'drift'      : arrays['drift'] if 'drift' in arrays.files else None,
+                'record'     : json.loads(str(arrays['record'])) if 'record' in arrays.files else None,
+                'pose'       : pose if pose else None}
+
+## Number of failed attempts of a task
+def failed_attempts(queue, name):
+    failure = read_json(queue_path(queue, 'failures', name))
+    return failure['attempts'] if failure else 0
+
+## List tasks without result that have not failed attempts times
+def pending_tasks(queue, attempts = MAX_ATTEMPTS):
+    done = set(list_tasks(queue, 'results'))
+    return [name for name in list_tasks(queue, 'tasks') if name not in done and failed_attempts(queue, name) < attempts]
+
+## Run tasks of a queue until none is left to claim
+## Any number of workers can run on any machine mounting the queue folder
+## Arguments
+## queue   : queue folder
+## owner   : worker name stored in leases and failures, None for host name and process ID
+## timeout : seconds without heartbeat after which leases of other workers are taken over
+## attempts: number of failed attempts after which a task is no longer retried
+## poll    : seconds to wait while the remaining tasks are leased by other workers
+## wait    : flag to wait for leased tasks to finish or expire, False to return when nothing can be claimed
+## Returns number of tasks this worker finished
+def work(queue, owner = None, timeout = LEASE_TIMEOUT, attempts = MAX_ATTEMPTS, poll = POLL_INTERVAL, wait = True):
+    owner    = owner or socket.gethostname() + ':' + str(os.getpid())
+    finished = 0
+    while True:
+        pending = pending_tasks(queue, attempts)
+        if not pending:
+            return finished
+
+        ## Start at a random task so workers starting together do not contend for the same lease
+        random.shuffle(pending)
+        name = next((name for name in pending if claim(queue, name, owner, timeout)), None)
+        if name is None:
+            if not wait:
+                return finished
+            time.sleep(poll)
+            continue
+
+        stop   = threading.Event()
+        beat   = threading.Thread(target = heartbeat, args = (queue_path(queue, 'leases', name), stop, timeout / 4), daemon = True)
+        result = queue_path(queue, 'results', name)
+        beat.start()
+        try:
+            ## Another worker may have finished the task after it was listed, or enqueue() removed it
+            spec = read_json(queue_path(queue, 'tasks', name))
+            if spec is None or os.path.exists(result):
+                continue
+            write_result(result, *run_task(spec))
+            finished += 1
+        except Exception:
+            failure = {'attempts': failed_attempts(queue, name) + 1, 'owner': owner, 'time': time.time(), 'error': traceback.format_exc()}
+            write_json(queue_path(queue, 'failures', name), failure)
+            print('Task {name} failed on attempt {attempts}: {error}'.format(name = name, attempts = failure['attempts'],
+                                                                             error = failure['error'].strip().splitlines()[-1]))
+        finally:
+            stop.set()
+            beat.join()
+            release(queue, name, owner)
+
+## Count tasks of a queue by state
+## Returns dictionary with the number of tasks, done, leased, pending and failed tasks, and the failed task names
+def queue_status(queue, attempts = MAX_ATTEMPTS):
+    tasks   = list_tasks(queue, 'tasks')
+    done    = set(list_tasks(queue, 'results')) & set(tasks)
+    leased  = set(list_tasks(queue, 'leases')) & set(tasks) - done
+    failed  = [name for name in tasks if name not in done and failed_attempts(queue, name) >= attempts]
+    return {'tasks': len(tasks), 'done': len(done), 'leased': len(leased), 'failed': len(failed),
+            'pending': len(tasks) - len(done) - len(failed), 'failed_tasks': failed}
+
+## Let workers retry failed tasks
+## Arguments
+## queue: queue folder
+## names: task names to retry, None for every failed task
+## Returns list of task names whose failures were cleared
+def retry(queue, names = None):
+    names = list_tasks(queue, 'failures') if names is None else names
+    for name in names:
+        remove_file(queue_path(queue, 'failures', name))
+    return names
+
+## Store finished results of a queue in mice_data.hdf5 and mice_metrics.hdf5
+## Results of tasks whose session changed in the cohort since they were enqueued are skipped,
+## and so are results that are already stored, so merge() can run again as more tasks finish
+## Arguments
+## queue     : queue folder
+## cohort    : dictionary in the format of database, the same as passed to enqueue()
+## tolerance : corner drift in pixels above which a session is reported for manual review
+## instrument: None, or 'jsonl' or 'hdf5' to store instrumentation records like main()
+## fps       : video frame rate of sessions without their own, the same as passed to enqueue()
+## prune     : flag to remove stored sessions that are not in cohort
+## Returns list of merged (mouse, day) sessions and list of sessions whose box corners drift more than tolerance
+def merge(queue, cohort, tolerance = DRIFT_TOLERANCE, instrument = None, fps = FRAME_RATE, prune = False):
+    merged  = []
+    records = []
+    with ExitStack() as stack:
+        mice_data    = stack.enter_context(h5py.File('mice_data.hdf5', 'a'))
+        mice_metrics = stack.enter_context(h5py.File('mice_metrics.hdf5', 'a'))
+        create_store(mice_metrics)
+        index = session_index(mice_metrics)
+
+        for name in list_tasks(queue, 'results'):
+            spec = read_json(queue_path(queue, 'tasks', name))
+            if spec is None or task_args(cohort.get(spec['mouse'], {}).get(spec['day'], [])) != spec['args']:
+                continue
+            mouse, day = spec['mouse'], spec['day']
+            result     = read_result(queue_path(queue, 'results', name))
+            data_key   = mouse + '/' + day + '/' + 'metrics'
+            if is_cached(mice_data, data_key, result['keys'][1]) and (result['pose'] is None or has_pose(mice_data, mouse, day)):
+                continue
+            store_session(mice_data, mice_metrics, index, mouse, day, result['results'], result['box_corners'], result['keys'],
+                          result['drift'], result['pose'])
+            merged.append((mouse, day))
+
+            ## Keep instrumentation record of session
+            record = result['record']
+            if record is not None and instrument is not None:
+                record.update(mouse = mouse, day = day)
+                records.append(record)
+                if instrument == 'hdf5':
+                    write_attribute(mice_data[data_key], record)
+
+        flagged = finalize_store(mice_data, mice_metrics, index, cohort, tolerance, fps, prune)
+
+    report_sessions(records, flagged, tolerance, instrument)
+    return merged, flagged
+
+## Command line entry point
+## argv: list of arguments, None for sys.argv
+def cli(argv = None):
+    parser = argparse.ArgumentParser(description = 'Analyze manifest sessions with workers on several machines sharing a queue folder')
+    parser.add_argument('--queue', default = QUEUE_DIRECTORY, help = 'queue folder on storage shared by every worker')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    command = commands.add_parser('enqueue', help = 'write a task for every session that is not cached')
+    command.add_argument('manifest', help = 'CSV file with one row per session, see manifest.py')
+    command.add_argument('--rigs', default = None, help = 'JSON file of rig name to fallback box corners')
+    command.add_argument('--pick', action = 'store_true', help = 'pick box corners on images by hand before queueing')
+    command.add_argument('--analyze', action = 'store_true', help = 'compute outdated step length files in the workers first')
+    command.add_argument('--method', choices = ['lowess', 'savgol'], default = 'lowess', help = 'smoothing method of step length files')
+    command.add_argument('--instrument', action = 'store_true', help = 'record per-session stage timing and frame counts')
+    command.add_argument('--archive', action = 'store_true', help = 'archive float32 pose columns of analyzed sessions')
+    command.add_argument('--force', action = 'store_true', help = 'recompute every session and drop earlier results')
+    command.add_argument('--fps', type = float, default = FRAME_RATE, help = 'video frame rate of sessions without an fps in the manifest')
+
+    command = commands.add_parser('work', help = 'run tasks until none is left to claim')
+    command.add_argument('--timeout', type = float, default = LEASE_TIMEOUT, help = 'seconds after which leases of silent workers expire')
+    command.add_argument('--attempts', type = int, default = MAX_ATTEMPTS, help = 'failed attempts after which a task is given up')
+    command.add_argument('--poll', type = float, default = POLL_INTERVAL, help = 'seconds between looks for claimable tasks')
+    command.add_argument('--no-wait', action = 'store_true', help = 'exit when the remaining tasks are leased by other workers')
+
+    command = commands.add_parser('merge', help = 'store finished results in mice_data.hdf5 and mice_metrics.hdf5')
+    command.add_argument('manifest', help = 'CSV file the tasks were enqueued from')
+    command.add_argument('--tolerance', type = float, default = DRIFT_TOLERANCE, help = 'corner drift in pixels reported for manual review')
+    command.add_argument('--instrument', choices = ['jsonl', 'hdf5'], default = None, help = 'store instrumentation records of merged sessions')
+    command.add_argument('--fps', type = float, default = FRAME_RATE, help = 'video frame rate passed to enqueue')
+    command.add_argument('--prune', action = 'store_true', help = 'remove stored sessions that are not in the manifest')
+
+    command = commands.add_parser('status', help = 'count tasks by state')
+    command.add_argument('--attempts', type = int, default = MAX_ATTEMPTS, help = 'failed attempts after which a task is given up')
+
+    commands.add_parser('retry', help = 'clear failures so given up tasks are run again')
+
+    args = parser.parse_args(argv)
+    if args.command == 'enqueue':
+        rig_corners = read_rigs(args.rigs) if args.rigs else None
+        names = enqueue(args.queue, read_manifest(args.manifest), args.pick, args.analyze, args.method, args.instrument, args.archive,
+                        args.force, rig_corners, fps = args.fps)
+        print('Queued {count} sessions in {queue}'.format(count = len(names), queue = args.queue))
+    elif args.command == 'work':
+        finished = work(args.queue, None, args.timeout, args.attempts, args.poll, not args.no_wait)
+        print('Finished {count} tasks'.format(count = finished))
+    elif args.command == 'merge':
+        merged, _ = merge(args.queue, read_manifest(args.manifest), args.tolerance, args.instrument, args.fps, args.prune)
+        print('Merged {count} sessions'.format(count = len(merged)))
+        status = queue_status(args.queue)
+        if status['pending'] or status['failed']:
+            print('{pending} tasks pending and {failed} failed, merge again when they finished'.format(**status))
+    elif args.command == 'status':
+        status = queue_status(args.queue, args.attempts)
+        print('{tasks} tasks: {done} done, {leased} leased, {pending} pending, {failed} failed'.format(**status))
+        for name in status['failed_tasks']:
+            failure = read_json(queue_path(args.queue, 'failures', name))
+            print(name + ': ' + failure['error'].strip().splitlines()[-1])
+    else:
+        print('Retrying {count} tasks'.format(count = len(retry(args.queue))))
+
+if __name__ == '__main__':
+    cli()
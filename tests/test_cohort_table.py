@@ -0,0 +1,32 @@
+##
+## test_cohort_table.py
+## Mouse Motor Coordination
+##
+## Regression tests of the long-format cohort table
+##
+
+import numpy as np
+import h5py
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from motor_coordination.cohort_table import export_table, iter_mouse_scores, score_table
+from motor_coordination.metrics_store import create_store, write_session
+
+## Numeric mouse names keep their leading zeros and are scored like any other name
+def test_numeric_mouse_names(tmp_path):
+    rng = np.random.default_rng(0)
+    with h5py.File(tmp_path / 'mice_metrics.hdf5', 'w') as mice_metrics:
+        create_store(mice_metrics)
+        for mouse in ['01', '02', '10']:
+            for day in ['d01', 'd02']:
+                write_session(mice_metrics, mouse, day, rng.random((5, 6)))
+        export_table(mice_metrics, str(tmp_path / 'table'))
+
+    score_table(str(tmp_path / 'table'), str(tmp_path / 'scores'))
+    scores = dict(iter_mouse_scores(str(tmp_path / 'scores')))
+    assert sorted(scores) == ['01', '02', '10']
+    for frame in scores.values():
+        assert list(frame.columns) == ['d01', 'd02']
+        assert frame.shape == (5, 2) and frame.notna().all().all()
@@ -0,0 +1,26 @@
+##
+## test_deeplabcut_loader.py
+## Mouse Motor Coordination
+##
+## Regression tests of the DeepLabCut loader
+##
+
+import os
+import numpy as np
+
+from motor_coordination import deeplabcut_loader
+from motor_coordination.deeplabcut_loader import load_columns, sidecar_path
+from motor_coordination.synthetic_sessions import simulate_pose, write_dlc_csv
+
+## Files in folders the sidecar cannot be written to are still loaded
+def test_load_without_writable_sidecar(tmp_path, monkeypatch):
+    path = str(tmp_path / 'session.csv')
+    write_dlc_csv(path, simulate_pose(100))
+    def denied(*args, **kwargs):
+        raise PermissionError('read-only folder')
+    monkeypatch.setattr(deeplabcut_loader.np, 'savez', denied)
+
+    frame = load_columns(path, ['head_x', 'head_y'])
+    assert frame.shape == (100, 2) and np.isfinite(frame.to_numpy()).all()
+    assert os.listdir(tmp_path) == ['session.csv']
+    assert not os.path.exists(sidecar_path(path))
@@ -0,0 +1,100 @@
+##
+## test_mouse_coordination_metrics.py
+## Mouse Motor Coordination
+##
+## Regression tests of session metrics on synthetic sessions
+##
+
+import contextlib
+import io
+import os
+import numpy as np
+import h5py
+
+from motor_coordination.deeplabcut_loader import load_pose
+from motor_coordination.metrics_store import session_index
+from motor_coordination.mouse_coordination_metrics import main, metrics, process_session, resolve_corners, session_keys
+from motor_coordination.online_metrics import score_stream, simulate_serial
+from motor_coordination.steplength_analysis import stream_analyze
+from motor_coordination.synthetic_sessions import CORNER_PARTS, make_cohort, simulate_pose, write_dlc_csv
+
+## Metrics from the analyzed file written by steplength_analysis.py equal metrics computed from the raw export
+def test_metrics_matches_process_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = make_cohort(str(tmp_path), mice = 1, days = 1, frames = 340 * 30)
+    _, raw_file, corners, reverse = database['M001']['d01']
+    analyzed_file = os.path.join('M001', 'analyzed.csv')
+    stream_analyze(raw_file, analyzed_file)
+
+    expected, expected_corners = process_session(raw_file, corners, reverse)
+    result, result_corners     = metrics(analyzed_file, raw_file, corners, reverse)
+    np.testing.assert_allclose(result, expected, rtol = 1e-6)
+    np.testing.assert_array_equal(result_corners, expected_corners)
+
+    ## Metric files are named after the analyzed file, not cut at the first underscore of its path
+    assert os.path.exists(os.path.join('M001', 'analyzed_quadrant_expectation.csv'))
+
+## Box corners averaged from the corner tracks are recomputed when the raw file changes under a warm cache
+def test_box_corners_follow_raw_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = make_cohort(str(tmp_path), mice = 1, days = 1, frames = 340 * 30)
+    raw_file = database['M001']['d01'][1]
+    with contextlib.redirect_stdout(io.StringIO()):
+        main(cohort = database)
+
+        ## Re-export the session with the box 20 pixels further right
+        pose = simulate_pose(340 * 30, seed = 1)
+        for name in CORNER_PARTS:
+            pose[name][:, 0] += 20
+        write_dlc_csv(raw_file, pose)
+        main(cohort = database)
+
+    with h5py.File('mice_data.hdf5', 'r') as mice_data:
+        box = mice_data['M001/d01/box'][...]
+    np.testing.assert_array_equal(box, resolve_corners(None, load_pose(raw_file, CORNER_PARTS)))
+
+## Sessions recorded at another frame rate are sectioned by it in both code paths and cached under their own key
+def test_metrics_follow_frame_rate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = make_cohort(str(tmp_path), mice = 1, days = 1, frames = 340 * 30)
+    _, raw_file, corners, reverse = database['M001']['d01']
+    analyzed_file = os.path.join('M001', 'analyzed.csv')
+    stream_analyze(raw_file, analyzed_file)
+
+    expected, _ = process_session(raw_file, corners, reverse, 15.0)
+    result, _   = metrics(analyzed_file, raw_file, corners, reverse, fps = 15.0)
+    np.testing.assert_allclose(result, expected, rtol = 1e-6)
+    assert not np.allclose(result, metrics(analyzed_file, raw_file, corners, reverse)[0], equal_nan = True)
+
+    args = [analyzed_file, raw_file, corners, reverse]
+    assert session_keys(args, False)[1] != session_keys(args, False, fps = 15.0)[1]
+    assert session_keys(args, False, fps = 15.0)[1] == session_keys(args + [None, None, None, 15.0], False)[1]
+
+## Sessions missing from a partial manifest stay stored unless pruning is asked for
+def test_partial_manifest_keeps_sessions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = make_cohort(str(tmp_path), mice = 2, days = 1, frames = 340 * 30)
+    partial  = {'M001': database['M001']}
+    with contextlib.redirect_stdout(io.StringIO()):
+        main(cohort = database)
+        main(cohort = partial)
+        with h5py.File('mice_metrics.hdf5', 'r') as mice_metrics:
+            assert sorted(session_index(mice_metrics)) == [('M001', 'd01'), ('M002', 'd01')]
+
+        main(cohort = partial, prune = True)
+    with h5py.File('mice_metrics.hdf5', 'r') as mice_metrics, h5py.File('mice_data.hdf5', 'r') as mice_data:
+        assert sorted(session_index(mice_metrics)) == [('M001', 'd01')]
+        assert 'M002' not in mice_data
+
+## Online metrics of a session replayed as serial lines equal metrics() of the recorded session
+def test_online_metrics_match_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = make_cohort(str(tmp_path), mice = 1, days = 1, frames = 340 * 30)
+    _, raw_file, _, reverse = database['M001']['d01']
+    analyzed_file = os.path.join('M001', 'analyzed.csv')
+    stream_analyze(raw_file, analyzed_file)
+    box_corners = resolve_corners(None, load_pose(raw_file, CORNER_PARTS)).mean(axis = 1, keepdims = True)
+
+    expected, _ = metrics(analyzed_file, raw_file, box_corners, reverse)
+    result, _   = score_stream(simulate_serial(raw_file, box_corners), reverse = reverse)
+    np.testing.assert_allclose(result, expected, rtol = 1e-6)
@@ -0,0 +1,66 @@
+##
+## test_mouse_coordination_score.py
+## Mouse Motor Coordination
+##
+## Regression tests of the vectorized bootstrap against per-replicate loops
+##
+
+import numpy as np
+
+from motor_coordination.mouse_coordination_score import bootstrap_scores, replicate_scores, score_sessions
+
+## Small cohort of 3 mice with 4 recorded days out of 5, and the sessions scored against it
+def small_cohort():
+    rng       = np.random.default_rng(0)
+    cohort    = np.round(rng.random((6, 5, 12)) * 10, 1)
+    sessions  = cohort.transpose(2, 1, 0)
+    positions = [(mouse, day) for mouse in range(3) for day in range(4)]
+    return cohort, sessions, positions
+
+## Scores of one replicate are the scores against the cohort sessions repeated by their multiplicities
+def loop_scores(cohort, sessions, positions, multiplicities):
+    return np.array([score_sessions(np.repeat(cohort, drawn, axis = 2), sessions, positions, 3, 5) for drawn in multiplicities])
+
+## Resampled scores of all replicates at once equal scoring each replicate in a loop
+def test_replicate_scores_match_loop():
+    cohort, sessions, positions = small_cohort()
+    multiplicities = np.random.default_rng(1).multinomial(12, np.full(12, 1 / 12), size = 20)
+    np.testing.assert_array_equal(replicate_scores(cohort, sessions, positions, 3, 5, multiplicities),
+                                  loop_scores(cohort, sessions, positions, multiplicities))
+
+## Bootstrap counts and cohort mean bounds with a fixed seed equal a loop over the same draws
+def test_bootstrap_scores_match_loop():
+    cohort, sessions, positions = small_cohort()
+    result = bootstrap_scores(cohort, sessions, positions, 3, 5, replicates = 30, confidence = 0.9, chunk = 30, seed = 7)
+
+    ## bootstrap_chunk() draws cohort sessions and then mice from the first spawned seed
+    rng            = np.random.default_rng(np.random.SeedSequence(7).spawn(1)[0])
+    multiplicities = rng.multinomial(12, np.full(12, 1 / 12), size = 30)
+    mice           = rng.multinomial(3, np.full(3, 1 / 3), size = 30)
+    scores         = loop_scores(cohort, sessions, positions, multiplicities)
+    counts         = np.stack([np.count_nonzero(scores == score, axis = 0) for score in range(1, 6)], axis = -1)
+    np.testing.assert_array_equal(result['score_counts'], counts)
+
+    means = []
+    for replicate in range(30):
+        weights = mice[replicate][:, None] * np.array([True] * 4 + [False])
+        with np.errstate(invalid = 'ignore'):
+            means.append(np.einsum('md,msd->sd', weights, scores[replicate]) / weights.sum(axis = 0))
+    bounds = np.nanpercentile(np.array(means)[:, :, :4], [5, 95], axis = 0)
+    np.testing.assert_allclose(result['mean_low'][:, :4], bounds[0])
+    np.testing.assert_allclose(result['mean_high'][:, :4], bounds[1])
+    assert np.isnan(result['mean_low'][:, 4]).all()
+
+## Lower bounds never exceed upper bounds, and higher confidence levels widen the intervals
+def test_confidence_bounds_are_ordered():
+    cohort, sessions, positions = small_cohort()
+    results = [bootstrap_scores(cohort, sessions, positions, 3, 5, replicates = 50, confidence = confidence, chunk = 20)
+               for confidence in [0.5, 0.9, 0.99]]
+    for result in results:
+        assert (result['score_low'] <= result['score_high']).all()
+        assert (result['mean_low'][:, :4] <= result['mean_high'][:, :4]).all()
+        assert (result['day_low'][:4] <= result['day_high'][:4]).all()
+    for narrow, wide in zip(results[:-1], results[1:]):
+        assert (wide['score_low'] <= narrow['score_low']).all() and (wide['score_high'] >= narrow['score_high']).all()
+        assert (wide['mean_low'][:, :4] <= narrow['mean_low'][:, :4]).all()
+        assert (wide['mean_high'][:, :4] >= narrow['mean_high'][:, :4]).all()
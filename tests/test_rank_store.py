@@ -0,0 +1,52 @@
+##
+## test_rank_store.py
+## Mouse Motor Coordination
+##
+## Regression tests of incremental scoring against persistent ranks
+##
+
+import numpy as np
+import h5py
+
+from motor_coordination.metrics_store import create_store, prune_sessions, read_metrics, session_index, write_session
+from motor_coordination.mouse_coordination_score import score_sessions
+from motor_coordination.rank_store import incremental_scores
+
+## Scores of every stored session computed from scratch
+def full_scores(mice_metrics):
+    index     = session_index(mice_metrics)
+    mice_keys = sorted({mouse for mouse, day in index})
+    mice_days = {mouse: sorted(day for key_mouse, day in index if key_mouse == mouse) for mouse in mice_keys}
+    cohort    = read_metrics(mice_metrics)
+    sessions  = np.array([cohort[:, :, index[(mouse, day)]].T for mouse in mice_keys for day in mice_days[mouse]])
+    positions = [(index1, index2) for index1, mouse in enumerate(mice_keys) for index2 in range(len(mice_days[mouse]))]
+    return score_sessions(cohort, sessions, positions, len(mice_keys), max([12] + [len(days) for days in mice_days.values()]))
+
+## Incremental scores equal a full recompute while sessions are added, changed and removed
+def test_incremental_scores_match_full_recompute(tmp_path):
+    rng = np.random.default_rng(0)
+    def session():
+        results = np.round(rng.random((5, 6)) * 10, 1)
+        if rng.random() < 0.1:
+            results[rng.integers(5), rng.integers(6)] = np.nan
+        return results
+
+    with h5py.File(tmp_path / 'mice_metrics.hdf5', 'w') as mice_metrics:
+        create_store(mice_metrics)
+        for mouse in range(3):
+            for day in range(4):
+                write_session(mice_metrics, 'M%d' % mouse, 'D%02d' % day, session())
+        for step in range(12):
+            index = session_index(mice_metrics)
+            if step % 3 == 0:
+                write_session(mice_metrics, 'M%d' % rng.integers(4), 'D%02d' % rng.integers(8), session())
+            elif step % 3 == 1:
+                mouse, day = list(index)[rng.integers(len(index))]
+                write_session(mice_metrics, mouse, day, session())
+            else:
+                prune_sessions(mice_metrics, set(list(index)[1:]))
+            scores = incremental_scores(mice_metrics, path = str(tmp_path / 'mice_ranks.hdf5'))[5]
+            np.testing.assert_array_equal(scores, full_scores(mice_metrics))
+
+        ## Scoring again without changes reports no changed mice
+        assert incremental_scores(mice_metrics, path = str(tmp_path / 'mice_ranks.hdf5'))[6] == set()
@@ -0,0 +1,61 @@
+##
+## test_treadmill_log.py
+## Mouse Motor Coordination
+##
+## Regression tests of treadmill log parsing and frame sectioning on hand-written logs
+##
+
+import numpy as np
+
+from motor_coordination.mouse_coordination_metrics import FRAME_RATE, SECTIONS, section_labels
+from motor_coordination.synthetic_sessions import write_treadmill_log
+from motor_coordination.treadmill_log import ENCODER, END, MOTOR, START, SYNC, frame_clock, log_sections, parse_block, read_log
+
+## Protocol of arduino_code.ino: the motor runs at its default value from session start,
+## and falls back to it after each step and after the last one
+LOG = '\r\n'.join(['programName=treadmill',
+                   'END HEADER',
+                   'START SESSION button, millis = 1000',
+                   'trigTime, millis=1000',
+                   'syncOut, millis = 1000',
+                   'dy=-3, millis=1500',
+                   'motorVal=98, millis = 4000',
+                   'motorVal=64, millis = 5000',
+                   'motorVal=122, millis = 6000',
+                   'motorVal=64, millis = 7000',
+                   'syncOut, millis = 8000',
+                   'END session button, millis=9000']) + '\r\n'
+
+## Lines are classified by prefix, with the first number as value and the last number as time
+def test_parse_block():
+    kind, values, millis = parse_block(LOG.encode())
+    assert kind.tolist()   == [START, SYNC, ENCODER, MOTOR, MOTOR, MOTOR, MOTOR, SYNC, END]
+    assert values[kind == ENCODER].tolist() == [-3]
+    assert values[kind == MOTOR].tolist()   == [98, 64, 122, 64]
+    assert millis.tolist() == [1000, 1000, 1500, 4000, 5000, 6000, 7000, 8000, 9000]
+
+## Frames are timed from the session start, or fitted to the logged pulses of the sync LED
+def test_frame_clock(tmp_path):
+    path = tmp_path / 'log.txt'
+    path.write_text(LOG)
+    log = read_log(str(path))
+    np.testing.assert_allclose(frame_clock(log, 4, 2.0), [1000, 1500, 2000, 2500])
+
+    ## A camera running 1% fast sees the pulse at 8000 ms in frame 14.14 instead of 14
+    clock = frame_clock(log, 20, 2.0, [0, 14.14])
+    np.testing.assert_allclose(clock[[0, 14]], [1000, 1000 + 14 * 7000 / 14.14])
+
+## Frames at the default motor value only count as the first section before the first step
+def test_log_sections(tmp_path):
+    path = tmp_path / 'log.txt'
+    path.write_text(LOG)
+    sections = log_sections(str(path), 10, 1.0)
+    assert sections.tolist() == [0, 0, 0, 1, -1, 2, -1, -1, -1, -1]
+
+## The synthetic log follows the fixed SECTIONS schedule until its last section ends
+def test_synthetic_log_matches_sections(tmp_path):
+    frames = int(SECTIONS[-1] * FRAME_RATE)
+    write_treadmill_log(str(tmp_path / 'log.txt'), frames)
+    expected = section_labels(np.arange(frames) / FRAME_RATE, [frames], SECTIONS)
+    sections = log_sections(str(tmp_path / 'log.txt'), frames, FRAME_RATE)
+    assert (sections == expected).mean() > 0.999
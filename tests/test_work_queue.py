@@ -0,0 +1,95 @@
+##
+## test_work_queue.py
+## Mouse Motor Coordination
+##
+## Regression tests of lease claiming and task files of the shared work queue
+##
+
+import os
+import threading
+import time
+import numpy as np
+
+from motor_coordination import work_queue
+from motor_coordination.synthetic_sessions import make_cohort
+from motor_coordination.work_queue import claim, enqueue, heartbeat, queue_path, read_json, release, run_task
+
+## Make the lease file of a task look like its owner stopped age seconds ago
+def age_lease(path, age):
+    stale = time.time() - age
+    os.utime(path, (stale, stale))
+
+## A task is claimed by one worker until its owner releases it
+def test_claim(tmp_path):
+    os.makedirs(tmp_path / 'leases')
+    assert claim(str(tmp_path), 'task', 'a')
+    assert not claim(str(tmp_path), 'task', 'b')
+    assert read_json(queue_path(str(tmp_path), 'leases', 'task'))['owner'] == 'a'
+
+    release(str(tmp_path), 'task', 'b')
+    assert not claim(str(tmp_path), 'task', 'b')
+    release(str(tmp_path), 'task', 'a')
+    assert claim(str(tmp_path), 'task', 'b')
+
+## Heartbeats keep the lease of a running task fresh
+def test_heartbeat_renews_lease(tmp_path):
+    os.makedirs(tmp_path / 'leases')
+    path = queue_path(str(tmp_path), 'leases', 'task')
+    assert claim(str(tmp_path), 'task', 'a')
+    age_lease(path, 100)
+
+    stop   = threading.Event()
+    thread = threading.Thread(target = heartbeat, args = (path, stop, 0.01))
+    thread.start()
+    time.sleep(0.2)
+    stop.set()
+    thread.join()
+    assert time.time() - os.stat(path).st_mtime < 10
+    assert not claim(str(tmp_path), 'task', 'b', timeout = 10)
+
+## A lease without heartbeat for longer than the timeout is taken over by another worker
+def test_take_over_expired_lease(tmp_path):
+    os.makedirs(tmp_path / 'leases')
+    path = queue_path(str(tmp_path), 'leases', 'task')
+    assert claim(str(tmp_path), 'task', 'a')
+    age_lease(path, 100)
+    assert claim(str(tmp_path), 'task', 'b', timeout = 10)
+    assert read_json(path)['owner'] == 'b'
+    assert os.listdir(tmp_path / 'leases') == ['task.lease']
+
+## A stale lease renewed by its owner while another worker takes it over is not stolen
+def test_renewed_lease_is_not_stolen(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'leases')
+    path = queue_path(str(tmp_path), 'leases', 'task')
+    assert claim(str(tmp_path), 'task', 'a')
+    age_lease(path, 100)
+
+    ## The owner sends a heartbeat after the taking worker checked the lease is stale
+    write_json = work_queue.write_json
+    def renew_then_write(target, value):
+        os.utime(path)
+        write_json(target, value)
+    monkeypatch.setattr(work_queue, 'write_json', renew_then_write)
+    assert not claim(str(tmp_path), 'task', 'b', timeout = 10)
+    assert read_json(path)['owner'] == 'a'
+    assert os.listdir(tmp_path / 'leases') == ['task.lease']
+
+## Box corners given as NumPy arrays are queued as lists and passed back to the metrics as arrays
+def test_enqueue_array_corners(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database = make_cohort(str(tmp_path), mice = 1, days = 1, frames = 340 * 30)
+    corners  = np.array([[10.0, 190.0], [10.0, 10.0], [390.0, 10.0], [390.0, 190.0]])
+    database['M001']['d01'][2] = corners
+    names = enqueue('queue', database)
+    spec  = read_json(queue_path('queue', 'tasks', names[0]))
+    assert spec['args'][2] == corners.tolist()
+    assert enqueue('queue', database) == names
+
+    calls = []
+    def run_session(*args):
+        calls.append(args)
+        return None, None, None, None
+    monkeypatch.setattr(work_queue, 'run_session', run_session)
+    run_task(spec)
+    assert isinstance(calls[0][2], np.ndarray)
+    np.testing.assert_array_equal(calls[0][2], corners)